@@ -0,0 +1,100 @@
+"""
+Start up time and publish latency of the Robot NATS backends.
+
+Needs a NATS server, by default on 127.0.0.1:4222. Start up is the time
+from Robot.connect() until `up` goes True. Publish latency is measured by a
+separate subscriber in this process, from Robot.publish() until the message
+arrives back from the server.
+"""
+
+import argparse
+import asyncio
+import struct
+import threading
+import time
+
+import kivy.clock
+import nats.aio.client
+
+from sissyBot.robot import Robot
+from sissyBot.stats import RollingWindow
+
+STAMP = struct.Struct("=d")
+SUBJECT = "bench.latency"
+
+
+class Listener:
+    def __init__(self, addr, count):
+        self.latencies = RollingWindow(count)
+        self.count = count
+        self.done = threading.Event()
+        self.ready = threading.Event()
+        self.thread = threading.Thread(target=asyncio.run, args=(self.main(addr),))
+        self.thread.daemon = True
+        self.thread.start()
+        self.ready.wait()
+
+    async def main(self, addr):
+        nc = nats.aio.client.Client()
+        await nc.connect(addr)
+
+        async def on_msg(msg):
+            now = time.perf_counter()
+            self.latencies.add(now - STAMP.unpack(msg.data)[0])
+            if len(self.latencies) >= self.count:
+                self.done.set()
+
+        await nc.subscribe(SUBJECT, cb=on_msg)
+        await nc.flush()
+        self.ready.set()
+
+        while not self.done.is_set():
+            await asyncio.sleep(0.05)
+        await nc.close()
+
+
+def wait_for(pred, timeout=10):
+    deadline = time.monotonic() + timeout
+    while not pred():
+        if time.monotonic() > deadline:
+            raise TimeoutError()
+        kivy.clock.Clock.tick()
+
+
+def bench(backend, host, port, count, interval):
+    robot = Robot(backend=backend)
+
+    start = time.perf_counter()
+    robot.connect(host, port)
+    wait_for(lambda: robot.up)
+    startup = time.perf_counter() - start
+
+    listener = Listener(f"{host}:{port}", count)
+    for _ in range(count):
+        robot.publish(SUBJECT, STAMP.pack(time.perf_counter()))
+        time.sleep(interval)
+    listener.done.wait(10)
+
+    robot.close()
+
+    pcts = listener.latencies.percentiles(50, 90, 99)
+    print(
+        f"{backend:>8}: start up {startup * 1e3:7.1f}ms  publish "
+        + "  ".join(f"p{pct} {value * 1e6:7.1f}us" for pct, value in pcts.items())
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", default=4222, type=int)
+    parser.add_argument("--count", default=2000, type=int)
+    parser.add_argument("--interval", default=0.0005, type=float)
+    args = parser.parse_args()
+
+    for backend in ("process", "thread"):
+        bench(backend, args.host, args.port, args.count, args.interval)
+
+
+if __name__ == "__main__":
+    main()
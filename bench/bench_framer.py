@@ -0,0 +1,91 @@
+"""
+Frames/sec of net.Framer against the old bytes concatenation functions.
+
+Each burst of drive packets arrives in 4096 byte reads, the same size
+PacketProcessor.recv_fn reads from the socket.
+"""
+
+import time
+
+import sissyBot.errors as errors
+import sissyBot.net as net
+import sissyBot.proto.packet_pb2 as packet_pb2
+
+READ_SIZE = 4096
+BURSTS = (1, 10, 100, 1000)
+MIN_TIME = 0.5
+
+
+# The framing functions net.py used before Framer, kept here as the baseline.
+def legacy_contains_pkt(buff):
+    if not len(buff):
+        return False
+
+    len_ = int.from_bytes(buff[:1], byteorder="big", signed=False)
+
+    if not len_:
+        raise errors.BadStreamError()
+
+    return len(buff) - 1 >= len_
+
+
+def legacy_get_1st_pkt(buff):
+    len_ = int.from_bytes(buff[:1], byteorder="big", signed=False)
+    buff = buff[1:]
+    return buff[:len_], buff[len_:]
+
+
+def legacy_run(reads):
+    frames = 0
+    accum_buff = b""
+    for buff in reads:
+        accum_buff += buff
+        while legacy_contains_pkt(accum_buff):
+            _, accum_buff = legacy_get_1st_pkt(accum_buff)
+            frames += 1
+    return frames
+
+
+def framer_run(reads, framer=net.Framer()):
+    frames = 0
+    for buff in reads:
+        framer.feed(buff)
+        for _ in framer.frames():
+            frames += 1
+    return frames
+
+
+def make_reads(count):
+    stream = bytearray()
+    for idx in range(count):
+        pkt = packet_pb2.Packet()
+        pkt.drive.heading = idx % 360
+        pkt.drive.throttle = 0.5
+        stream += net.insert_pkt_len(pkt.SerializeToString())
+
+    stream = bytes(stream)
+    return [stream[i : i + READ_SIZE] for i in range(0, len(stream), READ_SIZE)]
+
+
+def frames_per_sec(fn, reads, count):
+    runs = 0
+    start = time.perf_counter()
+    while True:
+        assert fn(reads) == count
+        runs += 1
+        elapsed = time.perf_counter() - start
+        if elapsed > MIN_TIME:
+            return runs * count / elapsed
+
+
+def main():
+    print(f"{'burst':>6} {'legacy f/s':>14} {'framer f/s':>14} {'speedup':>8}")
+    for count in BURSTS:
+        reads = make_reads(count)
+        legacy = frames_per_sec(legacy_run, reads, count)
+        framer = frames_per_sec(framer_run, reads, count)
+        print(f"{count:>6} {legacy:>14,.0f} {framer:>14,.0f} {framer / legacy:>7.2f}x")
+
+
+if __name__ == "__main__":
+    main()
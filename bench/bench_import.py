@@ -0,0 +1,90 @@
+"""
+Import time of each entry point, from `python -X importtime`.
+
+Each module is imported in a fresh interpreter `--runs` times and the best
+cumulative time is kept. Exits non-zero if an entry point goes over its
+budget, or pulls in a module it shouldn't, e.g. Kivy in the server. Budgets
+are for a desktop machine, scale them with --scale on slower ones.
+"""
+
+import argparse
+import os
+import re
+import subprocess
+import sys
+
+# name -> (module, budget in ms, modules it must not import)
+ENTRY_POINTS = {
+    "sbs": ("sissyBot.server", 250, ("kivy", "snoop", "nats", "numpy")),
+    "nats worker": ("sissyBot.nats_conn", 300, ("kivy", "snoop")),
+    "robot": ("sissyBot.robot", 300, ("snoop", "nats")),
+    "net": ("sissyBot.net", 200, ("kivy", "snoop", "nats", "numpy")),
+}
+
+LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)")
+
+
+def import_times(module):
+    """
+    Returns ({module: cumulative us} for everything `module` imported, its
+    own cumulative us). Start up imports like site aren't included.
+    """
+    env = dict(os.environ, KIVY_NO_CONSOLELOG="1", KIVY_NO_ARGS="1")
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True,
+        env=env,
+        check=True,
+    )
+
+    # children are printed before their parent, so the module's imports are
+    # the indented lines just above its own
+    lines = [LINE.match(line) for line in result.stderr.splitlines()]
+    lines = [match for match in lines if match]
+    end = next(i for i, match in enumerate(lines) if match.group(4) == module)
+    start = end
+    while start and lines[start - 1].group(3) != " ":
+        start -= 1
+
+    times = {
+        match.group(4): (len(match.group(3)), int(match.group(2)))
+        for match in lines[start:end]
+    }
+    return times, int(lines[end].group(2))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--runs", default=5, type=int)
+    parser.add_argument("--scale", default=1.0, type=float)
+    args = parser.parse_args()
+
+    failed = False
+    for name, (module, budget, banned) in ENTRY_POINTS.items():
+        runs = [import_times(module) for _ in range(args.runs)]
+        times, best = min(runs, key=lambda run: run[1])
+        budget *= args.scale
+
+        loaded = sorted(mod for mod in times if mod in banned)
+        # direct imports of the module
+        slowest = sorted(
+            ((us, mod) for mod, (depth, us) in times.items() if depth == 3),
+            reverse=True,
+        )[:3]
+
+        ok = best / 1000 <= budget and not loaded
+        failed |= not ok
+        print(
+            f"{'ok' if ok else 'FAIL':>4} {name:>12}: {best / 1000:6.1f}ms "
+            f"(budget {budget:.0f}ms)  biggest: "
+            + ", ".join(f"{mod} {us / 1000:.1f}ms" for us, mod in slowest)
+        )
+        if loaded:
+            print(f"{'':>18} imports {', '.join(loaded)}")
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""
+GUI -> NATS process latency of the Pipe and shared memory transports.
+
+Mirrors what NatsProc does in the child, without a NATS server: the Pipe
+consumer waits on recv() in the default executor, the ring consumer waits
+on its doorbell. Each message carries its send time, the child reports
+the one way latency percentiles.
+"""
+
+import asyncio
+import multiprocessing
+import struct
+import time
+
+from sissyBot.nats_proc import PubCmd
+from sissyBot.shm_ring import ShmRing
+from sissyBot.stats import RollingWindow
+
+COUNT = 2000
+INTERVAL = 0.0005
+STAMP = struct.Struct("=d")
+
+
+def report(name, latencies):
+    pcts = latencies.percentiles(50, 90, 99)
+    print(
+        f"{name:>5}: "
+        + "  ".join(f"p{pct} {value * 1e6:7.1f}us" for pct, value in pcts.items())
+    )
+
+
+def pipe_consumer(proc_end, result_end):
+    async def main():
+        loop = asyncio.get_running_loop()
+        latencies = RollingWindow(COUNT)
+        for _ in range(COUNT):
+            cmd = await loop.run_in_executor(None, proc_end.recv)
+            latencies.add(time.perf_counter() - STAMP.unpack(cmd.payload)[0])
+        result_end.send(latencies)
+
+    asyncio.run(main())
+
+
+def ring_consumer(ring, result_end):
+    async def main():
+        loop = asyncio.get_running_loop()
+        wake = asyncio.Event()
+        loop.add_reader(ring.doorbell_recv.fileno(), wake.set)
+
+        latencies = RollingWindow(COUNT)
+        while len(latencies) < COUNT:
+            ring.clear_doorbell()
+            for _, payload in ring.drain():
+                latencies.add(time.perf_counter() - STAMP.unpack(payload)[0])
+            await wake.wait()
+            wake.clear()
+        result_end.send(latencies)
+
+    asyncio.run(main())
+    ring.close()
+
+
+def run_pipe():
+    gui_end, proc_end = multiprocessing.Pipe()
+    result_recv, result_send = multiprocessing.Pipe(False)
+    proc = multiprocessing.Process(target=pipe_consumer, args=(proc_end, result_send))
+    proc.start()
+    time.sleep(0.5)
+
+    for _ in range(COUNT):
+        cmd = PubCmd()
+        cmd.subject = "drive.cmd"
+        cmd.payload = STAMP.pack(time.perf_counter())
+        gui_end.send(cmd)
+        time.sleep(INTERVAL)
+
+    report("pipe", result_recv.recv())
+    proc.join()
+
+
+def run_ring():
+    ring = ShmRing()
+    result_recv, result_send = multiprocessing.Pipe(False)
+    proc = multiprocessing.Process(target=ring_consumer, args=(ring, result_send))
+    proc.start()
+    time.sleep(0.5)
+
+    for _ in range(COUNT):
+        while not ring.put(b"drive.cmd", STAMP.pack(time.perf_counter())):
+            time.sleep(0)
+        time.sleep(INTERVAL)
+
+    report("shm", result_recv.recv())
+    proc.join()
+    ring.close()
+    ring.unlink()
+
+
+if __name__ == "__main__":
+    run_pipe()
+    run_ring()
@@ -0,0 +1,149 @@
+"""
+Replays a touch trace through float_joy.JoyPad and reports the time and
+memory each move costs.
+
+A trace is a text file of "x y" lines in widget coordinates: the first is
+the touch down, the rest are moves, then the touch goes up. Without --trace
+a drive-like one is made up: engage, sweep round the pad past its edge and
+back in, with a little jitter. Each replay runs once for time, then again
+under tracemalloc for the bytes allocated during each move (the peak over
+what was live before it) and what is still held at the end.
+
+--per-frame N turns on coalesce_moves and ticks the Kivy clock after every
+N moves, as if that many touch events arrived each frame, and reports how
+many on_move dispatches that left.
+"""
+
+import argparse
+import math
+import random
+import time
+import tracemalloc
+
+from kivy.config import Config
+
+# frames are ticked by hand, don't sleep between them
+Config.set("graphics", "maxfps", "0")
+
+from kivy.clock import Clock  # noqa: E402
+
+from sissyBot.float_joy import JoyPad  # noqa: E402
+
+SIZE = 800
+
+
+class Touch:
+    """The parts of a MotionEvent JoyPad reads. Kivy reuses one per touch."""
+
+    def __init__(self, x, y):
+        self.x = x
+        self.y = y
+
+    @property
+    def pos(self):
+        return self.x, self.y
+
+
+def made_up_trace(moves):
+    rand = random.Random(1)
+    centre = SIZE / 2
+    trace = [(centre, centre)]
+    for i in range(moves):
+        theta = i / 60 * math.pi
+        rho = SIZE * 0.3 * (1 + math.sin(i / 45))
+        trace.append(
+            (
+                centre + math.cos(theta) * rho + rand.uniform(-2, 2),
+                centre + math.sin(theta) * rho + rand.uniform(-2, 2),
+            )
+        )
+    return trace
+
+
+def load_trace(path):
+    with open(path) as trace_file:
+        return [
+            tuple(float(v) for v in line.split()) for line in trace_file if line.strip()
+        ]
+
+
+def replay(pad, trace, on_move, per_frame=0):
+    touch = Touch(*trace[0])
+    pad.on_touch_down(touch)
+    for i, (x, y) in enumerate(trace[1:], 1):
+        touch.x = x
+        touch.y = y
+        on_move(touch)
+        if per_frame and not i % per_frame:
+            Clock.tick()
+    pad.on_touch_up(touch)
+
+
+def timed(pad, trace, per_frame):
+    times = []
+
+    def on_move(touch):
+        start = time.perf_counter_ns()
+        pad.on_touch_move(touch)
+        times.append(time.perf_counter_ns() - start)
+
+    replay(pad, trace, on_move, per_frame)
+    return times
+
+
+def traced(pad, trace, per_frame):
+    allocated = []
+
+    def on_move(touch):
+        before, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        pad.on_touch_move(touch)
+        allocated.append(tracemalloc.get_traced_memory()[1] - before)
+
+    tracemalloc.start()
+    start, _ = tracemalloc.get_traced_memory()
+    replay(pad, trace, on_move, per_frame)
+    held = tracemalloc.get_traced_memory()[0] - start
+    tracemalloc.stop()
+    return allocated, held
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--trace", help="file of 'x y' lines")
+    parser.add_argument("--moves", default=5000, type=int)
+    parser.add_argument("--runs", default=5, type=int)
+    parser.add_argument("--per-frame", default=0, type=int)
+    args = parser.parse_args()
+
+    trace = load_trace(args.trace) if args.trace else made_up_trace(args.moves)
+
+    pad = JoyPad(size=(SIZE, SIZE), coalesce_moves=args.per_frame > 0)
+
+    replay(pad, trace, pad.on_touch_move, args.per_frame)  # warm up
+    times = sorted(
+        min((timed(pad, trace, args.per_frame) for _ in range(args.runs)), key=sum)
+    )
+    allocated, held = traced(pad, trace, args.per_frame)
+
+    def pct(p):
+        return times[min(len(times) - 1, int(len(times) * p))] / 1000
+
+    replays = args.runs + 2
+    print(
+        f"{pad.raw_moves // replays} moves, "
+        f"{pad.moves_dispatched // replays} on_move each replay, "
+        f"{pad.raw_moves / pad.moves_dispatched:.1f} moves per on_move"
+    )
+    print(
+        f"per move: mean {sum(times) / len(times) / 1000:.1f}us "
+        f"p50 {pct(0.5):.1f}us p99 {pct(0.99):.1f}us max {times[-1] / 1000:.1f}us"
+    )
+    print(
+        f"allocated per move: mean {sum(allocated) / len(allocated):.0f}B "
+        f"max {max(allocated)}B, held after the replay {held}B"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+"""
+Drive frames through a Dispatcher with the drive handler printing each one,
+as it used to, against logging it through logs.QueueLogging.
+
+Output goes to a stream that takes `--write-us` per write, standing in for a
+terminal over SSH or journald, 0 for /dev/null. Cases:
+
+print: the old handler, print() on every frame.
+logging, direct: a StreamHandler on the root logger, no queue.
+logging, queued: logs.QueueLogging, no rate limit.
+logging, queued + rate limit: as sbs runs it.
+logging, level off: the debug records not wanted at all.
+
+Each reports frames/s through the handler and its p99 per frame, and for the
+queued cases how long the listener took to write out what was left after.
+"""
+
+import argparse
+import io
+import logging
+import os
+import sys
+import time
+
+import sissyBot.logs as logs
+import sissyBot.net as net
+import sissyBot.proto.packet_pb2 as packet_pb2
+import sissyBot.server as server
+import sissyBot.stats as stats
+
+
+class SlowStream(io.TextIOBase):
+    """Takes delay seconds per write, like a slow terminal."""
+
+    def __init__(self, sink, delay):
+        self.sink = sink
+        self.delay = delay
+        self.writes = 0
+
+    def write(self, text):
+        if self.delay:
+            deadline = time.perf_counter() + self.delay
+            while time.perf_counter() < deadline:
+                pass
+        self.writes += 1
+        return self.sink.write(text)
+
+    def flush(self):
+        # logging flushes every handler it ever had at exit
+        if not self.sink.closed:
+            self.sink.flush()
+
+
+def print_drive(drive, writer):
+    # server.handle_drive before it logged
+    l_motor, r_motor = server.motor_calc(drive)
+    print(
+        f"drive.heading: {drive.heading}, throttle: {drive.throttle}Motors:{l_motor}, {r_motor}"
+    )
+
+
+def drive_frames(frames):
+    pkt = packet_pb2.Packet()
+    buffs = []
+    for i in range(frames):
+        pkt.drive.heading = i % 360
+        pkt.drive.throttle = (i % 100) / 100
+        buffs.append(pkt.SerializeToString())
+    return buffs
+
+
+def run(handler, buffs):
+    disp = net.Dispatcher(logging.getLogger("bench"))
+    disp.handlers["drive"] = handler
+    latency = stats.Histogram()
+
+    start = time.perf_counter()
+    for buff in buffs:
+        frame_start = time.perf_counter_ns()
+        disp.dispatch((buff,), None)
+        latency.record(time.perf_counter_ns() - frame_start)
+    return len(buffs) / (time.perf_counter() - start), latency.percentile(99)
+
+
+def report(name, rate, p99, stream, drained=None):
+    line = f"{name:>30}: {rate:9.0f} frames/s  p99 {p99 / 1000:7.1f}us  "
+    line += f"{stream.writes:6} writes"
+    if drained is not None:
+        line += f"  drained in {drained:.3f}s"
+    print(line, file=sys.__stdout__)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--frames", default=20000, type=int)
+    parser.add_argument("--write-us", default=50.0, type=float)
+    args = parser.parse_args()
+
+    buffs = drive_frames(args.frames)
+    delay = args.write_us / 1e6
+
+    with open(os.devnull, "w") as sink:
+        stream = SlowStream(sink, delay)
+        sys.stdout = stream
+        try:
+            rate, p99 = run(print_drive, buffs)
+        finally:
+            sys.stdout = sys.__stdout__
+        report("print", rate, p99, stream)
+
+        stream = SlowStream(sink, delay)
+        handler = logging.StreamHandler(stream)
+        handler.setFormatter(logging.Formatter(logs.FORMAT))
+        root = logging.getLogger()
+        root.addHandler(handler)
+        logs.set_levels("info,drive handler=debug")
+        try:
+            rate, p99 = run(server.handle_drive, buffs)
+        finally:
+            root.removeHandler(handler)
+        report("logging, direct", rate, p99, stream)
+
+        for name, levels, rate_limit in (
+            ("logging, queued", "info,drive handler=debug", 0),
+            ("logging, queued + rate limit", "info,drive handler=debug", logs.RATE),
+            ("logging, level off", "info,drive handler=info", logs.RATE),
+        ):
+            stream = SlowStream(sink, delay)
+            handler = logging.StreamHandler(stream)
+            handler.setFormatter(logging.Formatter(logs.FORMAT))
+            log_queue = logs.QueueLogging([handler], levels=levels, rate=rate_limit)
+            log_queue.start()
+            try:
+                rate, p99 = run(server.handle_drive, buffs)
+            finally:
+                stop_start = time.perf_counter()
+                log_queue.stop()
+                drained = time.perf_counter() - stop_start
+            report(name, rate, p99, stream, drained)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+"""
+Connection accept rate and frame throughput under each event loop.
+
+Accepts: clients in this process open and close `--connections` connections,
+`--concurrency` at a time, against a server that hangs up straight away.
+Frames: a separate process, on the same loop, blasts drive frames at a
+PacketProcessor and PacketProtocol server.
+
+Loops that aren't installed are skipped.
+"""
+
+import argparse
+import asyncio
+import logging
+import multiprocessing
+import time
+
+import sissyBot.loops as loops
+import sissyBot.net as net
+import sissyBot.proto.packet_pb2 as packet_pb2
+
+HOST = "127.0.0.1"
+BATCH = 10
+
+
+async def accepts(count, concurrency):
+    async def client_cb(reader, writer):
+        writer.close()
+
+    server = await asyncio.start_server(client_cb, HOST, 0, backlog=concurrency)
+    port = server.sockets[0].getsockname()[1]
+
+    async def connect(n):
+        for _ in range(n):
+            reader, writer = await asyncio.open_connection(HOST, port)
+            await reader.read()
+            writer.close()
+
+    start = time.perf_counter()
+    await asyncio.gather(*(connect(count // concurrency) for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+
+    server.close()
+    await server.wait_closed()
+    return count // concurrency * concurrency / elapsed
+
+
+def sender(loop_name, port, frames):
+    async def send():
+        reader, writer, header, _ = await net.open_connection(HOST, port)
+
+        pkt = packet_pb2.Packet()
+        pkt.drive.heading = 90
+        pkt.drive.throttle = 0.5
+        chunk = net.insert_pkt_len(pkt.SerializeToString(), header) * BATCH
+
+        for _ in range(frames // BATCH):
+            writer.write(chunk)
+            await writer.drain()
+
+        await reader.read()
+        writer.close()
+
+    loops.run(send(), loop_name)
+
+
+async def frames(loop_name, receiver, count):
+    loop = asyncio.get_running_loop()
+    log = logging.getLogger("bench")
+    stop_event = asyncio.Event()
+    done = loop.create_future()
+    received = 0
+
+    def on_drive(frames, writer):
+        nonlocal received
+        received += len(frames)
+        if received >= count // BATCH * BATCH and not done.done():
+            done.set_result(None)
+
+    on_drive.handle_batch = on_drive
+
+    if receiver == "stream":
+
+        async def client_cb(reader, writer):
+            proc = net.PacketProcessor(reader, writer, stop_event, log)
+            proc.handlers["drive"] = on_drive
+            await proc.recv_fn()
+            writer.close()
+
+        server = await asyncio.start_server(client_cb, HOST, 0)
+    else:
+
+        def on_connect(proto):
+            proto.handlers["drive"] = on_drive
+            loop.create_task(proto.recv_fn())
+
+        server = await loop.create_server(
+            lambda: net.PacketProtocol(stop_event, log, on_connect=on_connect),
+            HOST,
+            0,
+        )
+
+    port = server.sockets[0].getsockname()[1]
+    client = multiprocessing.Process(target=sender, args=(loop_name, port, count))
+    client.start()
+
+    while not received:
+        await asyncio.sleep(0)
+    start = time.perf_counter()
+    first = received
+
+    await done
+    elapsed = time.perf_counter() - start
+
+    stop_event.set()
+    server.close()
+    await loop.run_in_executor(None, client.join)
+    return (received - first) / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--connections", default=5000, type=int)
+    parser.add_argument("--concurrency", default=50, type=int)
+    parser.add_argument("--frames", default=200000, type=int)
+    args = parser.parse_args()
+
+    for loop_name in ("asyncio", "uvloop"):
+        if loop_name != "asyncio" and loops.loop_factory(loop_name) is None:
+            print(f"{loop_name:>8}: not installed")
+            continue
+
+        rate = loops.run(accepts(args.connections, args.concurrency), loop_name)
+        print(f"{loop_name:>8}: {rate:8.0f} accepts/s")
+
+        for receiver in ("stream", "protocol"):
+            rate = loops.run(frames(loop_name, receiver, args.frames), loop_name)
+            print(f"{loop_name:>8}: {rate:8.0f} frames/s {receiver}")
+
+
+if __name__ == "__main__":
+    main()
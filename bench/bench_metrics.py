@@ -0,0 +1,156 @@
+"""
+What net.FrameMetrics costs, with it off and on.
+
+dispatch: frames fed to a Framer and Dispatcher with sbs's handlers, no
+sockets, `--batch` frames per read. This is the worst case, everything but
+the metrics is as cheap as it gets.
+socket: drive frames blasted from another process at a PacketProcessor over
+loopback, as sbs receives them, written one at a time like a joystick
+client sends them and in runs of ten.
+
+Each case alternates off, on timing every read and on timing one read in
+`--sample` (sbs's --metrics-sample) `--runs` times and keeps the median of
+each. Exits non-zero if sampled metrics slow the socket case by more than
+--max-overhead percent.
+"""
+
+import argparse
+import asyncio
+import logging
+import multiprocessing
+import statistics
+import time
+import timeit
+
+import sissyBot.net as net
+import sissyBot.proto.packet_pb2 as packet_pb2
+import sissyBot.server as server
+import sissyBot.stats as stats
+
+HOST = "127.0.0.1"
+
+
+def drive_frame(header):
+    pkt = packet_pb2.Packet()
+    pkt.drive.heading = 90
+    pkt.drive.throttle = 0.5
+    return net.insert_pkt_len(pkt.SerializeToString(), header)
+
+
+def add_handlers(handlers):
+    handlers["drive"] = server.DriveCoalescer(on_drive=None)
+    handlers["ping"] = lambda frame, writer: None
+
+
+def dispatch_rate(metrics, batch, frames):
+    header = net.FRAMINGS[net.FRAMING_VARINT]
+    chunk = drive_frame(header) * batch
+    framer = net.Framer(header=header)
+    disp = net.Dispatcher(logging.getLogger("bench"), metrics)
+    add_handlers(disp.handlers)
+
+    start = time.perf_counter()
+    for _ in range(frames // batch):
+        framer.feed(chunk)
+        if metrics is not None:
+            metrics.reads += 1
+            metrics.bytes += len(chunk)
+        disp.dispatch(framer.frames(), None)
+    return frames // batch * batch / (time.perf_counter() - start)
+
+
+def sender(port, frames, batch):
+    async def send():
+        reader, writer, header, _ = await net.open_connection(HOST, port)
+        chunk = drive_frame(header) * batch
+        for _ in range(frames // batch):
+            writer.write(chunk)
+            await writer.drain()
+        writer.close()
+
+    asyncio.run(send())
+
+
+async def socket_rate(metrics, batch, frames):
+    stop_event = asyncio.Event()
+    done = asyncio.get_running_loop().create_future()
+    rate = None
+
+    async def client_cb(reader, writer):
+        nonlocal rate
+        proc = net.PacketProcessor(
+            reader, writer, stop_event, logging.getLogger("bench"), metrics=metrics
+        )
+        add_handlers(proc.handlers)
+
+        start = time.perf_counter()
+        await proc.recv_fn()
+        rate = frames // batch * batch / (time.perf_counter() - start)
+        writer.close()
+        done.set_result(None)
+
+    server_ = await asyncio.start_server(client_cb, HOST, 0)
+    port = server_.sockets[0].getsockname()[1]
+    client = multiprocessing.Process(target=sender, args=(port, frames, batch))
+    client.start()
+
+    await done
+    server_.close()
+    await asyncio.get_running_loop().run_in_executor(None, client.join)
+    return rate
+
+
+def compare(name, measure, runs, sample):
+    rates = {"off": [], "every": [], "sampled": []}
+    for _ in range(runs):
+        rates["off"].append(measure(None))
+        rates["every"].append(measure(net.FrameMetrics()))
+        rates["sampled"].append(measure(net.FrameMetrics(sample_every=sample)))
+
+    off, every, sampled = (statistics.median(rates[key]) for key in rates)
+    overhead = (off / sampled - 1) * 100
+    print(
+        f"{name:>18}: off {off:7.0f}/s  "
+        f"every read {every:7.0f}/s {(off / every - 1) * 100:+5.1f}%  "
+        f"1 in {sample} {sampled:7.0f}/s {overhead:+5.1f}%"
+    )
+    return overhead
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--frames", default=200000, type=int)
+    parser.add_argument("--runs", default=5, type=int)
+    parser.add_argument("--sample", default=8, type=int)
+    parser.add_argument("--max-overhead", default=5.0, type=float)
+    args = parser.parse_args()
+
+    for batch in (1, 10, 100):
+        compare(
+            f"dispatch, {batch:>3}/read",
+            lambda metrics: dispatch_rate(metrics, batch, args.frames),
+            args.runs,
+            args.sample,
+        )
+
+    overhead = max(
+        compare(
+            f"socket, {batch:>3}/write",
+            lambda metrics: asyncio.run(socket_rate(metrics, batch, args.frames)),
+            args.runs,
+            args.sample,
+        )
+        for batch in (1, 10)
+    )
+
+    hist = stats.Histogram()
+    record = min(timeit.repeat(lambda: hist.record(12345), number=100000, repeat=5))
+    print(f"Histogram.record: {record * 1e4:.0f}ns")
+
+    if overhead > args.max_overhead:
+        print(f"FAIL: socket overhead over {args.max_overhead}%")
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
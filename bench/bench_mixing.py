@@ -0,0 +1,87 @@
+"""
+mixing.Mixer against the scalar server.motor_calc.
+
+Reports how far the table is from the scalar functions before timing them,
+then times the numpy batch path over the same commands. That they agree is
+checked by tests/test_mixing.py.
+"""
+
+import random
+import time
+from dataclasses import dataclass
+
+import sissyBot.mixing as mixing
+import sissyBot.server as server
+
+COUNT = 100_000
+
+
+@dataclass
+class Drive:
+    heading: int
+    throttle: float
+
+
+def make_drives(count):
+    rand = random.Random(1)
+    return [Drive(rand.randint(-180, 180), rand.random()) for _ in range(count)]
+
+
+def max_error(mixer, drives):
+    worst = 0.0
+    for drive in drives:
+        expected = server.motor_calc(drive)
+        got = mixer.motor_calc(drive)
+        worst = max(worst, *(abs(a - b) for a, b in zip(expected, got)))
+    return worst
+
+
+def max_error_batch(mixer, drives):
+    import numpy as np
+
+    l_out, r_out = mixer.motor_calc_batch(
+        [d.heading for d in drives], [d.throttle for d in drives]
+    )
+    expected = np.array([server.motor_calc(d) for d in drives])
+    return max(
+        np.max(np.abs(expected[:, 0] - l_out)), np.max(np.abs(expected[:, 1] - r_out))
+    )
+
+
+def per_sec(fn, drives):
+    start = time.perf_counter()
+    for drive in drives:
+        fn(drive)
+    return len(drives) / (time.perf_counter() - start)
+
+
+def main():
+    mixer = mixing.Mixer()
+    drives = make_drives(COUNT)
+
+    print(f"max error, table: {max_error(mixer, drives):.2g}")
+
+    scalar = per_sec(server.motor_calc, drives)
+    table = per_sec(mixer.motor_calc, drives)
+    print(f"motor_calc     {scalar:>14,.0f} cmd/s")
+    print(f"Mixer (table)  {table:>14,.0f} cmd/s  {table / scalar:.2f}x")
+
+    try:
+        import numpy as np
+    except ImportError:
+        print("numpy not installed, skipping motor_calc_batch")
+        return
+
+    print(f"max error, batch: {max_error_batch(mixer, drives):.2g}")
+
+    headings = np.array([d.heading for d in drives])
+    throttles = np.array([d.throttle for d in drives])
+
+    start = time.perf_counter()
+    mixer.motor_calc_batch(headings, throttles)
+    batch = COUNT / (time.perf_counter() - start)
+    print(f"Mixer (batch)  {batch:>14,.0f} cmd/s  {batch / scalar:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+"""
+Frames/sec and CPU per frame of net.PacketProcessor against net.PacketProtocol.
+
+A separate process connects and blasts drive frames, `--batch` frames per
+write. Only this process's CPU time is counted, which is the receiving side.
+"""
+
+import argparse
+import asyncio
+import logging
+import multiprocessing
+import time
+
+import sissyBot.net as net
+import sissyBot.proto.packet_pb2 as packet_pb2
+
+HOST = "127.0.0.1"
+
+
+def sender(port, frames, batch):
+    async def send():
+        reader, writer, header, _ = await net.open_connection(HOST, port)
+
+        pkt = packet_pb2.Packet()
+        pkt.drive.heading = 90
+        pkt.drive.throttle = 0.5
+        chunk = net.insert_pkt_len(pkt.SerializeToString(), header) * batch
+
+        for _ in range(frames // batch):
+            writer.write(chunk)
+            await writer.drain()
+
+        await reader.read()
+        writer.close()
+
+    asyncio.run(send())
+
+
+class Counter:
+    def __init__(self, frames):
+        self.frames = frames
+        self.count = 0
+        self.done = asyncio.get_running_loop().create_future()
+
+    def handle_batch(self, frames, writer):
+        self.count += len(frames)
+        if self.count >= self.frames and not self.done.done():
+            self.done.set_result(None)
+
+
+async def run(receiver, frames, batch):
+    loop = asyncio.get_running_loop()
+    log = logging.getLogger("bench")
+    stop_event = asyncio.Event()
+    counter = Counter(frames)
+    procs = []
+
+    def attach(proc):
+        proc.handlers["drive"] = counter
+        procs.append(proc)
+
+    if receiver == "stream":
+
+        async def client_cb(reader, writer):
+            proc = net.PacketProcessor(reader, writer, stop_event, log)
+            attach(proc)
+            await proc.recv_fn()
+            writer.close()
+
+        server = await asyncio.start_server(client_cb, HOST, 0)
+    else:
+
+        def on_connect(proto):
+            attach(proto)
+            loop.create_task(proto.recv_fn())
+
+        server = await loop.create_server(
+            lambda: net.PacketProtocol(stop_event, log, on_connect=on_connect),
+            HOST,
+            0,
+        )
+
+    port = server.sockets[0].getsockname()[1]
+    client = multiprocessing.Process(target=sender, args=(port, frames, batch))
+    client.start()
+
+    # clocks start with the first frame so connection set up isn't counted
+    while not counter.count:
+        await asyncio.sleep(0)
+    wall = time.perf_counter()
+    cpu = time.process_time()
+    first = counter.count
+
+    await counter.done
+
+    wall = time.perf_counter() - wall
+    cpu = time.process_time() - cpu
+    counted = counter.count - first
+
+    stop_event.set()
+    server.close()
+    await loop.run_in_executor(None, client.join)
+
+    print(
+        f"{receiver:>8} batch {batch:>4}: {counted / wall:10.0f} frames/s "
+        f"{cpu / counted * 1e6:6.2f}us cpu/frame"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--frames", default=200000, type=int)
+    parser.add_argument("--batch", default=(1, 10, 100), type=int, nargs="+")
+    args = parser.parse_args()
+
+    for batch in args.batch:
+        for receiver in ("stream", "protocol"):
+            asyncio.run(run(receiver, args.frames, batch))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,193 @@
+"""
+Drops the link between a client driving through sbs_link.SbsThread, Robot's
+"sbs" backend, and sbs, and checks the heartbeat monitor stops the motors.
+
+sbs runs in this process as run_server sets it up, with a backend that
+records when the motors were stopped. The client connects through a proxy
+that, when the link drops, holds everything in both directions without
+closing the connection, the way a dead wifi link does, and lets it through
+again once the link is back. Checked:
+
+the motors stop within the heartbeat deadline, plus the monitor's check
+interval and `--margin`, of the link dropping.
+the client notices the echoes have stopped.
+once the link is back the client drives the robot again, on the same
+connection.
+
+Exits non-zero if any of these fail.
+"""
+
+import argparse
+import asyncio
+import sys
+import time
+
+import sissyBot.control as control
+import sissyBot.mixing as mixing
+import sissyBot.server as server
+from sissyBot.nats_proc import ConnState
+from sissyBot.proto import drive_pb2
+from sissyBot.sbs_link import SbsThread
+
+HOST = "127.0.0.1"
+
+
+class RecordingBackend:
+    def __init__(self):
+        self.output = (0.0, 0.0)
+        self.stops = []
+
+    def set(self, l_motor, r_motor):
+        self.output = (l_motor, r_motor)
+
+    def stop(self):
+        self.output = (0.0, 0.0)
+        self.stops.append(time.monotonic())
+
+
+class HoldingProxy:
+    """Forwards TCP connections, holding their data while the link is down."""
+
+    def __init__(self, server_port):
+        self.server_port = server_port
+        self.link_up = asyncio.Event()
+        self.link_up.set()
+        self.connections = 0
+
+    async def __call__(self, reader, writer):
+        self.connections += 1
+        up_reader, up_writer = await asyncio.open_connection(HOST, self.server_port)
+        await asyncio.gather(
+            self._pump(reader, up_writer),
+            self._pump(up_reader, writer),
+            return_exceptions=True,
+        )
+        writer.close()
+        up_writer.close()
+
+    async def _pump(self, reader, writer):
+        while data := await reader.read(65536):
+            await self.link_up.wait()
+            writer.write(data)
+            await writer.drain()
+        writer.close()
+
+
+async def wait_for(check, timeout):
+    """Time taken for check() to come true, None if it didn't in time."""
+    start = time.monotonic()
+    while time.monotonic() - start < timeout:
+        if check():
+            return time.monotonic() - start
+        await asyncio.sleep(0.005)
+    return None
+
+
+async def run(args):
+    stop_event = asyncio.Event()
+    backend = RecordingBackend()
+    control_loop = control.ControlLoop(None, backend, mixing.Mixer().motor_calc)
+    drive = server.DriveCoalescer(on_drive=None, on_stop=control_loop.all_stop)
+    control_loop.slot = drive
+    connections = server.ConnectionManager(drive, stop_event, hb_deadline=args.deadline)
+
+    sbs = await asyncio.start_server(connections, HOST, 0)
+    proxy = HoldingProxy(sbs.sockets[0].getsockname()[1])
+    proxy_server = await asyncio.start_server(proxy, HOST, 0)
+    control_task = asyncio.create_task(control_loop.run(stop_event))
+
+    states = []
+    link = SbsThread(
+        lambda status: states.append(status.state),
+        echo_timeout=args.echo_timeout,
+    )
+    link.connect(f"{HOST}:{proxy_server.sockets[0].getsockname()[1]}")
+
+    cmd = drive_pb2.DriveCmd(heading_delta=0, throttle=args.throttle)
+
+    async def drive_robot():
+        while True:
+            link.publish("drive.cmd", cmd.SerializeToString())
+            await asyncio.sleep(1 / args.drive_rate)
+
+    driver = asyncio.create_task(drive_robot())
+    failures = []
+
+    def moving():
+        return backend.output != (0.0, 0.0)
+
+    try:
+        if await wait_for(moving, 2.0) is None:
+            failures.append("never drove before the link dropped")
+            return failures
+        await asyncio.sleep(0.5)
+
+        states.clear()
+        dropped_at = time.monotonic()
+        proxy.link_up.clear()
+
+        limit = args.deadline * 1.25 + args.margin
+        if await wait_for(lambda: backend.stops, limit + 1.0) is None:
+            failures.append("motors never stopped")
+        else:
+            took = backend.stops[0] - dropped_at
+            print(f"motors stopped {took * 1e3:.0f}ms after the link dropped")
+            if took > limit:
+                failures.append(f"stop took longer than {limit * 1e3:.0f}ms")
+
+        noticed = await wait_for(
+            lambda: ConnState.RECONNECTING in states, args.echo_timeout + 1.0
+        )
+        if noticed is None:
+            failures.append("client never noticed the echoes stopped")
+        else:
+            print(f"client noticed {time.monotonic() - dropped_at:.3f}s in")
+
+        await asyncio.sleep(max(0.0, args.outage - (time.monotonic() - dropped_at)))
+        if moving():
+            failures.append("motors moving with the link down")
+
+        proxy.link_up.set()
+        back = await wait_for(moving, 2.0)
+        if back is None:
+            failures.append("never drove again once the link was back")
+        else:
+            print(f"driving again {back * 1e3:.0f}ms after the link came back")
+        if proxy.connections != 1:
+            failures.append(f"{proxy.connections} connections, wanted 1")
+
+        print(f"heartbeats: {link.heartbeat.stats()}")
+        print(f"drive commands dropped by the client: {link.dropped}")
+        return failures
+    finally:
+        driver.cancel()
+        link.close()
+        stop_event.set()
+        await control_task
+        proxy_server.close()
+        sbs.close()
+        await connections.close()
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--deadline", default=0.5, type=float)
+    parser.add_argument("--echo-timeout", default=1.0, type=float)
+    parser.add_argument("--outage", default=2.0, type=float)
+    parser.add_argument("--margin", default=0.1, type=float)
+    parser.add_argument("--throttle", default=0.8, type=float)
+    parser.add_argument("--drive-rate", default=30.0, type=float)
+    return parser.parse_args(argv)
+
+
+def main():
+    failures = asyncio.run(run(parse_args()))
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    if failures:
+        sys.exit(1)
+    print("OK")
+
+
+if __name__ == "__main__":
+    main()
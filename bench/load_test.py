@@ -0,0 +1,156 @@
+"""
+Many clients against a running sbs server.
+
+Every client streams drive frames and pings; the server echoes the pings, so
+the round trip of a ping measures how long a client waits behind everyone
+else. Ping stamps are sequence numbers rather than times, matched against
+perf_counter here, to get better than the protocol's millisecond resolution.
+
+Start the server with enough room first, e.g.
+
+    sbs --max-clients 500 --heartbeat-timeout 5
+"""
+
+import argparse
+import asyncio
+import logging
+import time
+
+import sissyBot.net as net
+import sissyBot.proto.packet_pb2 as packet_pb2
+from sissyBot.stats import RollingWindow
+
+
+class LoadClient:
+    def __init__(self, window):
+        self.sent = 0
+        self.pings = {}
+        self.rtt = RollingWindow(window)
+        self.seq = 0
+
+    def handle_echo(self, frame, writer):
+        sent = self.pings.pop(frame.time, None)
+        if sent is not None:
+            self.rtt.add(time.perf_counter() - sent)
+
+    async def run(
+        self, host, port, duration, drive_rate, ping_rate, features, stop_event
+    ):
+        reader, writer, header, features = await net.open_connection(
+            host, port, features=features
+        )
+        proc = net.PacketProcessor(
+            reader,
+            writer,
+            stop_event,
+            logging.getLogger("load"),
+            header,
+            features=features,
+        )
+        proc.handlers["ping"] = self.handle_echo
+        recv_task = asyncio.create_task(proc.recv_fn())
+
+        per_ping = max(1, round(drive_rate / ping_rate))
+        period = 1 / drive_rate
+        end = time.perf_counter() + duration
+        tick = 0
+
+        try:
+            while time.perf_counter() < end:
+                proc.send_drive(tick % 360, 0.5)
+                self.sent += 1
+
+                if not tick % per_ping:
+                    self.seq += 1
+                    ping = packet_pb2.Packet()
+                    ping.ping.time = self.seq
+                    self.pings[self.seq] = time.perf_counter()
+                    proc.send_pkt(ping)
+                    self.sent += 1
+
+                tick += 1
+                await writer.drain()
+                await asyncio.sleep(period)
+
+            # give the last echoes a moment to come back
+            await asyncio.sleep(0.2)
+        finally:
+            recv_task.cancel()
+            await asyncio.gather(recv_task, return_exceptions=True)
+            writer.close()
+
+
+async def run(args):
+    stop_event = asyncio.Event()
+    clients = [LoadClient(args.window) for _ in range(args.clients)]
+
+    start = time.perf_counter()
+    results = await asyncio.gather(
+        *(
+            client.run(
+                args.host,
+                args.port,
+                args.duration,
+                args.drive_rate,
+                args.ping_rate,
+                net.FEATURE_PACKED if args.packed else 0,
+                stop_event,
+            )
+            for client in clients
+        ),
+        return_exceptions=True,
+    )
+    elapsed = time.perf_counter() - start
+
+    failed = [result for result in results if isinstance(result, Exception)]
+    if failed:
+        print(f"{len(failed)} clients failed, first: {failed[0]!r}")
+
+    sent = sum(client.sent for client in clients)
+    print(f"{args.clients} clients, {sent} frames in {elapsed:.2f}s")
+    print(f"throughput: {sent / elapsed:.0f} frames/s")
+
+    rtt = RollingWindow(args.window * args.clients)
+    p99s = RollingWindow(args.clients)
+    for client in clients:
+        for value in client.rtt.samples:
+            rtt.add(value)
+        if len(client.rtt):
+            p99s.add(client.rtt.percentile(99))
+
+    pcts = rtt.percentiles(50, 90, 99)
+    print(
+        "ping rtt: "
+        + "  ".join(
+            f"p{pct} " + ("n/a" if value is None else f"{value * 1e3:.2f}ms")
+            for pct, value in pcts.items()
+        )
+    )
+    if len(p99s):
+        print(
+            f"per client p99: best {min(p99s.samples) * 1e3:.2f}ms "
+            f"worst {max(p99s.samples) * 1e3:.2f}ms"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", default=4443, type=int)
+    parser.add_argument("--clients", default=200, type=int)
+    parser.add_argument("--duration", default=5.0, type=float)
+    parser.add_argument("--drive-rate", default=50.0, type=float)
+    parser.add_argument("--ping-rate", default=10.0, type=float)
+    parser.add_argument("--window", default=500, type=int)
+    parser.add_argument(
+        "--packed", action="store_true", help="send packed drive frames"
+    )
+    args = parser.parse_args()
+
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,217 @@
+"""
+The datagram drive transport through a lossy, delaying loopback proxy.
+
+A client streams drive commands, numbering them in the heading field, and
+every so often sends drive_stop with the next drive straight after it. The
+proxy drops, delays and so reorders datagrams in both directions. The server
+side counts what it applies. Checked:
+
+no drive command older than one already applied gets through.
+every stop the proxy let at least one copy of through is applied, once,
+even when the drive after it overtakes the stop's copies.
+
+Exits non-zero if either fails. tests/test_datagram.py runs it too.
+"""
+
+import argparse
+import asyncio
+import functools
+import logging
+import random
+import sys
+
+import sissyBot.net as net
+import sissyBot.proto.packet_pb2 as packet_pb2
+
+HOST = "127.0.0.1"
+
+
+class LossyProxy(asyncio.DatagramProtocol):
+    """Forwards between one client and the server, badly."""
+
+    def __init__(self, server_addr, loss, delay, jitter):
+        self.server_addr = server_addr
+        self.loss = loss
+        self.delay = delay
+        self.jitter = jitter
+
+        self.client_addr = None
+        self.forwarded = 0
+        self.lost = 0
+        self.stops = {}  # seq -> whether any copy was forwarded
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        if addr == self.server_addr:
+            dest = self.client_addr
+        else:
+            self.client_addr = addr
+            dest = self.server_addr
+
+        stop_seq = None
+        if dest == self.server_addr:
+            stop_seq = stop_seq_of(data)
+            if stop_seq is not None:
+                self.stops.setdefault(stop_seq, False)
+
+        if dest is None or random.random() < self.loss:
+            self.lost += 1
+            return
+
+        self.forwarded += 1
+        if stop_seq is not None:
+            self.stops[stop_seq] = True
+        delay = self.delay + random.uniform(0, self.jitter)
+        asyncio.get_running_loop().call_later(delay, self.transport.sendto, data, dest)
+
+
+def stop_seq_of(data):
+    """The sequence number of a drive_stop datagram, None for anything else."""
+    (seq,) = net.DGRAM_SEQ.unpack_from(data)
+    number, _ = net.decode(memoryview(data)[net.DGRAM_SEQ.size :])
+    return seq if net.FRAME_TYPES.get(number) == "drive_stop" else None
+
+
+class Applied:
+    def __init__(self):
+        self.drives = 0
+        self.backwards = 0
+        self.newest = -1
+        self.stops = 0
+
+    def drive(self, frame, writer):
+        self.drives += 1
+        if frame.heading < self.newest:
+            self.backwards += 1
+        self.newest = max(self.newest, frame.heading)
+
+    def stop(self, frame, writer):
+        self.stops += 1
+
+
+def echo(peer, frame, writer):
+    pkt = packet_pb2.Packet()
+    pkt.ping.time = frame.time
+    peer.send_pkt(pkt)
+
+
+async def run(args):
+    """Returns a list of failures, empty if all went well."""
+    random.seed(args.seed)
+    loop = asyncio.get_running_loop()
+    log = logging.getLogger("lossy")
+    stop_event = asyncio.Event()
+    applied = Applied()
+    peers = []
+
+    def on_peer(peer):
+        peer.handlers["drive"] = applied.drive
+        peer.handlers["drive_stop"] = applied.stop
+        peer.handlers["ping"] = functools.partial(echo, peer)
+        peers.append(peer)
+        loop.create_task(peer.recv_fn())
+
+    server, _ = await loop.create_datagram_endpoint(
+        lambda: net.DatagramEndpoint(stop_event, log, on_peer=on_peer),
+        local_addr=(HOST, 0),
+    )
+    proxy_transport, proxy = await loop.create_datagram_endpoint(
+        lambda: LossyProxy(
+            server.get_extra_info("sockname"), args.loss, args.delay, args.jitter
+        ),
+        local_addr=(HOST, 0),
+    )
+
+    client = await net.open_datagram(
+        *proxy_transport.get_extra_info("sockname"), stop_event, log
+    )
+    echoes = 0
+
+    def on_echo(frame, writer):
+        nonlocal echoes
+        echoes += 1
+
+    client.handlers["ping"] = on_echo
+    recv_task = asyncio.create_task(client.recv_fn())
+
+    stops_sent = 0
+    pkt = packet_pb2.Packet()
+    pkt.drive.throttle = 0.5
+    stop = packet_pb2.Packet()
+    stop.drive_stop.SetInParent()
+    for i in range(args.count):
+        if i % args.stop_every == args.stop_every - 1:
+            client.send_pkt(stop)
+            stops_sent += 1
+        pkt.drive.heading = i
+        client.send_pkt(pkt)
+
+        if not i % 10:
+            ping = packet_pb2.Packet()
+            ping.ping.time = i
+            client.send_pkt(ping)
+
+        await asyncio.sleep(1 / args.rate)
+
+    await asyncio.sleep(args.delay + args.jitter + 0.1)
+
+    stop_event.set()
+    await recv_task
+    proxy_transport.close()
+    server.close()
+
+    peer = peers[0]
+    print(
+        f"loss {args.loss:.0%}, delay {args.delay * 1e3:.0f}"
+        f"+{args.jitter * 1e3:.0f}ms"
+    )
+    print(
+        f"drive: {args.count} sent, {applied.drives} applied, "
+        f"{peer.stale} stale dropped, {applied.backwards} applied out of order"
+    )
+    print(
+        f"stops: {stops_sent} sent, {applied.stops} applied, "
+        f"{peer.late_stops} of them behind a newer drive"
+    )
+    print(f"pings: {args.count // 10 + 1} sent, {echoes} echoed")
+
+    failures = []
+    if not applied.drives:
+        failures.append("no drive commands applied")
+    if applied.backwards:
+        failures.append(f"{applied.backwards} stale drive commands applied")
+
+    delivered = sum(proxy.stops.values())
+    print(f"stops with a copy through the proxy: {delivered}")
+    if applied.stops != delivered:
+        failures.append(
+            f"{applied.stops} stops applied, {delivered} got through the proxy"
+        )
+    return failures
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--count", default=2000, type=int)
+    parser.add_argument("--rate", default=200.0, type=float)
+    parser.add_argument("--stop-every", default=100, type=int)
+    parser.add_argument("--loss", default=0.2, type=float)
+    parser.add_argument("--delay", default=0.005, type=float)
+    parser.add_argument("--jitter", default=0.02, type=float)
+    parser.add_argument("--seed", default=None, type=int)
+    return parser.parse_args(argv)
+
+
+def main():
+    failures = asyncio.run(run(parse_args()))
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    if failures:
+        sys.exit(1)
+    print("OK")
+
+
+if __name__ == "__main__":
+    main()
@@ -36,11 +36,17 @@ setup(
     packages=["sissyBot"],
     python_requires=">=3.13",
     install_requires=["grpcio-tools"],
-    extras_require={"GUI": ["kivy"]},
+    extras_require={
+        "GUI": ["kivy"],
+        "sim": ["numpy"],
+        "uvloop": ["uvloop"],
+        "debug": ["snoop"],
+    },
     entry_points={
         "console_scripts": [
             "sbc=sissyBot.client:client[GUI]",
             "sbs=sissyBot.server:serve",
+            "sbs-replay=sissyBot.replay:main",
         ]
     },
     project_urls={"Source": "https://github.com/HappyFox/SissyBot"},  # Optional
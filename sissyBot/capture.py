@@ -0,0 +1,204 @@
+"""
+Append-only capture of the frames clients send, for replaying offline.
+
+A capture file is MAGIC then one record per frame: a RECORD header holding
+time.monotonic_ns() when the frame was read, the connection it came in on
+and its length, then the frame itself as decode() takes it, without the
+stream's length prefix. Frames are never empty, so zero length records are
+events instead: connection OPENED or CLOSED ored with the connection, or 0
+for the start of a new session when a later run appends to the file.
+Connections are numbered from 0 in the order they opened, per session.
+
+Version 1 files have no open and close events, and can still be read.
+"""
+
+import mmap
+import os
+import struct
+import time
+
+MAGIC = b"SBCAP\x02"
+MAGIC_V1 = b"SBCAP\x01"
+
+RECORD = struct.Struct("<QII")  # time ns, connection, frame length
+
+# event flags in the connection field of zero length records
+OPENED = 1 << 30
+CLOSED = 1 << 31
+EVENTS = OPENED | CLOSED
+
+# kinds of CaptureReader.records()
+FRAME = "frame"
+OPEN = "open"
+CLOSE = "close"
+
+
+class CaptureFile:
+    """A capture file open for appending, shared by every connection."""
+
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, "a+b")
+
+        self.file.seek(0)
+        magic = self.file.read(len(MAGIC))
+        if not magic:
+            self.file.write(MAGIC)
+        elif magic == MAGIC_V1:
+            self.file.close()
+            raise ValueError(f"{path} was written by an older sbs, start a new one")
+        elif magic != MAGIC:
+            self.file.close()
+            raise ValueError(f"{path} is not a capture file")
+
+        self.event(0)
+
+        self._next_conn = 0
+        self.frames = 0
+
+    def event(self, conn_flags):
+        self.file.write(RECORD.pack(time.monotonic_ns(), conn_flags, 0))
+
+    def stream(self):
+        """A CaptureStream for the next connection, which opens it."""
+        stream = CaptureStream(self, self._next_conn)
+        self._next_conn += 1
+        return stream
+
+    def close(self):
+        self.file.close()
+
+    def stats(self):
+        return {
+            "connections": self._next_conn,
+            "frames": self.frames,
+            "bytes": self.file.tell() if not self.file.closed else None,
+        }
+
+
+class CaptureStream:
+    """One connection's view of a CaptureFile."""
+
+    def __init__(self, capture, conn):
+        self.capture = capture
+        self.conn = conn
+        self.closed = False
+        capture.event(OPENED | conn)
+
+    def close(self):
+        """Records the connection closing, once."""
+        if not self.closed and not self.capture.file.closed:
+            self.closed = True
+            self.capture.event(CLOSED | self.conn)
+
+    def record(self, frames):
+        """
+        Passes frames through, writing each one down on the way. They all get
+        the time of the read they came from.
+        """
+        capture = self.capture
+        write = capture.file.write
+        pack = RECORD.pack
+        now = time.monotonic_ns()
+
+        for frame in frames:
+            write(pack(now, self.conn, len(frame)))
+            write(frame)
+            capture.frames += 1
+            yield frame
+
+
+class CaptureReader:
+    """
+    Memory maps a capture file. Iterating gives (time ns, connection, frame)
+    with the frames as memoryviews into the map, which stay valid until
+    close(). records() gives the open and close events as well.
+
+    Sessions are joined end to end: each one's times carry on from the last
+    record of the one before, and its connections are renumbered after the
+    last one's. A record cut short by the writer dying is skipped and counted
+    in `truncated`.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.truncated = 0
+
+        with open(path, "rb") as capture_file:
+            if os.fstat(capture_file.fileno()).st_size < len(MAGIC):
+                raise ValueError(f"{path} is not a capture file")
+            self._map = mmap.mmap(capture_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if self._map[: len(MAGIC)] not in (MAGIC, MAGIC_V1):
+            self._map.close()
+            raise ValueError(f"{path} is not a capture file")
+
+        self._view = memoryview(self._map)
+
+    def __iter__(self):
+        for time_ns, conn, kind, frame in self.records():
+            if kind is FRAME:
+                yield time_ns, conn, frame
+
+    def records(self):
+        """
+        Yields (time ns, connection, kind, frame), kind being FRAME, OPEN or
+        CLOSE and frame None for the last two. Every connection opens before
+        its first frame and is closed by the end, if not by the capture then
+        at the end of its session.
+        """
+        view = self._view
+        size = len(view)
+        unpack = RECORD.unpack_from
+        offset = len(MAGIC)
+
+        time_base = 0  # added to this session's times
+        last_time = 0
+        conn_base = 0
+        conns = 0  # connections seen so far
+        live = set()
+
+        while offset + RECORD.size <= size:
+            time_ns, conn_flags, len_ = unpack(view, offset)
+            offset += RECORD.size
+
+            if not len_ and not conn_flags:
+                # a new session, start it just after the last one ended
+                for conn in sorted(live):
+                    yield last_time, conn, CLOSE, None
+                live.clear()
+                time_base = last_time - time_ns
+                conn_base = conns
+                continue
+
+            if offset + len_ > size:
+                self.truncated += 1
+                break
+
+            last_time = time_ns + time_base
+            conn = conn_base + (conn_flags & ~EVENTS)
+            conns = max(conns, conn + 1)
+
+            if len_:
+                if conn not in live:
+                    # version 1, no open events
+                    live.add(conn)
+                    yield last_time, conn, OPEN, None
+                yield last_time, conn, FRAME, view[offset : offset + len_]
+                offset += len_
+            elif conn_flags & OPENED:
+                live.add(conn)
+                yield last_time, conn, OPEN, None
+            elif conn in live:
+                live.discard(conn)
+                yield last_time, conn, CLOSE, None
+        else:
+            if offset != size:
+                self.truncated += 1
+
+        for conn in sorted(live):
+            yield last_time, conn, CLOSE, None
+
+    def close(self):
+        self._view.release()
+        self._map.close()
@@ -1,3 +1,4 @@
+import collections
 import logging
 import math
 import select
@@ -10,10 +11,12 @@ import kivy.properties
 import kivy.uix
 import kivy.uix.boxlayout
 import kivy.uix.label
+import kivy.uix.recycleview
 import kivy.uix.togglebutton
 import kivy.uix.widget
 import kivy.utils
 
+import sissyBot.logs as logs
 import sissyBot.robot
 
 from . import float_joy
@@ -29,16 +32,17 @@ class RootWidget(kivy.uix.boxlayout.BoxLayout):
 class DriveBinding:
     def __init__(self, bot_con):
         self._bot_con = bot_con
+        self.log = logging.getLogger("drive binding")
 
     def on_engage(self, pad):
-        print(f"engadge! {pad}")
+        self.log.debug("engadge! %s", pad)
 
     def on_move(self, pad, theta, rho):
-        print(f"moving {theta}, {rho}")
+        self.log.debug("moving %s, %s", theta, rho)
         self._bot_con.drive.cmd(theta, rho)
 
     def on_release(self, pad):
-        print("release")
+        self.log.debug("release")
         self._bot_con.drive.stop()
 
 
@@ -50,7 +54,6 @@ class ConnectButton(kivy.uix.togglebutton.ToggleButton):
         bot_con.bind(up=self.on_up)
 
     def on_up(self, _, up):
-        print("on_up")
         if up:
             self.text = "Connected"
             self.state = "down"
@@ -59,10 +62,54 @@ class ConnectButton(kivy.uix.togglebutton.ToggleButton):
         self.state = "normal"
 
 
-class LogPanel(kivy.uix.label.Label):
+LEVEL_COLORS = {
+    logging.DEBUG: (0.6, 0.6, 0.6, 1),
+    logging.INFO: (1, 1, 1, 1),
+    logging.WARNING: (1, 0.8, 0.2, 1),
+    logging.ERROR: (1, 0.2, 0.2, 1),
+}
+
+
+def level_color(level):
+    for threshold in sorted(LEVEL_COLORS, reverse=True):
+        if level >= threshold:
+            return LEVEL_COLORS[threshold]
+    return LEVEL_COLORS[logging.DEBUG]
+
+
+class LogRow(kivy.uix.label.Label):
+    pass
+
+
+class LogPanel(kivy.uix.recycleview.RecycleView):
+    """
+    The last max_entries log lines, as a RecycleView so only the rows on
+    screen are laid out.
+
+    Entries may be added from any thread. They queue up and go in once per
+    frame, each line of an entry becoming a row. Rows below min_level or not
+    containing filter_text are left out, changing either rebuilds the view
+    from what is still in the ring.
+    """
+
+    max_entries = kivy.properties.NumericProperty(1000)
+    min_level = kivy.properties.NumericProperty(logging.DEBUG)
+    filter_text = kivy.properties.StringProperty("")
+
+    def __init__(self, **kwargs):
+        self._entries = collections.deque(maxlen=1000)
+        self._shown = collections.deque()  # serial of each row in data
+        self._pending = collections.deque()
+        self._serial = 0
+        self._flush_trigger = kivy.clock.Clock.create_trigger(self._flush)
+        super(LogPanel, self).__init__(**kwargs)
+
     def info(self, text):
         self._log_entry(logging.INFO, text)
 
+    def warning(self, text):
+        self._log_entry(logging.WARNING, text)
+
     def error(self, text):
         self._log_entry(logging.ERROR, text)
 
@@ -70,12 +117,115 @@ class LogPanel(kivy.uix.label.Label):
         self._log_entry(logging.DEBUG, text)
 
     def _log_entry(self, level, text):
-        text = kivy.utils.escape_markup(text)
-
-        if level == logging.ERROR:
-            text = f"[color=ff3333]{text}[/color]"
-
-        self.text += f"\n{text}\n"
+        self._pending.append((level, text))
+        self._flush_trigger()
+
+    def _shows(self, level, line):
+        if level < self.min_level:
+            return False
+        return not self.filter_text or self.filter_text.lower() in line.lower()
+
+    @staticmethod
+    def _row(entry):
+        _, level, line = entry
+        return {"text": line, "color": level_color(level)}
+
+    def _flush(self, dt):
+        rows = []
+        while self._pending:
+            level, text = self._pending.popleft()
+            for line in text.splitlines() or [""]:
+                entry = (self._serial, level, line)
+                self._serial += 1
+                self._entries.append(entry)
+                if self._shows(level, line):
+                    rows.append(entry)
+
+        # rows whose entries have fallen out of the ring
+        oldest = self._entries[0][0] if self._entries else self._serial
+        dropped = 0
+        while self._shown and self._shown[0] < oldest:
+            self._shown.popleft()
+            dropped += 1
+
+        # new rows older than the ring can't be shown either
+        rows = [entry for entry in rows if entry[0] >= oldest]
+
+        if dropped:
+            del self.data[:dropped]
+        if rows:
+            self._shown.extend(entry[0] for entry in rows)
+            self.data.extend(self._row(entry) for entry in rows)
+
+    def _refilter(self, *args):
+        shown = [entry for entry in self._entries if self._shows(entry[1], entry[2])]
+        self._shown = collections.deque(entry[0] for entry in shown)
+        self.data = [self._row(entry) for entry in shown]
+
+    def on_min_level(self, *args):
+        self._refilter()
+
+    def on_filter_text(self, *args):
+        self._refilter()
+
+    def on_max_entries(self, _, max_entries):
+        self._entries = collections.deque(self._entries, maxlen=int(max_entries))
+        self._refilter()
+
+
+class LogPanelHandler(logging.Handler):
+    """Sends log records to a LogPanel, from any thread."""
+
+    def __init__(self, panel, level=logging.NOTSET):
+        super().__init__(level)
+        self.panel = panel
+
+    def emit(self, record):
+        try:
+            self.panel._log_entry(record.levelno, self.format(record))
+        except Exception:
+            self.handleError(record)
+
+
+class StatsPanel(kivy.uix.label.Label):
+    """
+    The robot connection's counters and the drive pad's, refreshed every
+    `interval` seconds.
+    """
+
+    robot = kivy.properties.ObjectProperty(None, allownone=True)
+    pad = kivy.properties.ObjectProperty(None, allownone=True)
+    interval = kivy.properties.NumericProperty(1.0)
+
+    def __init__(self, **kwargs):
+        self._event = None
+        super(StatsPanel, self).__init__(**kwargs)
+        self.on_interval(self, self.interval)
+
+    def on_interval(self, _, interval):
+        if self._event is not None:
+            self._event.cancel()
+        self._event = kivy.clock.Clock.schedule_interval(self.refresh, interval)
+
+    def refresh(self, dt=None):
+        lines = []
+        if self.robot is not None:
+            for key, value in self.robot.metrics().items():
+                if key.endswith("_ns"):
+                    key = key[:-3] + "_us"
+                    if value is not None:
+                        value = f"{value / 1000:.1f}"
+                elif key == "rtt":
+                    key = "rtt_ms"
+                    if value is not None:
+                        value = f"{value * 1000:.2f}"
+                lines.append(f"{key}: {value}")
+
+        if self.pad is not None:
+            lines.append(f"pad_moves: {self.pad.raw_moves}")
+            lines.append(f"pad_on_move: {self.pad.moves_dispatched}")
+
+        self.text = "\n".join(lines)
 
 
 class ClientApp(kv.app.App):
@@ -85,13 +235,28 @@ class ClientApp(kv.app.App):
 
     def on_start(self):
         self.log = self.root.ids.log
-        # self.log = LogBinding(self.root.ids.log)
-        self.bot_con = sissyBot.robot.Robot()
+        self.log.max_entries = self.config.getint("log", "max_entries")
+        self.log_handler = LogPanelHandler(self.log)
+        self.log_handler.setFormatter(logging.Formatter("%(name)s: %(message)s"))
+        self.log_queue = logs.QueueLogging(
+            [self.log_handler], levels=self.config.get("log", "levels")
+        )
+        self.log_queue.start()
+        self.log.info("Da Log!")
+
+        self.bot_con = sissyBot.robot.Robot(
+            backend=self.config.get("robot", "backend"),
+            log_levels=self.config.get("log", "levels"),
+        )
 
         self.drive_binding = DriveBinding(self.bot_con)
 
+        self.root.ids.stats.robot = self.bot_con
+        self.root.ids.stats.pad = self.root.ids.drive_pad
+
     def on_stop(self):
         self.bot_con.close()
+        self.log_queue.stop()
 
     def build(self):
         self.root = RootWidget()
@@ -100,7 +265,9 @@ class ClientApp(kv.app.App):
             "robot": {
                 "address": self.root.on_addr_update,
                 "port": self.root.on_addr_update,
-            }
+                "backend": self.on_backend,
+            },
+            "log": {"max_entries": self.on_log_size, "levels": self.on_log_levels},
         }
         return self.root
 
@@ -120,16 +287,66 @@ class ClientApp(kv.app.App):
                 "desc": "Destination port",
                 "section": "robot",
                 "key": "port"
+            },
+            {
+                "type": "options",
+                "title": "Backend",
+                "desc": "NATS in a process or thread, or straight to sbs",
+                "section": "robot",
+                "key": "backend",
+                "options": ["process", "thread", "sbs"]
             }
         ]
         """
         settings.add_json_panel("Networking", self.config, data=json_data)
 
+        json_data = """
+        [
+            {
+                "type": "numeric",
+                "title": "Log size",
+                "desc": "Lines kept in the log panel",
+                "section": "log",
+                "key": "max_entries"
+            },
+            {
+                "type": "string",
+                "title": "Log levels",
+                "desc": "e.g. info,robot=debug,drive binding=debug",
+                "section": "log",
+                "key": "levels"
+            }
+        ]
+        """
+        settings.add_json_panel("Log", self.config, data=json_data)
+
     def build_config(self, config):
-        config.setdefaults("robot", {"address": "sissybot.local", "port": "4443"})
+        config.setdefaults(
+            "robot",
+            {"address": "sissybot.local", "port": "4443", "backend": "process"},
+        )
+        config.setdefaults(
+            "log", {"max_entries": "1000", "levels": logs.DEFAULT_LEVELS}
+        )
+
+    def on_backend(self, config):
+        # takes effect on the next connect
+        self.bot_con.close()
+        self.bot_con.backend = config.get("robot", "backend")
+
+    def on_log_size(self, config):
+        self.log.max_entries = config.getint("log", "max_entries")
+
+    def on_log_levels(self, config):
+        try:
+            logs.set_levels(config.get("log", "levels"))
+        except ValueError as e:
+            self.log.error(str(e))
+            return
+        self.bot_con.log_levels = config.get("log", "levels")
 
     def on_config_change(self, config, section, key, value):
-        print(section + " " + key + " " + value)
+        logging.getLogger("config").debug("%s %s %s", section, key, value)
 
         if section in self.settings_fn:
             if key in self.settings_fn[section]:
@@ -0,0 +1,119 @@
+"""
+Fixed rate motor control, decoupled from when drive packets arrive.
+"""
+
+import asyncio
+import logging
+
+import sissyBot.stats as stats
+
+
+class LoggingBackend:
+    """Motor backend that only logs, for running without hardware."""
+
+    def __init__(self):
+        self.log = logging.getLogger("motors")
+        self.output = (0.0, 0.0)
+
+    def set(self, l_motor, r_motor):
+        self.output = (l_motor, r_motor)
+        self.log.debug("Motors: %s, %s", l_motor, r_motor)
+
+    def stop(self):
+        self.output = (0.0, 0.0)
+        self.log.info("ALL STOP")
+
+
+BACKENDS = {"log": LoggingBackend}
+
+
+def _slew(current, target, max_step):
+    if max_step is None:
+        return target
+    return current + max(-max_step, min(max_step, target - current))
+
+
+class ControlLoop:
+    """
+    Reads the newest drive command from `slot` every tick, turns it into motor
+    outputs with `mixer`, limits how fast the outputs may change and writes
+    them to `backend`.
+
+    `slot` is anything with a take() method returning the newest command or
+    None, normally a server.DriveCoalescer. `slew` is the largest change in
+    motor output per second, 0 for no limit.
+    """
+
+    def __init__(self, slot, backend, mixer, rate=200, slew=8.0):
+        self.slot = slot
+        self.backend = backend
+        self.mixer = mixer
+
+        self.period = 1 / rate
+        self.max_step = slew * self.period if slew else None
+
+        self.target = (0.0, 0.0)
+        self.output = (0.0, 0.0)
+
+        self.ticks = 0
+        self.overruns = 0
+        self.periods = stats.RollingWindow(int(rate * 10))
+
+        self.log = logging.getLogger("control")
+
+    def all_stop(self, frame=None, writer=None):
+        # skips the slew limit, stopping has to be immediate
+        self.target = (0.0, 0.0)
+        self.output = (0.0, 0.0)
+        self.backend.stop()
+
+    def tick(self):
+        drive = self.slot.take()
+        if drive is not None:
+            self.target = self.mixer(drive)
+
+        if self.output == self.target:
+            return
+
+        self.output = tuple(
+            _slew(current, target, self.max_step)
+            for current, target in zip(self.output, self.target)
+        )
+        self.backend.set(*self.output)
+
+    async def run(self, stop_event):
+        loop = asyncio.get_running_loop()
+
+        next_tick = loop.time()
+        last = None
+
+        while not stop_event.is_set():
+            now = loop.time()
+            if last is not None:
+                self.periods.add(now - last)
+            last = now
+
+            self.tick()
+            self.ticks += 1
+
+            next_tick += self.period
+            delay = next_tick - loop.time()
+
+            if delay < 0:
+                # we missed at least one tick, start counting again from now
+                self.overruns += 1
+                next_tick = loop.time()
+                delay = 0
+
+            await asyncio.sleep(delay)
+
+        self.all_stop()
+
+    def stats(self):
+        pcts = self.periods.percentiles(50, 99)
+        return {
+            "ticks": self.ticks,
+            "overruns": self.overruns,
+            "period_p50": pcts[50],
+            "period_p99": pcts[99],
+        }
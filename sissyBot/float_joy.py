@@ -6,16 +6,17 @@ import math
 
 import kivy as kv
 import kivy.app
+import kivy.clock
+import kivy.graphics
 import kivy.properties
 import kivy.uix
 import kivy.uix.widget
 
 
 class Point:
-    def __init__(self, *args):
-        self.x = None
-        self.y = None
+    __slots__ = ("x", "y")
 
+    def __init__(self, *args):
         self.x, self.y = self._args_to_xy(args)
 
     def __getitem__(self, idx):
@@ -25,33 +26,25 @@ class Point:
             return self.y
         raise IndexError()
 
-    def _args_to_xy(self, args):
-        x = None
-        y = None
+    @staticmethod
+    def _args_to_xy(args):
         if len(args) == 1:
             arg = args[0]
-
-            if hasattr(arg, "x") and hasattr(arg, "y"):
+            # touches and Points on the move path, tuples on touch down
+            try:
                 return arg.x, arg.y
-
-            x = arg[0]
-            y = arg[1]
-            return x, y
+            except AttributeError:
+                return arg[0], arg[1]
 
         elif len(args) == 2:
-            x = args[0]
-            y = args[1]
-            return x, y
+            return args
 
         raise TypeError("Invalid type pass")
 
     def _rel_coord(self, args):
-        dx, dy = self._args_to_xy(args)
+        x, y = self._args_to_xy(args)
 
-        x_dist = dx - self.x
-        y_dist = dy - self.y
-
-        return x_dist, y_dist
+        return x - self.x, y - self.y
 
     def distance_to(self, *args):
         dx, dy = self._rel_coord(args)
@@ -63,6 +56,14 @@ class Point:
 
         return math.atan2(dy, dx)
 
+    def polar_to(self, *args):
+        """
+        (radians, distance) to a point, parsing it once.
+        """
+        dx, dy = self._rel_coord(args)
+
+        return math.atan2(dy, dx), math.hypot(dx, dy)
+
     def degrees_to(self, *args):
         return math.degrees(self.radians_to(*args))
 
@@ -93,20 +94,73 @@ class JoyPad(kv.uix.widget.Widget):
 
     trim = kv.properties.NumericProperty(0.0)
 
+    # fold touch moves into at most one on_move per frame, or per 1 / move_rate
+    # seconds when move_rate is set. engage and release are never held back
+    coalesce_moves = kv.properties.BooleanProperty(False)
+    move_rate = kv.properties.NumericProperty(0)
+    # raw touch moves behind the on_move being dispatched
+    folded = kv.properties.NumericProperty(1)
+
     def __init__(self, **kwargs):
         self._td_pt = None
-        self._td_pad = kv.graphics.InstructionGroup()
-        self._dir_indicator = kv.graphics.InstructionGroup()
         self._active_touch = None
 
+        self._pending_move = None
+        self._move_trigger = None
+        self.raw_moves = 0
+        self.moves_dispatched = 0
+
         self.register_event_type("on_engage")
         self.register_event_type("on_move")
         self.register_event_type("on_release")
 
         super(JoyPad, self).__init__(**kwargs)
 
-        self.canvas.add(self._td_pad)
-        self.canvas.add(self._dir_indicator)
+        # built once, touches only move them about
+        self._pad_fill = kv.graphics.Color()
+        self._pad = kv.graphics.Ellipse()
+        self._pad_line_color = kv.graphics.Color()
+        self._pad_line = kv.graphics.Line()
+        self._dish_fill = kv.graphics.Color()
+        self._dish = kv.graphics.Ellipse()
+        self._dish_line_color = kv.graphics.Color()
+        self._dish_line = kv.graphics.Line()
+        self._td_pad = kv.graphics.InstructionGroup()
+        for instruction in (
+            self._pad_fill,
+            self._pad,
+            self._pad_line_color,
+            self._pad_line,
+            self._dish_fill,
+            self._dish,
+            self._dish_line_color,
+            self._dish_line,
+        ):
+            self._td_pad.add(instruction)
+
+        self._base_line_color = kv.graphics.Color()
+        self._base_line = kv.graphics.Line()
+        self._shaft_fill = kv.graphics.Color()
+        self._base = kv.graphics.Ellipse()
+        self._shaft = kv.graphics.Line()
+        self._knob_fill = kv.graphics.Color()
+        self._knob = kv.graphics.Ellipse()
+        self._knob_line_color = kv.graphics.Color()
+        self._knob_line = kv.graphics.Line()
+        self._dir_indicator = kv.graphics.InstructionGroup()
+        for instruction in (
+            self._base_line_color,
+            self._base_line,
+            self._shaft_fill,
+            self._base,
+            self._shaft,
+            self._knob_fill,
+            self._knob,
+            self._knob_line_color,
+            self._knob_line,
+        ):
+            self._dir_indicator.add(instruction)
+        self._stick_shown = False
 
     def on_engage(self):
         pass
@@ -117,6 +171,40 @@ class JoyPad(kv.uix.widget.Widget):
     def on_release(self):
         pass
 
+    def on_move_rate(self, *args):
+        # the next move makes a trigger with the new timeout
+        if self._move_trigger is not None:
+            self._move_trigger.cancel()
+            self._move_trigger = None
+            self._flush_move(0)
+
+    def _queue_move(self, theta, rho):
+        if self._pending_move is None:
+            if self._move_trigger is None:
+                timeout = 1 / self.move_rate if self.move_rate > 0 else 0
+                self._move_trigger = kv.clock.Clock.create_trigger(
+                    self._flush_move, timeout
+                )
+            self._pending_move = [theta, rho, 0]
+            self._move_trigger()
+
+        pending = self._pending_move
+        pending[0] = theta
+        pending[1] = rho
+        pending[2] += 1
+
+    def _flush_move(self, dt):
+        if self._pending_move is None:
+            return
+        theta, rho, folded = self._pending_move
+        self._pending_move = None
+        self._dispatch_move(theta, rho, folded)
+
+    def _dispatch_move(self, theta, rho, folded):
+        self.folded = folded
+        self.moves_dispatched += 1
+        self.dispatch("on_move", theta, rho)
+
     def _cal_sizes(self):
         min_size = min(self.width, self.height)
         self.pad_radius = (min_size * self.pad_size) / 2
@@ -124,22 +212,38 @@ class JoyPad(kv.uix.widget.Widget):
 
         self.shaft_width = self.knob_radius * self.shaft_size
 
-    def _draw_circle(self, x, y, radius):
+    @staticmethod
+    def _place_circle(ellipse, x, y, radius):
         diam = radius * 2
-        return kv.graphics.Ellipse(pos=(x - radius, y - radius), size=[diam, diam])
+        ellipse.pos = (x - radius, y - radius)
+        ellipse.size = (diam, diam)
 
     def _draw_pad(self, x, y):
-        self._td_pad.clear()
-        self._td_pad.add(kv.graphics.Color(rgb=self.pad_color))
-        self._td_pad.add(self._draw_circle(x, y, self.pad_radius))
-        self._td_pad.add(kv.graphics.Color(rgb=self.pad_outline))
-        self._td_pad.add(kv.graphics.Line(circle=(x, y, self.pad_radius)))
+        """
+        Puts the pad and the base of the stick at x, y, with the current
+        colours and sizes, and shows the pad.
+        """
+        self._pad_fill.rgb = self.pad_color
+        self._place_circle(self._pad, x, y, self.pad_radius)
+        self._pad_line_color.rgb = self.pad_outline
+        self._pad_line.circle = (x, y, self.pad_radius)
 
         dish_radius = self.pad_radius * self.dish_size
-        self._td_pad.add(kv.graphics.Color(rgb=self.dish_color))
-        self._td_pad.add(self._draw_circle(x, y, dish_radius))
-        self._td_pad.add(kv.graphics.Color(rgb=self.pad_outline))
-        self._td_pad.add(kv.graphics.Line(circle=(x, y, dish_radius)))
+        self._dish_fill.rgb = self.dish_color
+        self._place_circle(self._dish, x, y, dish_radius)
+        self._dish_line_color.rgb = self.pad_outline
+        self._dish_line.circle = (x, y, dish_radius)
+
+        self._base_line_color.rgb = self.knob_outline
+        self._base_line.circle = (x, y, self.shaft_width)
+        self._shaft_fill.rgb = self.shaft_color
+        self._place_circle(self._base, x, y, self.shaft_width)
+        self._shaft.width = self.shaft_width
+        self._knob_fill.rgb = self.knob_color
+        self._knob.size = (self.knob_radius * 2, self.knob_radius * 2)
+        self._knob_line_color.rgb = self.knob_outline
+
+        self.canvas.add(self._td_pad)
 
     def on_touch_down(self, touch):
         if self._active_touch:
@@ -161,35 +265,22 @@ class JoyPad(kv.uix.widget.Widget):
         return True
 
     def _draw_stick(self, x, y):
-
         pad = self._td_pt
-        self._dir_indicator.clear()
+        radius = self.knob_radius
 
-        self._dir_indicator.add(kv.graphics.Color(rgb=self.knob_outline))
-        self._dir_indicator.add(
-            kv.graphics.Line(circle=(pad.x, pad.y, self.shaft_width))
-        )
+        self._shaft.points = (pad.x, pad.y, x, y)
+        self._knob.pos = (x - radius, y - radius)
+        self._knob_line.circle = (x, y, radius)
 
-        self._dir_indicator.add(kv.graphics.Color(rgb=self.shaft_color))
-
-        self._dir_indicator.add(self._draw_circle(pad.x, pad.y, self.shaft_width))
-
-        self._dir_indicator.add(
-            kv.graphics.Line(points=[pad.x, pad.y, x, y], width=self.shaft_width)
-        )
-
-        self._dir_indicator.add(kv.graphics.Color(rgb=self.knob_color))
-        self._dir_indicator.add(self._draw_circle(x, y, self.knob_radius))
-
-        self._dir_indicator.add(kv.graphics.Color(rgb=self.knob_outline))
-        self._dir_indicator.add(kv.graphics.Line(circle=(x, y, self.knob_radius)))
+        if not self._stick_shown:
+            self.canvas.add(self._dir_indicator)
+            self._stick_shown = True
 
     def on_touch_move(self, touch):
         if touch is not self._active_touch:
             return super().on_touch_move(touch)
 
-        rho = self._td_pt.distance_to(touch)
-        theta = self._td_pt.radians_to(touch)
+        theta, rho = self._td_pt.polar_to(touch)
 
         if rho > self.pad_radius:
             x, y = self._td_pt.polar_from(theta, self.pad_radius)
@@ -211,7 +302,11 @@ class JoyPad(kv.uix.widget.Widget):
                 theta = theta % -math.pi
                 theta = math.pi + theta
 
-        self.dispatch("on_move", theta, rho)
+        self.raw_moves += 1
+        if self.coalesce_moves:
+            self._queue_move(theta, rho)
+        else:
+            self._dispatch_move(theta, rho, 1)
         return True
 
     def on_touch_up(self, touch):
@@ -219,8 +314,14 @@ class JoyPad(kv.uix.widget.Widget):
             return super().on_touch_move(touch)
 
         self._active_touch = None
-        self._td_pad.clear()
-        self._dir_indicator.clear()
+        # a move left over would drive again after the release
+        if self._pending_move is not None:
+            self._move_trigger.cancel()
+            self._pending_move = None
+        self.canvas.remove(self._td_pad)
+        if self._stick_shown:
+            self.canvas.remove(self._dir_indicator)
+            self._stick_shown = False
 
         self.dispatch("on_release")
 
@@ -0,0 +1,148 @@
+"""
+Heartbeats over a PacketProcessor connection using the ping frame.
+
+The client stamps each DriveHeartBeat with a wrapping millisecond clock and
+the server echoes it back unchanged, so only the client's clock matters for
+the round trip time. The server also watches the gaps between heartbeats
+and calls an all stop if they stop arriving.
+"""
+
+import asyncio
+import logging
+import time
+
+import sissyBot.proto.packet_pb2 as packet_pb2
+import sissyBot.stats as stats
+
+TIME_MASK = 0x7FFFFFFF  # DriveHeartBeat.time is an int32
+
+
+def now_ms():
+    return int(time.monotonic() * 1000) & TIME_MASK
+
+
+def elapsed_ms(stamp):
+    return (now_ms() - stamp) & TIME_MASK
+
+
+class HeartbeatSender:
+    """
+    Client side. run() sends `rate` heartbeats a second with send_pkt,
+    handle_echo() is the ping handler for the echoes coming back.
+    """
+
+    def __init__(self, send_pkt, rate=10.0, window=500):
+        self.send_pkt = send_pkt
+        self.period = 1 / rate
+
+        self.sent = 0
+        self.received = 0
+        self.rtt = stats.RollingWindow(window)
+        self.jitter = stats.RollingWindow(window)
+        self.last_echo = None  # time.monotonic() of the latest echo
+        self._last_rtt = None
+
+    async def run(self, stop_event):
+        while not stop_event.is_set():
+            pkt = packet_pb2.Packet()
+            pkt.ping.time = now_ms()
+            self.send_pkt(pkt)
+            self.sent += 1
+
+            await asyncio.sleep(self.period)
+
+    def handle_echo(self, frame, writer):
+        rtt = elapsed_ms(frame.time) / 1000
+
+        self.last_echo = time.monotonic()
+        self.received += 1
+        self.rtt.add(rtt)
+        if self._last_rtt is not None:
+            self.jitter.add(abs(rtt - self._last_rtt))
+        self._last_rtt = rtt
+
+    def stats(self):
+        rtt = self.rtt.percentiles(50, 99)
+        jitter = self.jitter.percentiles(50, 99)
+        return {
+            "sent": self.sent,
+            "received": self.received,
+            "rtt_p50": rtt[50],
+            "rtt_p99": rtt[99],
+            "jitter_p50": jitter[50],
+            "jitter_p99": jitter[99],
+        }
+
+
+class HeartbeatMonitor:
+    """
+    Server side ping handler. Echoes every heartbeat with send_pkt and keeps
+    the gaps between them.
+
+    Once heartbeats have started, run() calls on_timeout() if none arrive for
+    `deadline` seconds, once per outage. Clients that never send heartbeats
+    are left alone.
+    """
+
+    def __init__(self, send_pkt, on_timeout, deadline=0.5, window=500):
+        self.send_pkt = send_pkt
+        self.on_timeout = on_timeout
+        self.deadline = deadline
+
+        self.received = 0
+        self.timeouts = 0
+        self.gaps = stats.RollingWindow(window)
+        self.jitter = stats.RollingWindow(window)
+
+        self._last = None
+        self._last_gap = None
+        self._tripped = False
+
+        self.log = logging.getLogger("heartbeat")
+
+    def __call__(self, frame, writer):
+        now = time.monotonic()
+
+        pkt = packet_pb2.Packet()
+        pkt.ping.time = frame.time
+        self.send_pkt(pkt)
+
+        if self._last is not None:
+            gap = now - self._last
+            self.gaps.add(gap)
+            if self._last_gap is not None:
+                self.jitter.add(abs(gap - self._last_gap))
+            self._last_gap = gap
+
+        if self._tripped:
+            self.log.info("heartbeats back")
+            self._tripped = False
+
+        self._last = now
+        self.received += 1
+
+    async def run(self, stop_event):
+        while not stop_event.is_set():
+            await asyncio.sleep(self.deadline / 4)
+
+            if self._last is None or self._tripped:
+                continue
+
+            if time.monotonic() - self._last > self.deadline:
+                self.log.error(f"No heartbeat for {self.deadline}s, stopping")
+                self._tripped = True
+                self._last_gap = None
+                self.timeouts += 1
+                self.on_timeout()
+
+    def stats(self):
+        gaps = self.gaps.percentiles(50, 99)
+        jitter = self.jitter.percentiles(50, 99)
+        return {
+            "received": self.received,
+            "timeouts": self.timeouts,
+            "gap_p50": gaps[50],
+            "gap_p99": gaps[99],
+            "jitter_p50": jitter[50],
+            "jitter_p99": jitter[99],
+        }
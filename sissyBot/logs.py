@@ -0,0 +1,169 @@
+"""
+Logging that keeps formatting and I/O off the control path.
+
+QueueLogging puts a handler on the root logger that only queues records, and
+a QueueListener thread formats and writes them, so a log call on the event
+loop costs a LogRecord and a queue put however slow stdout is. Unlike the
+stdlib QueueHandler nothing is formatted before queueing, so log with
+%-style args rather than f-strings and don't pass anything that changes
+afterwards.
+
+Levels are given as a spec like "info,motors=debug,nats=warning": a bare
+level for the root logger, name=level for the others. Without one the
+SISSYBOT_LOG environment variable is used, then DEFAULT_LEVELS.
+
+Loggers that see every drive frame or control tick get a RateLimit filter on
+their debug records.
+"""
+
+import logging
+import logging.handlers
+import os
+import queue
+import time
+
+ENV_VAR = "SISSYBOT_LOG"
+DEFAULT_LEVELS = "info"
+FORMAT = "%(asctime)-15s %(message)s"
+
+# per frame or per tick loggers, and the debug records a second they're allowed
+RATE_LIMITED = ("drive handler", "motors", "drive binding")
+RATE = 10.0
+
+
+def parse_levels(spec):
+    """ "info,nats=debug" -> {None: logging.INFO, "nats": logging.DEBUG}"""
+    levels = {}
+    for part in spec.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        name, _, level_name = part.rpartition("=")
+        level = logging.getLevelName(level_name.strip().upper())
+        if not isinstance(level, int):
+            raise ValueError(f"Unknown log level {level_name!r} in {spec!r}")
+        levels[name.strip() or None] = level
+    return levels
+
+
+def level_spec(spec):
+    """Checks a level spec, as an argparse type."""
+    parse_levels(spec)
+    return spec
+
+
+def set_levels(spec=None):
+    """Applies a level spec, see the module docstring."""
+    if spec is None:
+        spec = os.environ.get(ENV_VAR) or DEFAULT_LEVELS
+    for name, level in parse_levels(spec).items():
+        logging.getLogger(name).setLevel(level)
+
+
+class RateLimit(logging.Filter):
+    """
+    Lets through `rate` records a second on average, in bursts of up to
+    `burst`, and drops the rest. The next record let through after a drop
+    says how many went.
+
+    Only records below `level`, INFO by default, are limited: the per frame
+    and per tick traffic is debug, and events like an all stop must always
+    make it to the log.
+    """
+
+    def __init__(self, rate=RATE, burst=None, level=logging.INFO):
+        super().__init__()
+        self.rate = rate
+        self.level = level
+        self.burst = burst if burst is not None else max(1.0, rate)
+        self.dropped = 0
+
+        self._tokens = self.burst
+        self._last = time.monotonic()
+        self._since = 0  # dropped since the last one let through
+
+    def filter(self, record):
+        if record.levelno >= self.level:
+            return True
+
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._last) * self.rate)
+        self._last = now
+
+        if self._tokens < 1:
+            self.dropped += 1
+            self._since += 1
+            return False
+
+        self._tokens -= 1
+        if self._since:
+            record.msg = f"{record.msg} ({self._since} dropped)"
+            self._since = 0
+        return True
+
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that leaves formatting to the listener's handlers."""
+
+    def prepare(self, record):
+        return record
+
+
+class SendHandler(logging.handlers.QueueHandler):
+    """
+    Hands records to `send`, e.g. a multiprocessing Connection's, for another
+    process to log. Unlike DeferredQueueHandler the message is formatted
+    first, so the records pickle.
+    """
+
+    def __init__(self, send):
+        super().__init__(None)
+        self.send = send
+
+    def enqueue(self, record):
+        self.send(record)
+
+
+class QueueLogging:
+    """
+    Routes the root logger through a queue to `handlers`, a stderr
+    StreamHandler by default. start() it once logging is wanted and stop() it
+    on the way out, which writes whatever is still queued.
+
+    rate=0 turns off the rate limits on RATE_LIMITED loggers.
+    """
+
+    def __init__(self, handlers=None, levels=None, rate=RATE):
+        if handlers is None:
+            handler = logging.StreamHandler()
+            handler.setFormatter(logging.Formatter(FORMAT))
+            handlers = [handler]
+
+        self.levels = levels
+        self.queue = queue.SimpleQueue()
+        self.handler = DeferredQueueHandler(self.queue)
+        self.listener = logging.handlers.QueueListener(
+            self.queue, *handlers, respect_handler_level=True
+        )
+        self.limits = {name: RateLimit(rate) for name in RATE_LIMITED} if rate else {}
+
+    def start(self):
+        set_levels(self.levels)
+        for name, limit in self.limits.items():
+            logging.getLogger(name).addFilter(limit)
+
+        logging.getLogger().addHandler(self.handler)
+        self.listener.start()
+
+    def stop(self):
+        logging.getLogger().removeHandler(self.handler)
+        for name, limit in self.limits.items():
+            logging.getLogger(name).removeFilter(limit)
+
+        self.listener.stop()
+
+    def stats(self):
+        return {
+            "queued": self.queue.qsize(),
+            **{f"dropped {name}": limit.dropped for name, limit in self.limits.items()},
+        }
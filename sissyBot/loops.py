@@ -0,0 +1,52 @@
+"""
+Event loop selection for sbs and the NATS worker.
+
+"asyncio" is the standard loop, "uvloop" uses uvloop and "auto" uses uvloop
+when it is installed. Asking for uvloop without it installed logs a warning
+and falls back to the standard loop. Without an explicit choice the
+SISSYBOT_LOOP environment variable is used, so spawned worker processes pick
+up the same setting.
+"""
+
+import asyncio
+import logging
+import os
+
+ENV_VAR = "SISSYBOT_LOOP"
+LOOPS = ("asyncio", "uvloop", "auto")
+
+log = logging.getLogger("loops")
+
+
+def loop_factory(name=None):
+    """Returns a callable making a new event loop, or None for the default."""
+    if name is None:
+        name = os.environ.get(ENV_VAR) or "asyncio"
+
+    if name not in LOOPS:
+        raise ValueError(f"Unknown event loop {name!r}, expected one of {LOOPS}")
+
+    if name == "asyncio":
+        return None
+
+    try:
+        import uvloop
+    except ImportError:
+        if name == "uvloop":
+            log.warning("uvloop is not installed, using the asyncio event loop")
+        return None
+
+    return uvloop.new_event_loop
+
+
+def new_event_loop(name=None):
+    factory = loop_factory(name)
+    if factory is None:
+        return asyncio.new_event_loop()
+    return factory()
+
+
+def run(main, name=None):
+    """asyncio.run() on the selected loop."""
+    with asyncio.Runner(loop_factory=loop_factory(name)) as runner:
+        return runner.run(main)
@@ -0,0 +1,156 @@
+"""
+sbs's counters in the Prometheus text format, served over plain HTTP.
+
+An Exporter holds collectors, callables returning lines of the format, and
+renders them all on each scrape. Nothing is computed between scrapes.
+"""
+
+import asyncio
+import re
+
+import sissyBot.net as net
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# histogram bucket bounds, in seconds
+BOUNDS = (1e-6, 2.5e-6, 5e-6, 1e-5, 2.5e-5, 5e-5, 1e-4, 2.5e-4, 5e-4, 1e-3, 1e-2, 0.1)
+
+MAX_REQUEST = 8192
+
+
+def _labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{value}"' for key, value in labels.items()) + "}"
+
+
+def metric(name, kind, help_, samples):
+    """Lines for one metric, samples being [(labels dict or None, value)]."""
+    lines = [f"# HELP {name} {help_}", f"# TYPE {name} {kind}"]
+    lines.extend(f"{name}{_labels(labels)} {value}" for labels, value in samples)
+    return lines
+
+
+def histogram(name, help_, histograms, scale=1e-9):
+    """
+    Lines for stats.Histograms, given as [(labels dict or None, histogram)].
+    scale turns their units into the metric's, ns to seconds by default.
+    """
+    lines = [f"# HELP {name} {help_}", f"# TYPE {name} histogram"]
+    for labels, hist in histograms:
+        labels = labels or {}
+        bounds = [bound / scale for bound in BOUNDS]
+        for bound, count in hist.cumulative(bounds):
+            bucket = _labels({**labels, "le": f"{bound * scale:g}"})
+            lines.append(f"{name}_bucket{bucket} {count}")
+        lines.append(f"{name}_bucket{_labels({**labels, 'le': '+Inf'})} {hist.count}")
+        lines.append(f"{name}_sum{_labels(labels)} {hist.total * scale:.9g}")
+        lines.append(f"{name}_count{_labels(labels)} {hist.count}")
+    return lines
+
+
+def stats_gauges(prefix, stats):
+    """A gauge for each number in a stats() dict, e.g. ConnectionManager's."""
+    lines = []
+    for key, value in stats.items():
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            continue
+        name = f"{prefix}_{re.sub(r'[^a-zA-Z0-9_]', '_', key)}"
+        lines.extend(metric(name, "gauge", key, [(None, value)]))
+    return lines
+
+
+def frame_metrics(metrics, prefix="sissybot"):
+    """Lines for a net.FrameMetrics."""
+
+    def frame_type(number):
+        return {"type": net.FRAME_TYPES.get(number, str(number))}
+
+    lines = []
+    lines += metric(
+        f"{prefix}_reads_total", "counter", "socket reads", [(None, metrics.reads)]
+    )
+    lines += metric(
+        f"{prefix}_read_bytes_total", "counter", "bytes read", [(None, metrics.bytes)]
+    )
+    lines += metric(
+        f"{prefix}_frames_total",
+        "counter",
+        "frames handled by type",
+        [(frame_type(number), count) for number, count in metrics.frames().items()],
+    )
+    lines += metric(
+        f"{prefix}_unhandled_frames_total",
+        "counter",
+        "frames with no handler",
+        [(None, metrics.unhandled)],
+    )
+    lines += histogram(
+        f"{prefix}_parse_seconds",
+        "time to decode a frame, of sampled reads",
+        [(None, metrics.parse_ns)],
+    )
+    lines += histogram(
+        f"{prefix}_handler_seconds",
+        "time in the handler per frame by type, of sampled reads",
+        [(frame_type(number), hist) for number, hist in metrics.handler_ns.items()],
+    )
+    return lines
+
+
+class Exporter:
+    """
+    Serves GET /metrics. add() collectors, functions taking no arguments and
+    returning lines, then pass handle to asyncio.start_server.
+    """
+
+    def __init__(self):
+        self.collectors = []
+        self.scrapes = 0
+
+    def add(self, collector):
+        self.collectors.append(collector)
+
+    def render(self):
+        lines = []
+        for collector in self.collectors:
+            lines.extend(collector())
+        lines += metric(
+            "sissybot_scrapes_total",
+            "counter",
+            "metrics scrapes",
+            [(None, self.scrapes)],
+        )
+        return "\n".join(lines) + "\n"
+
+    async def handle(self, reader, writer):
+        try:
+            request = await reader.readuntil(b"\r\n\r\n")
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError):
+            writer.close()
+            return
+
+        method, path, *_ = request.split(b" ", 2) + [b"", b""]
+        if method != b"GET" or path.split(b"?")[0] not in (b"/", b"/metrics"):
+            status, body = "404 Not Found", b"not found\n"
+            content_type = "text/plain"
+        else:
+            self.scrapes += 1
+            status, body = "200 OK", self.render().encode()
+            content_type = CONTENT_TYPE
+
+        head = (
+            f"HTTP/1.0 {status}\r\n"
+            f"Content-Type: {content_type}\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            "Connection: close\r\n\r\n"
+        )
+        writer.write(head.encode() + body)
+        try:
+            await writer.drain()
+        except ConnectionError:
+            pass
+        writer.close()
+
+    async def start(self, host="127.0.0.1", port=9464):
+        return await asyncio.start_server(self.handle, host, port, limit=MAX_REQUEST)
@@ -0,0 +1,64 @@
+"""
+Motor mixing: drive heading and throttle to left and right motor outputs.
+
+The curves are sampled once into lookup tables so the control loop does a
+couple of list lookups per command instead of trig.
+"""
+
+import math
+
+
+def sine_curve(gain=1.6):
+    def curve(x):
+        y = math.sin(math.radians(x)) * gain
+        y = max(-1, min(1, y))
+        return round(y, 5)
+
+    return curve
+
+
+class Mixer:
+    """
+    Table driven version of server.motor_calc.
+
+    `curve` maps degrees to a motor output in [-1, 1] and is sampled every
+    `resolution` degrees, offset by `l_offset`/`r_offset` for each motor.
+    """
+
+    def __init__(self, curve=None, resolution=1.0, l_offset=135, r_offset=45):
+        if curve is None:
+            curve = sine_curve()
+
+        self.resolution = resolution
+        self.steps = round(360 / resolution)
+
+        self.l_table = [curve(i * resolution + l_offset) for i in range(self.steps)]
+        self.r_table = [curve(i * resolution + r_offset) for i in range(self.steps)]
+
+        self._np_tables = None
+
+    def _index(self, heading):
+        return round(heading / self.resolution) % self.steps
+
+    def motor_calc(self, drive):
+        idx = self._index(drive.heading)
+        throttle = drive.throttle
+        return self.l_table[idx] * throttle, self.r_table[idx] * throttle
+
+    def motor_calc_batch(self, headings, throttles):
+        """
+        Mix whole arrays of commands at once, for replay and simulation.
+
+        Needs numpy. Returns a (left, right) pair of arrays.
+        """
+        import numpy as np
+
+        if self._np_tables is None:
+            self._np_tables = np.array(self.l_table), np.array(self.r_table)
+        l_table, r_table = self._np_tables
+
+        headings = np.asarray(headings, dtype=np.float64)
+        throttles = np.asarray(throttles, dtype=np.float64)
+
+        idx = np.rint(headings / self.resolution).astype(np.int64) % self.steps
+        return l_table[idx] * throttles, r_table[idx] * throttles
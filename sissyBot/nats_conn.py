@@ -0,0 +1,269 @@
+"""
+The NATS client end of the robot connection. Only imported where it runs, in
+the NatsProc worker process or by NatsThread.
+"""
+
+import asyncio
+import collections
+import logging
+import random
+import time
+
+# from nats.aio.client import Client as NATS
+import nats.aio.client
+
+# not nats.aio.errors, its Err* names subclass these and so never match what
+# the client raises
+import nats.errors
+
+from sissyBot.nats_proc import NEVER_DROP, ConnState, ConnStatus
+
+RTT_INTERVAL = 2.0
+# least time between status reports for publishes buffered while down
+STATUS_INTERVAL = 0.25
+
+# While disconnected only the newest of these is worth sending, and
+# nats_proc.NEVER_DROP ones are never dropped from the buffer.
+LATEST_ONLY = {"drive.cmd"}
+
+
+class SubBatcher:
+    """
+    Collects (sid, subject, payload) records from NATS subscription callbacks
+    and hands them to `send` as one list per turn of the event loop.
+    """
+
+    def __init__(self, send):
+        self.send = send
+        self.batch = []
+        self.subjects = {}
+        self.subs = {}
+
+    def _callback(self, sid):
+        async def sub_callback(msg):
+            if not self.batch:
+                asyncio.get_running_loop().call_soon(self.flush)
+            self.batch.append((sid, msg.subject, msg.data))
+
+        return sub_callback
+
+    async def subscribe(self, nc, sid, subject):
+        """Subscribe now if nc is connected, otherwise on the next resubscribe()."""
+        self.subjects[sid] = subject
+        if nc is not None and nc.is_connected:
+            self.subs[sid] = await nc.subscribe(subject, cb=self._callback(sid))
+
+    async def resubscribe(self, nc):
+        self.subs = {}
+        for sid, subject in list(self.subjects.items()):
+            if sid not in self.subs:
+                self.subs[sid] = await nc.subscribe(subject, cb=self._callback(sid))
+
+    async def unsubscribe(self, sid):
+        self.subjects.pop(sid, None)
+        sub = self.subs.pop(sid, None)
+        if sub is None:
+            return
+
+        try:
+            await sub.unsubscribe()
+        except nats.errors.ConnectionClosedError:
+            pass
+
+    def flush(self):
+        batch, self.batch = self.batch, []
+        if batch:
+            self.send(batch)
+
+
+class ManagedConnection:
+    """
+    Keeps a NATS connection up for a backend.
+
+    Connects with jittered exponential backoff and starts again the same way
+    whenever the connection drops, rather than giving up. Publishes made while
+    down are buffered, up to max_buffered, and sent once connected again.
+    Only the newest buffered LATEST_ONLY message is kept, and only sent if it
+    is younger than max_latest_age by then, so a long outage doesn't end with
+    the robot acting on a stale joystick position. NEVER_DROP ones are never
+    thrown away. Subscriptions in `subs` are made again on every connect.
+    State goes to `report` as ConnStatus messages.
+    """
+
+    def __init__(
+        self,
+        addr,
+        report,
+        subs,
+        min_backoff=0.1,
+        max_backoff=5.0,
+        max_buffered=64,
+        max_latest_age=0.3,
+    ):
+        self.addr = addr
+        self.report = report
+        self.subs = subs
+
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+        self.max_buffered = max_buffered
+        self.max_latest_age = max_latest_age
+
+        self.nc = None
+        self.buffer = collections.deque()
+        self.dropped = 0
+        self.published = 0
+        self.reconnect_time = None
+        self._last_status = 0.0
+        self._closing = False
+        self._error_logged = False
+
+        self.log = logging.getLogger("nats")
+
+    @property
+    def connected(self):
+        return self.nc is not None and self.nc.is_connected
+
+    def status(self, state, rtt=None):
+        self._last_status = time.monotonic()
+        self.report(
+            ConnStatus(
+                state,
+                rtt,
+                self.reconnect_time,
+                len(self.buffer),
+                self.dropped,
+                self.published,
+            )
+        )
+
+    async def run(self):
+        backoff = self.min_backoff
+        down_since = None
+
+        while True:
+            nc = nats.aio.client.Client()
+            closed = asyncio.Event()
+
+            async def closed_cb():
+                closed.set()
+
+            try:
+                # allow_reconnect=False only covers dropped connections. The
+                # first connect retries every 2 s for up to 60 tries unless
+                # told otherwise, which would hide the outage from us. This
+                # way it gives up after a second immediate try.
+                await nc.connect(
+                    self.addr,
+                    allow_reconnect=False,
+                    max_reconnect_attempts=1,
+                    reconnect_time_wait=0,
+                    closed_cb=closed_cb,
+                    error_cb=self._on_error,
+                )
+            except (OSError, asyncio.TimeoutError, nats.errors.NoServersError) as e:
+                if down_since is None:
+                    down_since = time.monotonic()
+                    self.log.warning("can't connect to %s: %r", self.addr, e)
+                self.status(ConnState.RECONNECTING)
+
+                await asyncio.sleep(random.uniform(0, backoff))
+                backoff = min(backoff * 2, self.max_backoff)
+                continue
+
+            if down_since is not None:
+                self.reconnect_time = time.monotonic() - down_since
+                self.log.info(
+                    "connected to %s after %.2fs", self.addr, self.reconnect_time
+                )
+            else:
+                self.log.info("connected to %s", self.addr)
+            backoff = self.min_backoff
+            self._error_logged = False
+
+            self.nc = nc
+            await self.subs.resubscribe(nc)
+            await self._flush_buffer()
+            self.status(ConnState.UP)
+
+            rtt = asyncio.get_running_loop().create_task(self.rtt_task(nc))
+            await closed.wait()
+            rtt.cancel()
+
+            self.nc = None
+            down_since = time.monotonic()
+            if not self._closing:
+                self.log.warning("lost the connection to %s", self.addr)
+            self.status(ConnState.RECONNECTING)
+
+    async def _on_error(self, e):
+        # the nats client's default logs a traceback for every failed try,
+        # and nc.connect() keeps trying for a while before it raises
+        if self._error_logged:
+            self.log.debug("nats client error: %r", e)
+        else:
+            self._error_logged = True
+            self.log.warning("nats client error: %r", e)
+
+    async def close(self):
+        self._closing = True
+        if self.connected:
+            await self.nc.close()
+
+    async def publish(self, subject, payload):
+        if self.connected:
+            try:
+                await self.nc.publish(subject, payload)
+                self.published += 1
+                return
+            except nats.errors.ConnectionClosedError:
+                pass
+
+        self._buffer(subject, payload)
+        # a report per publish would flood the state pipe at the drive rate
+        if time.monotonic() - self._last_status >= STATUS_INTERVAL:
+            self.status(ConnState.RECONNECTING)
+
+    def _buffer(self, subject, payload):
+        if subject in LATEST_ONLY:
+            stale = [msg for msg in self.buffer if msg[0] == subject]
+            for msg in stale:
+                self.buffer.remove(msg)
+            self.dropped += len(stale)
+
+        self.buffer.append((subject, payload, time.monotonic()))
+
+        while len(self.buffer) > self.max_buffered:
+            victim = next(
+                (msg for msg in self.buffer if msg[0] not in NEVER_DROP), None
+            )
+            if victim is None:
+                break
+            self.buffer.remove(victim)
+            self.dropped += 1
+
+    async def _flush_buffer(self):
+        if self.buffer:
+            self.log.info("sending %d buffered publishes", len(self.buffer))
+        while self.buffer:
+            subject, payload, buffered_at = self.buffer.popleft()
+            if (
+                subject in LATEST_ONLY
+                and time.monotonic() - buffered_at > self.max_latest_age
+            ):
+                self.dropped += 1
+                continue
+            await self.nc.publish(subject, payload)
+            self.published += 1
+
+    async def rtt_task(self, nc, interval=RTT_INTERVAL):
+        while True:
+            await asyncio.sleep(interval)
+
+            start = time.perf_counter()
+            try:
+                await nc.flush()
+            except (nats.errors.TimeoutError, nats.errors.ConnectionClosedError):
+                continue
+
+            self.status(ConnState.UP, time.perf_counter() - start)
@@ -0,0 +1,345 @@
+"""
+Runs the robot's NATS connection away from the GUI, in a child process with
+NatsProc or a thread with NatsThread.
+
+Neither Kivy nor the NATS client is imported here, the worker imports
+sissyBot.nats_conn once it starts.
+"""
+
+import asyncio
+import enum
+import logging
+import multiprocessing
+import sys
+import threading
+import types
+from dataclasses import dataclass
+
+from sissyBot import logs, loops
+
+# Never dropped, by the shm ring or the reconnect buffer.
+NEVER_DROP = {"drive.all_stop"}
+
+
+# @dataclass
+class PubCmd:
+    subject: str
+    payload: bytes
+
+
+@dataclass
+class SubCmd:
+    sid: int
+    subject: str
+
+
+@dataclass
+class UnsubCmd:
+    sid: int
+
+
+@dataclass
+class LevelsCmd:
+    spec: str
+
+
+class ConnState(enum.Enum):
+    UP = 1
+    DOWN = 2
+    RECONNECTING = 3
+
+
+@dataclass
+class ConnStatus:
+    state: ConnState
+    rtt: float = None
+    reconnect_time: float = None
+    buffered: int = 0
+    dropped: int = 0
+    published: int = 0
+
+
+class NatsProc:
+    """
+    Runs the NATS client in a child process.
+
+    Commands go to the child over a Pipe. With transport="shm" publishes use a
+    shared memory ring instead, which skips pickling and the executor hop in
+    the child. Subscriptions and shutdown still go over the Pipe.
+
+    Messages too big for a ring slot go over the Pipe. publish() never waits
+    on a full ring. Ordinary messages are dropped and counted in
+    `ring_dropped`, NEVER_DROP ones go in the ring's reserved slots, or over
+    the Pipe once those are full too. That can overtake older messages still
+    in the ring, but a full ring always ends in a stop, as only reserved puts
+    can fill it.
+
+    The child's log records come back over the connection state Pipe, as
+    logging.LogRecords among the ConnStatuses, for the GUI to log. Its levels
+    are `log_levels`, a logs level spec, until set_log_levels() changes them.
+
+    `sent` counts publishes handed to the child, ConnStatus.published the
+    ones it has passed to NATS.
+    """
+
+    def __init__(self, transport="pipe", loop=None, log_levels=None):
+        self.proc = None
+        self.loop_name = loop
+        self.log_levels = log_levels
+
+        self.gui_end, self.proc_end = multiprocessing.Pipe()
+
+        self.sub_recv_end, self.sub_send_end = multiprocessing.Pipe(False)
+        self.conn_state_recv_end, self.conn_state_send_end = multiprocessing.Pipe(False)
+
+        self.sent = 0
+        self.ring_dropped = 0
+        self._ring_full = False
+
+        self.ring = None
+        if transport == "shm":
+            from sissyBot.shm_ring import ShmRing
+
+            self.ring = ShmRing()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["proc"] = None
+        return state
+
+    def connect(self, addr):
+        # spawn, so the child doesn't inherit pipe ends of other NatsProcs and
+        # keep them from ever seeing EOF
+        ctx = multiprocessing.get_context("spawn")
+        self.proc = ctx.Process(target=self.main, args=(addr,))
+
+        # spawn re-imports the parent's __main__ in the child, which for the
+        # GUI is all of Kivy. Nothing the worker runs lives there.
+        main = sys.modules["__main__"]
+        sys.modules["__main__"] = types.ModuleType("__main__")
+        try:
+            self.proc.start()
+        finally:
+            sys.modules["__main__"] = main
+
+        self.proc_end.close()
+        # so the receiving side sees EOF once the child is gone
+        self.conn_state_send_end.close()
+        self.sub_send_end.close()
+
+    def is_alive(self):
+        return self.proc is not None and self.proc.is_alive()
+
+    def close(self):
+        # self.gui_end.send(closeCmd())
+        self.gui_end.close()
+        self.proc.join()
+
+        if self.ring is not None:
+            self.ring.close()
+            self.ring.unlink()
+
+    def publish(self, subject, payload):
+        encoded = subject.encode()
+        # too big for a slot, the Pipe takes anything
+        if self.ring is not None and self.ring.fits(encoded, payload):
+            if self.ring.put(encoded, payload, subject in NEVER_DROP):
+                self._ring_full = False
+                self.sent += 1
+                return
+
+            if subject not in NEVER_DROP:
+                self.ring_dropped += 1
+                if not self._ring_full:
+                    self._ring_full = True
+                    logging.getLogger("nats").warning(
+                        "Publish ring full, dropping until it drains"
+                    )
+                return
+
+        cmd = PubCmd()
+        cmd.subject = subject
+        cmd.payload = payload
+        self.gui_end.send(cmd)
+        self.sent += 1
+
+    def subscribe(self, sid, subject):
+        self.gui_end.send(SubCmd(sid, subject))
+
+    def unsubscribe(self, sid):
+        self.gui_end.send(UnsubCmd(sid))
+
+    def set_log_levels(self, spec):
+        self.log_levels = spec
+        self.gui_end.send(LevelsCmd(spec))
+
+    def _send_state(self, msg):
+        # log records can come from any thread of the child
+        with self._state_lock:
+            self.conn_state_send_end.send(msg)
+
+    async def _shutdown(self):
+        self.sub_send_end.close()
+        self.proc_end.close()
+
+        if self.ring is not None:
+            loop = asyncio.get_running_loop()
+            loop.remove_reader(self.ring.doorbell_recv.fileno())
+            self.ring.close()
+
+        await self.conn.close()
+
+        tasks = [
+            task for task in asyncio.all_tasks() if task is not asyncio.current_task()
+        ]
+
+        for task in tasks:
+            task.cancel()
+
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+
+        self._send_state(ConnStatus(ConnState.DOWN))
+
+    def main(self, addr):
+        # close the gui end here
+        self.gui_end.close()
+
+        self._state_lock = threading.Lock()
+        logging.getLogger().addHandler(logs.SendHandler(self._send_state))
+        logs.set_levels(self.log_levels)
+
+        loops.run(self.main_task(addr), self.loop_name)
+
+    async def main_task(self, addr):
+        from sissyBot.nats_conn import ManagedConnection, SubBatcher
+
+        loop = asyncio.get_running_loop()
+        subs = SubBatcher(self.sub_send_end.send)
+        self.conn = ManagedConnection(addr, self._send_state, subs)
+
+        loop.create_task(self.conn.run())
+        if self.ring is not None:
+            loop.create_task(self.ring_task())
+
+        while True:
+
+            try:
+                cmd = await loop.run_in_executor(None, self.proc_end.recv)
+            except EOFError:
+                await self._shutdown()
+
+                return
+
+            if isinstance(cmd, PubCmd):
+                await self.conn.publish(cmd.subject, cmd.payload)
+
+            elif isinstance(cmd, SubCmd):
+                await subs.subscribe(self.conn.nc, cmd.sid, cmd.subject)
+
+            elif isinstance(cmd, UnsubCmd):
+                await subs.unsubscribe(cmd.sid)
+
+            elif isinstance(cmd, LevelsCmd):
+                logs.set_levels(cmd.spec)
+
+    async def ring_task(self):
+        wake = asyncio.Event()
+        asyncio.get_running_loop().add_reader(
+            self.ring.doorbell_recv.fileno(), wake.set
+        )
+
+        while True:
+            self.ring.clear_doorbell()
+
+            for sub, payload in self.ring.drain():
+                await self.conn.publish(sub, payload)
+
+            await wake.wait()
+            wake.clear()
+
+
+class NatsThread:
+    """
+    Runs the NATS client on an asyncio loop in a thread of this process.
+
+    Same publish/subscribe/close interface as NatsProc, without the process
+    start up or the IPC hop. Connection state is handed to `on_status` and
+    batches of subscription records to `on_msgs`, both from the NATS thread.
+    """
+
+    def __init__(self, on_status, on_msgs, loop=None):
+        from sissyBot.nats_conn import SubBatcher
+
+        self.on_status = on_status
+        self.subs = SubBatcher(on_msgs)
+
+        self.loop = loops.new_event_loop(loop)
+        self.thread = None
+        self.conn = None
+        self.sent = 0
+        # commands queue up here until the connection is made
+        self.cmd_queue = asyncio.Queue()
+
+    def connect(self, addr):
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+        asyncio.run_coroutine_threadsafe(self.main_task(addr), self.loop)
+
+    def is_alive(self):
+        return self.thread is not None and self.thread.is_alive()
+
+    def _run(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+        self.loop.close()
+
+    def close(self):
+        future = asyncio.run_coroutine_threadsafe(self._shutdown(), self.loop)
+        future.result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+
+    def _send(self, cmd):
+        self.loop.call_soon_threadsafe(self.cmd_queue.put_nowait, cmd)
+
+    def publish(self, subject, payload):
+        cmd = PubCmd()
+        cmd.subject = subject
+        cmd.payload = payload
+        self._send(cmd)
+        self.sent += 1
+
+    def subscribe(self, sid, subject):
+        self._send(SubCmd(sid, subject))
+
+    def unsubscribe(self, sid):
+        self._send(UnsubCmd(sid))
+
+    async def _shutdown(self):
+        for task in asyncio.all_tasks():
+            if task is not asyncio.current_task():
+                task.cancel()
+
+        if self.conn is not None:
+            await self.conn.close()
+
+        self.on_status(ConnStatus(ConnState.DOWN))
+
+    async def main_task(self, addr):
+        from sissyBot.nats_conn import ManagedConnection
+
+        self.conn = ManagedConnection(addr, self.on_status, self.subs)
+        self.loop.create_task(self.conn.run())
+
+        while True:
+            cmd = await self.cmd_queue.get()
+
+            if isinstance(cmd, PubCmd):
+                await self.conn.publish(cmd.subject, cmd.payload)
+            elif isinstance(cmd, SubCmd):
+                await self.subs.subscribe(self.conn.nc, cmd.sid, cmd.subject)
+            elif isinstance(cmd, UnsubCmd):
+                await self.subs.unsubscribe(cmd.sid)
@@ -1,113 +1,1003 @@
 import asyncio
-import logging
-import sys
-import traceback
+import collections
+import struct
+import time
 
-from dataclasses import dataclass
-from enum import Enum
+from google.protobuf.message import DecodeError
 
 import sissyBot.errors as errors
+import sissyBot.packed as packed
 import sissyBot.proto.packet_pb2 as packet_pb2
-
+import sissyBot.stats as stats
 
 LEN_HEADER = 1
 LEN_ORDER = "big"
 
+MAX_FRAME = 1 << 20
+
+# Framing modes a client can ask for when the connection opens. A client
+# that sends no handshake gets FRAMING_BYTE, which is what older clients speak.
+FRAMING_BYTE = 1
+FRAMING_VARINT = 2
+FRAMING_U32 = 3
+
+# A zero length is never valid in the 1 byte framing, so it marks a handshake.
+HANDSHAKE = 0
+
+# Optional features ride in the top bit of the handshake's mode byte. The
+# server acks the ones it supports.
+FRAMING_MASK = 0x7F
+FEATURE_PACKED = 0x80  # client may send sissyBot.packed drive frames
+FEATURES = FEATURE_PACKED
+
+# Datagrams are a sequence number followed by one serialized Packet.
+DGRAM_SEQ = struct.Struct(">I")
+SEQ_MOD = 1 << 32
+
+
+class FixedHeader:
+    def __init__(self, width):
+        self.width = width
+
+    def encode(self, len_):
+        return len_.to_bytes(length=self.width, byteorder=LEN_ORDER, signed=False)
+
+    def decode(self, view, start, end):
+        hdr_end = start + self.width
+        if hdr_end > end:
+            return None
+
+        len_ = int.from_bytes(view[start:hdr_end], byteorder=LEN_ORDER)
+        return len_, hdr_end
+
 
-def get_pkt_len(buff):
-    return int.from_bytes(buff[:LEN_HEADER], byteorder=LEN_ORDER, signed=False)
+class VarintHeader:
+    """Protobuf style base 128 varint length."""
 
+    MAX_WIDTH = 10
 
-def get_1st_pkt(buff):
-    len_ = get_pkt_len(buff)
-    buff = buff[LEN_HEADER:]
-    pkt = buff[:len_]
-    remaining_buff = buff[len_:]
-    return pkt, remaining_buff
+    def encode(self, len_):
+        out = bytearray()
+        while len_ > 0x7F:
+            out.append((len_ & 0x7F) | 0x80)
+            len_ >>= 7
+        out.append(len_)
+        return bytes(out)
 
+    def decode(self, view, start, end):
+        len_ = 0
+        shift = 0
+        for idx in range(start, min(end, start + self.MAX_WIDTH)):
+            byte = view[idx]
+            len_ |= (byte & 0x7F) << shift
+            if not byte & 0x80:
+                return len_, idx + 1
+            shift += 7
 
-def insert_pkt_len(buff):
-    len_ = len(buff)
-    len_bytes = len_.to_bytes(length=LEN_HEADER, byteorder=LEN_ORDER, signed=False)
-    return len_bytes + buff
+        if end - start >= self.MAX_WIDTH:
+            raise errors.BadStreamError(
+                f"Length header longer than {self.MAX_WIDTH} bytes"
+            )
+
+        return None
+
+
+FRAMINGS = {
+    FRAMING_BYTE: FixedHeader(LEN_HEADER),
+    FRAMING_VARINT: VarintHeader(),
+    FRAMING_U32: FixedHeader(4),
+}
+
+
+def insert_pkt_len(buff, header=FRAMINGS[FRAMING_BYTE]):
+    return header.encode(len(buff)) + buff
 
 
-async def write_pkt(pkt, writer):
+def encode_drive(heading, throttle, features=0):
+    """A drive frame, packed if the connection has FEATURE_PACKED."""
+    if features & FEATURE_PACKED:
+        return packed.pack_drive(heading, throttle)
+
+    pkt = packet_pb2.Packet()
+    pkt.drive.heading = heading
+    pkt.drive.throttle = throttle
+    return pkt.SerializeToString()
+
+
+async def write_pkt(pkt, writer, header=FRAMINGS[FRAMING_BYTE]):
     buff = pkt.SerializeToString()
-    buff = insert_pkt_len(buff)
+    buff = insert_pkt_len(buff, header)
     writer.write(buff)
     await writer.drain()
 
 
-def contains_pkt(buff):
-    if not len(buff):
-        return False
+async def open_connection(host, port, framing=FRAMING_VARINT, features=0):
+    """
+    Connect to a server and ask for the given framing mode and features.
 
-    len_ = int.from_bytes(buff[:LEN_HEADER], byteorder="big", signed=False)
+    Returns (reader, writer, header, features), features being the ones the
+    server agreed to. Servers that predate the handshake drop the connection
+    when they see it, in which case we reconnect without one and fall back to
+    the 1 byte framing, which has no features.
+    """
+    reader, writer = await asyncio.open_connection(host, port)
 
-    if not len_:
-        raise errors.BadStreamError()
+    if framing == FRAMING_BYTE:
+        return reader, writer, FRAMINGS[FRAMING_BYTE], 0
 
-    buff = buff[LEN_HEADER:]
-    # print(f"{len_}:{len(buff)}")
+    writer.write(bytes([HANDSHAKE, framing | features]))
+    await writer.drain()
 
-    if len(buff) >= len_:
-        return True
+    try:
+        ack = await reader.readexactly(2)
+    except (asyncio.IncompleteReadError, ConnectionResetError):
+        writer.close()
+        reader, writer = await asyncio.open_connection(host, port)
+        return reader, writer, FRAMINGS[FRAMING_BYTE], 0
 
-    return False
+    if ack[0] != HANDSHAKE or ack[1] & FRAMING_MASK != framing:
+        writer.close()
+        raise errors.BadStreamError(f"Server refused framing mode {framing}")
 
+    return reader, writer, FRAMINGS[framing], ack[1] & features
 
-class PacketProcessor:
-    def __init__(self, reader, writer, stop_event, log):
-        self.reader = reader
-        self.writer = writer
 
-        self.stop_event = stop_event
-        self.recv_task = None
+class Framer:
+    """
+    Splits a length prefixed byte stream into frames.
+
+    Incoming data is written straight into a preallocated buffer, either with
+    feed() or by filling the view returned from get_buffer() and then calling
+    buffer_updated(). frames() yields memoryviews into that buffer, so a frame
+    is only valid until the next call to feed() or get_buffer().
+    """
+
+    def __init__(
+        self, size=16384, min_free=4096, header=FRAMINGS[FRAMING_BYTE], max_size=None
+    ):
+        self.header = header
+        self.features = 0
+        self.max_size = max_size
+
+        self._buff = bytearray(size)
+        self._view = memoryview(self._buff)
+        self._min_free = min_free
+
+        self._start = 0  # first byte not yet consumed by frames()
+        self._end = 0  # end of the valid data
+
+    def __len__(self):
+        return self._end - self._start
+
+    def get_buffer(self, sizehint=-1):
+        needed = max(sizehint, self._min_free)
+
+        if self._start == self._end:
+            self._start = self._end = 0
+
+        if len(self._buff) - self._end < needed:
+            self._compact(needed)
+
+        return self._view[self._end :]
+
+    def buffer_updated(self, nbytes):
+        self._end += nbytes
+
+    def feed(self, data):
+        len_ = len(data)
+        self.get_buffer(len_)[:len_] = data
+        self.buffer_updated(len_)
+
+    def accept_handshake(self):
+        """
+        Pick the framing mode from the start of the stream.
+
+        Returns None until enough bytes have arrived, then the bytes to send
+        back to the client, which are empty for clients that sent no handshake.
+        """
+        if self._start == self._end:
+            return None
+
+        if self._view[self._start] != HANDSHAKE:
+            self.header = FRAMINGS[FRAMING_BYTE]
+            return b""
+
+        if self._end - self._start < 2:
+            return None
+
+        mode = self._view[self._start + 1] & FRAMING_MASK
+        if mode not in FRAMINGS:
+            raise errors.BadStreamError(f"Unknown framing mode {mode}")
+
+        self._start += 2
+        self.header = FRAMINGS[mode]
+        self.features = self._view[self._start - 1] & FEATURES
+        return bytes([HANDSHAKE, mode | self.features])
 
+    def frames(self):
+        view = self._view
+        end = self._end
+        decode = self.header.decode
+
+        while self._start < end:
+            hdr = decode(view, self._start, end)
+
+            if hdr is None:
+                break
+
+            len_, hdr_end = hdr
+
+            if not len_ or len_ > MAX_FRAME:
+                raise errors.BadStreamError(f"Bad frame length {len_}")
+
+            if hdr_end + len_ > end:
+                break
+
+            self._start = hdr_end + len_
+            yield view[hdr_end : self._start]
+
+    def _compact(self, needed):
+        remaining = self._end - self._start
+
+        if remaining + needed > len(self._buff):
+            # frames handed out earlier still reference the old buffer, so
+            # allocate a new one rather than resizing in place.
+            size = len(self._buff)
+            while remaining + needed > size:
+                size *= 2
+
+            if self.max_size is not None and size > self.max_size:
+                raise errors.BadStreamError(
+                    f"Read buffer would grow past {self.max_size} bytes"
+                )
+
+            buff = bytearray(size)
+            buff[:remaining] = self._view[self._start : self._end]
+            self._buff = buff
+            self._view = memoryview(buff)
+        else:
+            self._view[:remaining] = self._view[self._start : self._end]
+
+        self._start = 0
+        self._end = remaining
+
+
+# oneof field number -> frame type name, e.g. {2: "drive"}
+FRAME_TYPES = {
+    field.number: field.name
+    for field in packet_pb2.Packet.DESCRIPTOR.oneofs_by_name["frame"].fields
+}
+
+
+DRIVE_NUMBER = packet_pb2.Packet.DESCRIPTOR.fields_by_name["drive"].number
+
+
+def decode(pkt_buff):
+    """
+    Packet bytes -> (oneof field number, frame), (None, None) if empty.
+    Packed drive frames are understood whether or not they were negotiated.
+    """
+    if pkt_buff and pkt_buff[0] == packed.PACKED_DRIVE:
+        try:
+            return DRIVE_NUMBER, packed.unpack_drive(pkt_buff)
+        except struct.error:
+            raise DecodeError("bad packed drive frame")
+
+    fields = packet_pb2.Packet.FromString(pkt_buff).ListFields()
+    if fields:
+        field, frame = fields[0]
+        return field.number, frame
+    return None, None
+
+
+class HandlerTable(dict):
+    """
+    Frame type name -> handler.
+
+    A handler is either called as handler(frame, writer) for every frame, or,
+    if it has a handle_batch(frames, writer) method, is given each run of
+    consecutive frames of its type in one call. The table is mirrored into
+    by_number, keyed by oneof field number, whenever it changes.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._rebuild()
+
+    def __setitem__(self, key, value):
+        super().__setitem__(key, value)
+        self._rebuild()
+
+    def __delitem__(self, key):
+        super().__delitem__(key)
+        self._rebuild()
+
+    def update(self, *args, **kwargs):
+        super().update(*args, **kwargs)
+        self._rebuild()
+
+    def __ior__(self, other):
+        super().__ior__(other)
+        self._rebuild()
+        return self
+
+    def setdefault(self, key, default=None):
+        value = super().setdefault(key, default)
+        self._rebuild()
+        return value
+
+    def pop(self, *args):
+        value = super().pop(*args)
+        self._rebuild()
+        return value
+
+    def popitem(self):
+        item = super().popitem()
+        self._rebuild()
+        return item
+
+    def clear(self):
+        super().clear()
+        self._rebuild()
+
+    def _rebuild(self):
+        self.by_number = {}
+        for number, name in FRAME_TYPES.items():
+            if name in self:
+                handler = self[name]
+                self.by_number[number] = (
+                    getattr(handler, "handle_batch", None),
+                    handler,
+                )
+
+
+class FrameMetrics:
+    """
+    Counts and times what Dispatchers handle, one instance can be shared by
+    every connection. Counts are exact. Timing takes clock reads and histogram
+    updates, so only every `sample_every`th dispatch is timed: decoding per
+    read and handlers per run of one frame type, as ns per frame.
+    """
+
+    def __init__(self, sample_every=1):
+        self.sample_every = sample_every
+        self.dispatches = 0
+
+        self.reads = 0
+        self.bytes = 0
+        self.unhandled = 0
+        # oneof field number -> frames handled
+        self.counts = collections.defaultdict(int)
+
+        self.parse_ns = stats.Histogram()
+        self.handler_ns = collections.defaultdict(stats.Histogram)
+
+    def frames(self):
+        """{oneof field number: frames handled}"""
+        return dict(self.counts)
+
+
+class Dispatcher:
+    def __init__(self, log, metrics=None):
         self.log = log
+        self.handlers = HandlerTable()
+        self.unhandled = collections.Counter()
+        self.metrics = metrics
+        self._timing = None  # metrics, while a sampled dispatch is delivered
+
+    def dispatch(self, pkt_buffs, writer):
+        """Returns the number of frames dispatched."""
+        # decode everything we have first, then hand out runs of the same type
+        metrics = self.metrics
+        if metrics is not None:
+            metrics.dispatches += 1
+            if not metrics.dispatches % metrics.sample_every:
+                return self._dispatch_timed(pkt_buffs, writer, metrics)
+        return self.deliver([decode(pkt_buff) for pkt_buff in pkt_buffs], writer)
+
+    def _dispatch_timed(self, pkt_buffs, writer, metrics):
+        start = time.perf_counter_ns()
+        decoded = [decode(pkt_buff) for pkt_buff in pkt_buffs]
+        if decoded:
+            count = len(decoded)
+            metrics.parse_ns.record((time.perf_counter_ns() - start) // count, count)
+
+        self._timing = metrics
+        try:
+            return self.deliver(decoded, writer)
+        finally:
+            self._timing = None
+
+    def deliver(self, decoded, writer):
+        """Hands out already decoded (oneof field number, frame) pairs."""
+        unhandled = None
+        run = []
+        run_number = None
+
+        for number, frame in decoded:
+            if number != run_number and run:
+                unhandled = self._deliver(run_number, run, writer, unhandled)
+                run = []
+
+            run_number = number
+            run.append(frame)
+
+        if run:
+            unhandled = self._deliver(run_number, run, writer, unhandled)
+
+        if unhandled:
+            self.unhandled.update(unhandled)
+            types = ", ".join(
+                f"{FRAME_TYPES.get(number)}: {count}"
+                for number, count in unhandled.items()
+            )
+            self.log.error(f"Unhandled frame types: {types}")
+
+        return len(decoded)
+
+    def _deliver(self, number, frames, writer, unhandled):
+        entry = self.handlers.by_number.get(number)
+
+        if entry is None:
+            if unhandled is None:
+                unhandled = collections.Counter()
+            unhandled[number] += len(frames)
+            if self.metrics is not None:
+                self.metrics.unhandled += len(frames)
+            return unhandled
+
+        if self.metrics is not None:
+            self.metrics.counts[number] += len(frames)
+        timing = self._timing
+        if timing is not None:
+            start = time.perf_counter_ns()
+
+        handle_batch, handler = entry
+        if handle_batch:
+            handle_batch(frames, writer)
+        else:
+            for frame in frames:
+                handler(frame, writer)
+
+        if timing is not None:
+            count = len(frames)
+            timing.handler_ns[number].record(
+                (time.perf_counter_ns() - start) // count, count
+            )
 
-        self.handlers = {}
+        return unhandled
 
-    async def recv_fn(self):
-        self.accum_buff = b""
 
+class FrameBudget:
+    """Token bucket holding up to a second's worth of frames."""
+
+    def __init__(self, rate):
+        self.rate = rate
+        self._tokens = rate
+        self._time = None
+
+    def take(self, count, now):
+        """Spend count frames, returns how long to wait before reading more."""
+        if self._time is not None:
+            self._tokens = min(self.rate, self._tokens + (now - self._time) * self.rate)
+        self._time = now
+
+        self._tokens -= count
+        if self._tokens < 0:
+            return -self._tokens / self.rate
+        return 0
+
+    def allow(self, now):
+        """Spend one frame if there is one left, for senders we can't pause."""
+        if self.take(1, now):
+            self._tokens += 1
+            return False
+        return True
+
+
+class FramedConnection:
+    """
+    What PacketProcessor and PacketProtocol share: the Framer and handshake,
+    the Dispatcher and its handlers, the frame budget, capture and metrics,
+    and sending on `writer`.
+
+    Server side, leave header as None and the framing is taken from the
+    client's handshake. Client side, pass the header and features
+    open_connection() returned.
+
+    `max_buffer` caps how far the read buffer may grow and `frame_rate`
+    limits frames per second, by pausing reads from a client that goes over
+    it so TCP pushes back on the sender. Frames are written to `capture`, a
+    capture.CaptureStream, on their way to the handlers. Reads, frames and
+    timings are counted in `metrics`, a FrameMetrics, if one is given.
+    """
+
+    def __init__(
+        self,
+        writer,
+        log,
+        header=None,
+        max_buffer=None,
+        frame_rate=None,
+        features=0,
+        capture=None,
+        metrics=None,
+    ):
+        self.writer = writer
+        self.log = log
+
+        self.dispatcher = Dispatcher(log, metrics)
+        self.handlers = self.dispatcher.handlers
+        self.metrics = metrics
+
+        if header is None:
+            self.framer = Framer(max_size=max_buffer)
+            self.negotiated = False
+        else:
+            self.framer = Framer(header=header, max_size=max_buffer)
+            self.framer.features = features
+            self.negotiated = True
+
+        self.budget = FrameBudget(frame_rate) if frame_rate else None
+        self.throttled = 0.0
+        self.capture = capture
+
+    @property
+    def header(self):
+        return self.framer.header
+
+    @property
+    def features(self):
+        return self.framer.features
+
+    def send_pkt(self, pkt):
+        self.writer.write(insert_pkt_len(pkt.SerializeToString(), self.header))
+
+    def send_drive(self, heading, throttle):
+        buff = encode_drive(heading, throttle, self.features)
+        self.writer.write(insert_pkt_len(buff, self.header))
+
+    def _handle_read(self, nbytes):
+        """
+        After nbytes have gone into the Framer: answers the handshake and
+        dispatches whatever frames are complete. Returns how many were
+        dispatched, None while the handshake is still incomplete.
+        """
+        if self.metrics is not None:
+            self.metrics.reads += 1
+            self.metrics.bytes += nbytes
+
+        if not self.negotiated:
+            reply = self.framer.accept_handshake()
+            if reply is None:
+                return None
+
+            self.negotiated = True
+            if reply:
+                self.writer.write(reply)
+
+        frames = self.framer.frames()
+        if self.capture is not None:
+            frames = self.capture.record(frames)
+        return self.dispatcher.dispatch(frames, self.writer)
+
+    def _throttle(self, count):
+        """Spends count frames from the budget, returns how long to pause."""
+        if not self.budget or not count:
+            return 0
+        delay = self.budget.take(count, asyncio.get_running_loop().time())
+        self.throttled += delay
+        return delay
+
+
+class PacketProcessor(FramedConnection):
+    """
+    Receives frames from an asyncio StreamReader in recv_fn(), a task per
+    read. See FramedConnection for the other arguments.
+    """
+
+    def __init__(self, reader, writer, stop_event, log, header=None, **kwargs):
+        super().__init__(writer, log, header, **kwargs)
+        self.reader = reader
+        self.stop_event = stop_event
+        self.recv_task = None
+
+    async def recv_fn(self):
         stop_task = asyncio.create_task(self.stop_event.wait())
 
-        while True:
-            recv_task = asyncio.create_task(self.reader.read(4096))
-            done, pending = await asyncio.wait(
-                {stop_task, recv_task}, return_when=asyncio.FIRST_COMPLETED
+        try:
+            while True:
+                recv_task = asyncio.create_task(self.reader.read(4096))
+                done, pending = await asyncio.wait(
+                    {stop_task, recv_task}, return_when=asyncio.FIRST_COMPLETED
+                )
+
+                if stop_task in done:
+                    recv_task.cancel()
+                    return
+
+                assert recv_task in done
+                assert len(done) == 1
+
+                try:
+                    buff = recv_task.result()
+                except ConnectionError as e:
+                    # a reset is just a rude close
+                    self.log.info(f"connection lost: {e!r}")
+                    return
+
+                if not len(buff):
+                    self.log.info("connection close, shutting down PacketProcessor.")
+                    return
+
+                self.framer.feed(buff)
+                delay = self._throttle(self._handle_read(len(buff)))
+                if delay:
+                    await asyncio.sleep(delay)
+        finally:
+            stop_task.cancel()
+
+
+class PacketProtocol(FramedConnection, asyncio.BufferedProtocol):
+    """
+    PacketProcessor as a BufferedProtocol, for loop.create_server().
+
+    The transport reads straight into the Framer's buffer and frames are
+    dispatched from buffer_updated(), so there is no task or copy per read.
+    Handlers get the transport as their writer. on_connect(protocol) is called
+    from connection_made(); reading is paused until recv_fn() starts, so
+    handlers can be registered before the first frame arrives. The other
+    arguments are as for FramedConnection.
+    """
+
+    def __init__(self, stop_event, log, header=None, on_connect=None, **kwargs):
+        super().__init__(None, log, header, **kwargs)
+        self.stop_event = stop_event
+        self.on_connect = on_connect
+
+        self.transport = None
+        self._resume_handle = None
+
+        self._closed = None
+        self._error = None
+
+    def connection_made(self, transport):
+        self.transport = self.writer = transport
+        self._closed = asyncio.get_running_loop().create_future()
+
+        transport.pause_reading()
+        if self.on_connect is not None:
+            self.on_connect(self)
+
+    def connection_lost(self, exc):
+        self.log.info("connection close, shutting down PacketProtocol.")
+        if self._resume_handle is not None:
+            self._resume_handle.cancel()
+        if not self._closed.done():
+            self._closed.set_result(None)
+
+    def get_buffer(self, sizehint):
+        return self.framer.get_buffer(sizehint)
+
+    def buffer_updated(self, nbytes):
+        self.framer.buffer_updated(nbytes)
+
+        try:
+            count = self._handle_read(nbytes)
+        except (errors.BadStreamError, DecodeError) as e:
+            self._error = e
+            self.transport.abort()
+            return
+
+        delay = self._throttle(count)
+        if delay:
+            self.transport.pause_reading()
+            self._resume_handle = asyncio.get_running_loop().call_later(
+                delay, self._resume
             )
 
-            if stop_task in done:
-                return
+    def _resume(self):
+        self._resume_handle = None
+        if not self.transport.is_closing():
+            self.transport.resume_reading()
 
-            assert recv_task in done
-            assert len(done) == 1
+    async def recv_fn(self):
+        """Runs until the connection closes or stop_event is set."""
+        self.transport.resume_reading()
+
+        waiting = {self._closed}
+        stop_task = None
+        if self.stop_event is not None:
+            stop_task = asyncio.create_task(self.stop_event.wait())
+            waiting.add(stop_task)
+
+        try:
+            await asyncio.wait(waiting, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            if stop_task is not None:
+                stop_task.cancel()
+            self.transport.close()
+
+        if self._error is not None:
+            raise self._error
+
+
+def seq_newer(seq, than):
+    """True if seq comes after than, allowing for wrap around."""
+    return 0 < (seq - than) % SEQ_MOD < SEQ_MOD // 2
+
+
+class DatagramPeer:
+    """
+    One remote address of a DatagramEndpoint. The datagram version of
+    PacketProtocol, with the same handlers, send_pkt and recv_fn, and it is
+    its own writer.
+
+    Apart from pings and stops, a frame that isn't newer than the last one
+    taken from the peer is dropped, so a late drive command can't undo a
+    newer one. send_pkt sends drive_stop STOP_COPIES times under one sequence
+    number and the receiver applies whichever copy lands first, even behind
+    newer frames: if the first copy is lost and a later drive overtakes the
+    rest, stopping late beats not stopping. Those are counted in late_stops.
+    Drive frames over frame_rate are dropped, there is no connection to push
+    back on.
+
+    reject() closes the peer and has the endpoint drop what the address sends
+    for a while, rather than taking each datagram as a new peer.
+
+    There is no handshake, the receiver always takes packed drive frames and
+    `features` only says what send_drive() sends.
+    """
+
+    STOP_COPIES = 3
+    STOP_INTERVAL = 0.01
+
+    def __init__(self, endpoint, addr, stop_event, log, frame_rate=None, features=0):
+        self.endpoint = endpoint
+        self.features = features
+        self.addr = addr
+        self.writer = self
 
-            buff = recv_task.result()
+        self.stop_event = stop_event
+        self.log = log
 
-            if not len(buff):
-                self.log.info("connection close, shutting down PacketProcessor.")
+        self.dispatcher = Dispatcher(log)
+        self.handlers = self.dispatcher.handlers
+
+        self.budget = FrameBudget(frame_rate) if frame_rate else None
+
+        self.last_seen = None
+        self._next_seq = 0
+        self._newest = None
+        # sequence numbers of recent stops taken, to apply each only once
+        self._stop_seqs = collections.deque(maxlen=16)
+        # datagrams that arrive before recv_fn() starts
+        self._pending = []
+        self._closed = asyncio.get_running_loop().create_future()
+
+        self.received = 0
+        self.stale = 0
+        self.late_stops = 0
+        self.over_rate = 0
+        self.bad = 0
+        # never throttled, over rate frames are dropped instead
+        self.throttled = 0.0
+
+    def get_extra_info(self, name, default=None):
+        if name == "peername":
+            return self.addr
+        return default
+
+    def send_pkt(self, pkt):
+        data = self._send(pkt.SerializeToString())
+
+        if pkt.WhichOneof("frame") == "drive_stop":
+            loop = asyncio.get_running_loop()
+            for copy in range(1, self.STOP_COPIES):
+                loop.call_later(
+                    copy * self.STOP_INTERVAL, self.endpoint.sendto, data, self.addr
+                )
+
+    def send_drive(self, heading, throttle):
+        self._send(encode_drive(heading, throttle, self.features))
+
+    def _send(self, buff):
+        data = DGRAM_SEQ.pack(self._next_seq) + buff
+        self._next_seq = (self._next_seq + 1) % SEQ_MOD
+
+        self.endpoint.sendto(data, self.addr)
+        return data
+
+    def datagram_received(self, data):
+        self.last_seen = asyncio.get_running_loop().time()
+
+        if self._pending is not None:
+            self._pending.append(data)
+        else:
+            self._receive(data)
+
+    def _receive(self, data):
+        self.received += 1
+
+        try:
+            if len(data) <= DGRAM_SEQ.size:
+                raise DecodeError("datagram too short")
+            (seq,) = DGRAM_SEQ.unpack_from(data)
+            number, frame = decode(memoryview(data)[DGRAM_SEQ.size :])
+        except DecodeError:
+            self.bad += 1
+            return
+
+        name = FRAME_TYPES.get(number)
+
+        if name != "ping":
+            newer = self._newest is None or seq_newer(seq, self._newest)
+            if name == "drive_stop":
+                if seq in self._stop_seqs:
+                    self.stale += 1
+                    return
+                self._stop_seqs.append(seq)
+                if not newer:
+                    self.late_stops += 1
+            elif not newer:
+                self.stale += 1
                 return
+            if newer:
+                self._newest = seq
 
-            self.accum_buff += buff
+        if name == "drive" and self.budget:
+            if not self.budget.allow(self.last_seen):
+                self.over_rate += 1
+                return
+
+        self.dispatcher.deliver([(number, frame)], self)
+
+    async def recv_fn(self):
+        """Runs until the peer goes quiet, is closed or stop_event is set."""
+        pending, self._pending = self._pending, None
+        for data in pending:
+            self._receive(data)
+
+        waiting = {self._closed}
+        stop_task = None
+        if self.stop_event is not None:
+            stop_task = asyncio.create_task(self.stop_event.wait())
+            waiting.add(stop_task)
+
+        try:
+            await asyncio.wait(waiting, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            if stop_task is not None:
+                stop_task.cancel()
+            self.close()
+
+        self.log.info(
+            f"datagram peer {self.addr} gone, {self.received} received, "
+            f"{self.stale} stale, {self.late_stops} late stops, "
+            f"{self.over_rate} over rate, {self.bad} bad"
+        )
+
+    def close(self):
+        if not self._closed.done():
+            self._closed.set_result(None)
+        self.endpoint.forget(self)
+
+    def reject(self):
+        self.endpoint.block(self.addr)
+        self.close()
+
+
+class DatagramEndpoint(asyncio.DatagramProtocol):
+    """
+    Sorts datagrams by sender into DatagramPeers, for
+    loop.create_datagram_endpoint().
+
+    on_peer(peer) is called for each new sender, it should register handlers
+    and run peer.recv_fn(). Peers that send nothing for peer_timeout seconds
+    are closed, the next datagram from the address starts a new peer, and so
+    a new sequence.
+
+    Datagrams from an address passed to block() are dropped and counted in
+    `blocked` for `block_time` seconds, peer_timeout by default, without
+    making a peer or logging anything. The first one after that makes a peer
+    again.
+    """
+
+    def __init__(
+        self,
+        stop_event,
+        log,
+        frame_rate=None,
+        on_peer=None,
+        peer_timeout=5.0,
+        block_time=None,
+    ):
+        self.stop_event = stop_event
+        self.log = log
+        self.frame_rate = frame_rate
+        self.on_peer = on_peer
+        self.peer_timeout = peer_timeout
+        self.block_time = block_time if block_time is not None else peer_timeout
+
+        self.transport = None
+        self.peers = {}
+        self.blocked_until = {}  # addr -> loop time
+        self.blocked = 0
+        self._sweep_handle = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+        if self.peer_timeout:
+            self._sweep_handle = asyncio.get_running_loop().call_later(
+                self.peer_timeout / 2, self._sweep
+            )
 
-            while contains_pkt(self.accum_buff):
-                self.accum_buff = self._process_pkt(self.accum_buff)
+    def connection_lost(self, exc):
+        if self._sweep_handle is not None:
+            self._sweep_handle.cancel()
+        for peer in list(self.peers.values()):
+            peer.close()
 
-    def _process_pkt(self, buff):
-        pkt_buff, remain_buff = get_1st_pkt(buff)
+    def error_received(self, exc):
+        self.log.warning(f"datagram error: {exc}")
 
-        pkt = packet_pb2.Packet.FromString(pkt_buff)
+    def peer(self, addr):
+        peer = self.peers.get(addr)
+        if peer is None:
+            peer = DatagramPeer(
+                self, addr, self.stop_event, self.log, frame_rate=self.frame_rate
+            )
+            self.peers[addr] = peer
+            if self.on_peer is not None:
+                self.on_peer(peer)
+        return peer
+
+    def datagram_received(self, data, addr):
+        until = self.blocked_until.get(addr)
+        if until is not None:
+            if asyncio.get_running_loop().time() < until:
+                self.blocked += 1
+                return
+            del self.blocked_until[addr]
 
-        frame_type = pkt.WhichOneof("frame")
+        self.peer(addr).datagram_received(data)
 
-        if frame_type in self.handlers:
-            frame = getattr(pkt, frame_type)
-            self.handlers[frame_type](frame, self.writer)
-            return remain_buff
+    def block(self, addr):
+        if self.block_time:
+            self.blocked_until[addr] = (
+                asyncio.get_running_loop().time() + self.block_time
+            )
 
-        self.log.error(f"Unhandled frame type: {frame_type}")
-        return remain_buff
+    def sendto(self, data, addr):
+        if not self.transport.is_closing():
+            self.transport.sendto(data, addr)
+
+    def forget(self, peer):
+        if self.peers.get(peer.addr) is peer:
+            del self.peers[peer.addr]
+
+    def _sweep(self):
+        now = asyncio.get_running_loop().time()
+        for peer in list(self.peers.values()):
+            if peer.last_seen is not None and now - peer.last_seen > self.peer_timeout:
+                peer.close()
+        for addr, until in list(self.blocked_until.items()):
+            if now >= until:
+                del self.blocked_until[addr]
+
+        self._sweep_handle = asyncio.get_running_loop().call_later(
+            self.peer_timeout / 2, self._sweep
+        )
+
+
+async def open_datagram(host, port, stop_event, log):
+    """
+    Client side of the datagram transport, returns the DatagramPeer for the
+    server. Register handlers on it, then run its recv_fn().
+    """
+    loop = asyncio.get_running_loop()
+    transport, endpoint = await loop.create_datagram_endpoint(
+        lambda: DatagramEndpoint(stop_event, log, peer_timeout=None),
+        remote_addr=(host, port),
+    )
+    return endpoint.peer(transport.get_extra_info("peername"))
@@ -0,0 +1,27 @@
+"""
+Fixed layout drive commands, a byte smaller than a protobuf Packet.
+
+A packed drive frame is the PACKED_DRIVE kind byte, then heading as a signed
+32 bit int and throttle as a 32 bit float, little endian. A serialized
+Packet starts with a field tag and there is no field 0, so a leading zero
+byte can't be mistaken for one and both kinds of frame can share a stream.
+"""
+
+import collections
+import struct
+
+PACKED_DRIVE = 0
+
+DRIVE = struct.Struct("<Bif")
+
+# stands in for a packet_pb2.Drive frame in handlers
+PackedDrive = collections.namedtuple("PackedDrive", ["heading", "throttle"])
+
+
+def pack_drive(heading, throttle):
+    return DRIVE.pack(PACKED_DRIVE, heading, throttle)
+
+
+def unpack_drive(buff):
+    _, heading, throttle = DRIVE.unpack(buff)
+    return PackedDrive(heading, throttle)
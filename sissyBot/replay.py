@@ -0,0 +1,390 @@
+"""
+sbs-replay: plays back a capture made with `sbs --capture`.
+
+By default frames go through what sbs runs between the socket and the
+motors, in this process and on the capture's clock: controller election,
+observers' drive frames ignored, heartbeat timeouts, the DriveCoalescer and
+a ControlLoop with its rate and slew limit, so the motor outputs match what
+sbs wrote given the same settings. The time each frame takes to decode and
+handle is recorded. With --target the frames are sent to a running sbs
+instead, one connection per captured connection, opened and closed when
+they were, and the time each frame went out behind schedule is recorded in
+its place.
+
+--speed 1 keeps the captured timing, 10 plays it ten times as fast and 0 as
+fast as it will go.
+"""
+
+import argparse
+import asyncio
+import functools
+import hashlib
+import logging
+import struct
+import time
+
+from google.protobuf.message import DecodeError
+
+import sissyBot.capture as capture
+import sissyBot.control as control
+import sissyBot.loops as loops
+import sissyBot.mixing as mixing
+import sissyBot.net as net
+import sissyBot.server as server
+import sissyBot.stats as stats
+
+PCTS = (50, 90, 99, 99.9)
+
+OUTPUT = struct.Struct("<dd")
+
+
+class MotorRecorder:
+    """Motor backend for a ControlLoop that keeps every output it's given."""
+
+    def __init__(self):
+        self.outputs = []  # (time ns, left, right)
+        self.stops = 0
+        self.now = 0
+
+    def set(self, l_motor, r_motor):
+        self.outputs.append((self.now, l_motor, r_motor))
+
+    def stop(self):
+        self.stops += 1
+        self.outputs.append((self.now, 0.0, 0.0))
+
+    def digest(self):
+        """Hash of the outputs in order, equal across runs if nothing changed."""
+        digest = hashlib.sha1()
+        for _, l_motor, r_motor in self.outputs:
+            digest.update(OUTPUT.pack(l_motor, r_motor))
+        return digest.hexdigest()[:16]
+
+    def summary(self):
+        if not self.outputs:
+            return "no motor outputs"
+
+        lines = [f"{len(self.outputs)} motor outputs, digest {self.digest()}"]
+        for name, idx in (("left", 1), ("right", 2)):
+            values = [output[idx] for output in self.outputs]
+            lines.append(
+                f"{name:>6}: min {min(values):+.3f} max {max(values):+.3f} "
+                f"mean {sum(values) / len(values):+.3f}"
+            )
+        lines.append(f"{self.stops} of them stops")
+        return "\n".join(lines)
+
+
+class Pacer:
+    """Works out when each frame is due at the given speed, 0 for never wait."""
+
+    def __init__(self, speed):
+        self.speed = speed
+        self.start = None
+
+    def due(self, time_ns):
+        """Seconds until the frame captured at time_ns is due, or overdue if < 0."""
+        now = time.perf_counter()
+        if self.start is None:
+            self.start = now - time_ns / 1e9 / self.speed if self.speed else now
+        if not self.speed:
+            return 0.0
+        return self.start + time_ns / 1e9 / self.speed - now
+
+
+def format_us(pcts):
+    return " ".join(
+        f"p{pct:g} {value / 1000:.1f}us"
+        for pct, value in pcts.items()
+        if value is not None
+    )
+
+
+class ReplayServer:
+    """
+    sbs's connection handling and motor control, stepped by hand. advance()
+    runs the control loop ticks and heartbeat checks due up to a time, then
+    open(), frame() and close() do what a connection doing that does.
+    """
+
+    def __init__(self, args):
+        self.recorder = MotorRecorder()
+        self.control_loop = control.ControlLoop(
+            None,
+            self.recorder,
+            mixing.Mixer(mixing.sine_curve(args.mix_gain)).motor_calc,
+            rate=args.rate,
+            slew=args.slew,
+        )
+        self.drive = server.DriveCoalescer(
+            on_drive=None, on_stop=self.control_loop.all_stop
+        )
+        self.control_loop.slot = self.drive
+
+        self.period = int(self.control_loop.period * 1e9)
+        self.deadline = int(args.heartbeat_timeout * 1e9)
+        self.next_tick = None
+
+        self.clients = {}  # conn -> server.Client, oldest first
+        self.dispatchers = {}
+        self.last_ping = {}  # conn -> time of its last ping, while armed
+        self.next_check = {}  # conn -> time its monitor next looks
+
+        self.ignored = 0
+        self.timeouts = 0
+        self.unhandled = {}
+
+    def advance(self, now):
+        if self.next_tick is None:
+            self.next_tick = now
+
+        while True:
+            check = min(self.next_check.values(), default=None)
+            due = self.next_tick if check is None else min(self.next_tick, check)
+            if due > now:
+                return
+
+            self.recorder.now = due
+            if due == self.next_tick:
+                self.control_loop.tick()
+                self.control_loop.ticks += 1
+                self.next_tick += self.period
+            else:
+                self._check_heartbeats(due)
+
+    def _check_heartbeats(self, now):
+        # as heartbeat.HeartbeatMonitor.run, every deadline / 4
+        for conn, check in list(self.next_check.items()):
+            if check > now:
+                continue
+            self.next_check[conn] = check + self.deadline // 4
+
+            last = self.last_ping.get(conn)
+            if last is not None and now - last > self.deadline:
+                del self.last_ping[conn]
+                self.timeouts += 1
+                if self.clients[conn].controller:
+                    self.drive.stop(None, None)
+
+    def open(self, now, conn):
+        client = server.Client(conn, conn, None)
+        self.clients[conn] = client
+        self._elect()
+
+        dispatcher = net.Dispatcher(logging.getLogger("replay"))
+        dispatcher.handlers["drive"] = server.ControllerOnly(self.drive, client)
+        dispatcher.handlers["drive_stop"] = self.drive.stop
+        dispatcher.handlers["ping"] = functools.partial(self._ping, conn)
+        self.dispatchers[conn] = dispatcher
+        self.next_check[conn] = now + self.deadline // 4
+
+    def frame(self, now, conn, frame):
+        self.recorder.now = now
+        self.dispatchers[conn].dispatch((frame,), None)
+
+    def close(self, now, conn):
+        self.recorder.now = now
+        client = self.clients.pop(conn)
+        if client.controller:
+            self.drive.stop(None, None)
+            self._elect()
+
+        self.ignored += client.ignored
+        for number, count in self.dispatchers.pop(conn).unhandled.items():
+            self.unhandled[number] = self.unhandled.get(number, 0) + count
+        self.last_ping.pop(conn, None)
+        del self.next_check[conn]
+
+    def finish(self):
+        """Ticks until the outputs stop changing."""
+        for _ in range(int(10e9 // self.period)):
+            if self.control_loop.output == self.control_loop.target:
+                break
+            self.advance(self.next_tick)
+
+    def _ping(self, conn, frame, writer):
+        self.last_ping[conn] = self.recorder.now
+
+    def _elect(self):
+        # as server.ConnectionManager
+        if self.clients and not any(c.controller for c in self.clients.values()):
+            next(iter(self.clients.values())).controller = True
+
+
+def replay_local(reader, args):
+    replay = ReplayServer(args)
+
+    latency = stats.RollingWindow(None)
+    pacer = Pacer(args.speed)
+    bad = 0
+    count = 0
+
+    start = time.perf_counter()
+    for time_ns, conn, kind, frame in reader.records():
+        if args.conn is not None and conn != args.conn:
+            continue
+
+        wait = pacer.due(time_ns)
+        if wait > 0:
+            time.sleep(wait)
+
+        replay.advance(time_ns)
+        if kind is capture.OPEN:
+            replay.open(time_ns, conn)
+            continue
+        if kind is capture.CLOSE:
+            replay.close(time_ns, conn)
+            continue
+
+        handle_start = time.perf_counter_ns()
+        try:
+            replay.frame(time_ns, conn, frame)
+        except DecodeError:
+            bad += 1
+        latency.add(time.perf_counter_ns() - handle_start)
+        count += 1
+    replay.finish()
+    elapsed = time.perf_counter() - start
+
+    print(f"{count} frames in {elapsed:.3f}s, {count / elapsed:.0f} frames/s")
+    print(f"handler latency: {format_us(latency.percentiles(*PCTS))}")
+    print(f"drive commands: {replay.drive.stats()}")
+    print(
+        f"{replay.ignored} drive frames from observers ignored, "
+        f"{replay.timeouts} heartbeat timeouts, "
+        f"{replay.control_loop.ticks} control ticks"
+    )
+    if bad or replay.unhandled:
+        print(f"undecodable: {bad}, unhandled: {replay.unhandled}")
+    print(replay.recorder.summary())
+
+    if args.outputs:
+        with open(args.outputs, "w") as out:
+            out.write("time_s,left,right\n")
+            for time_ns, l_motor, r_motor in replay.recorder.outputs:
+                out.write(f"{time_ns / 1e9:.6f},{l_motor:.6f},{r_motor:.6f}\n")
+
+
+async def drain(reader):
+    while await reader.read(4096):
+        pass
+
+
+async def replay_to(reader, args):
+    host, _, port = args.target.rpartition(":")
+    conns = {}  # captured connection -> (writer, header, drain task)
+    opened = 0
+    lag = stats.RollingWindow(None)
+    pacer = Pacer(args.speed)
+    count = 0
+
+    start = time.perf_counter()
+    try:
+        for time_ns, conn, kind, frame in reader.records():
+            if args.conn is not None and conn != args.conn:
+                continue
+
+            wait = pacer.due(time_ns)
+            if wait > 0:
+                await asyncio.sleep(wait)
+            elif kind is capture.FRAME:
+                lag.add(-wait * 1e9)
+
+            if kind is capture.OPEN:
+                stream, writer, header, _ = await net.open_connection(
+                    host or "127.0.0.1", int(port)
+                )
+                conns[conn] = writer, header, asyncio.create_task(drain(stream))
+                opened += 1
+                continue
+
+            if kind is capture.CLOSE:
+                writer, _, task = conns.pop(conn)
+                await writer.drain()
+                writer.close()
+                task.cancel()
+                continue
+
+            writer, header, _ = conns[conn]
+            writer.write(net.insert_pkt_len(bytes(frame), header))
+            count += 1
+            if not count % 64:
+                await writer.drain()
+
+        elapsed = time.perf_counter() - start
+    finally:
+        for writer, _, task in conns.values():
+            writer.close()
+            task.cancel()
+
+    print(
+        f"{count} frames over {opened} connections in {elapsed:.3f}s, "
+        f"{count / elapsed:.0f} frames/s"
+    )
+    if args.speed:
+        print(f"{len(lag)} frames sent late: {format_us(lag.percentiles(*PCTS))}")
+    print("motor outputs are in sbs's own stats")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("capture", help="file written by sbs --capture")
+    parser.add_argument(
+        "--speed", type=float, default=1.0, help="playback speed, 0 for max"
+    )
+    parser.add_argument(
+        "--target", metavar="HOST:PORT", default=None, help="send to this sbs"
+    )
+    parser.add_argument(
+        "--conn", type=int, default=None, help="only play this captured connection"
+    )
+    parser.add_argument(
+        "--mix-gain",
+        type=float,
+        default=1.6,
+        help="gain of the sine mixing curve, as for sbs",
+    )
+    parser.add_argument(
+        "--rate", type=float, default=200, help="motor control loop rate, as for sbs"
+    )
+    parser.add_argument(
+        "--slew",
+        type=float,
+        default=8.0,
+        help="max change in motor output per second, as for sbs",
+    )
+    parser.add_argument(
+        "--heartbeat-timeout",
+        type=float,
+        default=0.5,
+        help="all stop after this long without a heartbeat, as for sbs",
+    )
+    parser.add_argument(
+        "--outputs", metavar="CSV", default=None, help="write motor outputs here"
+    )
+    parser.add_argument(
+        "--loop",
+        choices=loops.LOOPS,
+        default=None,
+        help=f"event loop for --target, defaults to ${loops.ENV_VAR} or asyncio",
+    )
+    args = parser.parse_args()
+
+    logging.basicConfig(format="%(asctime)-15s %(message)s")
+
+    reader = capture.CaptureReader(args.capture)
+    try:
+        if args.target is None:
+            replay_local(reader, args)
+        else:
+            loops.run(replay_to(reader, args), args.loop)
+    finally:
+        if reader.truncated:
+            print(f"{reader.truncated} truncated record(s) skipped")
+        reader.close()
+
+
+if __name__ == "__main__":
+    main()
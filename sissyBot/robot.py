@@ -1,160 +1,252 @@
-import asyncio
-import enum
+import collections
+import functools
 import logging
 import math
-import multiprocessing
-import sys
-import traceback
-from dataclasses import dataclass
+import os
+import threading
+import time
 
+import kivy.clock
 import kivy.event
 
-# from nats.aio.client import Client as NATS
-import nats.aio.client
-
-# from nats.aio.errors import ErrConnectionClosed, ErrTimeout
-import nats.aio.errors
-import snoop
-
+from sissyBot import loops, stats
+
+# the NATS side used to live here, so it is still importable from here
+from sissyBot.nats_proc import (
+    ConnState,
+    ConnStatus,
+    NatsProc,
+    NatsThread,
+    PubCmd,
+    SubCmd,
+    UnsubCmd,
+)
 from sissyBot.proto import drive_pb2
 
 
-# @dataclass
-class PubCmd:
-    subject: str
-    payload: bytes
+class Subscription:
+    def __init__(self, sid, subject, callback, maxlen):
+        self.sid = sid
+        self.subject = subject
+        self.callback = callback
 
+        self.queue = collections.deque(maxlen=maxlen)
+        self.dropped = 0
 
-@dataclass
-class SubCmd:
-    subject: str
 
+class SubDispatcher:
+    """
+    Routes batches of (sid, subject, payload) records to per subscription
+    callbacks on the Kivy main loop.
 
-class ConnState(enum.Enum):
-    UP = 1
-    DOWN = 2
+    put_batch() can be called from any thread. Each subscription queues at
+    most maxlen messages between deliveries, beyond that the oldest are
+    dropped and counted.
+    """
 
+    def __init__(self, clock):
+        self.subs = {}
+        self.next_sid = 1
+        self._trigger = clock.create_trigger(self.deliver)
 
-class NatsProc:
-    def __init__(self):
-        self.proc = None
+    def add(self, subject, callback, maxlen):
+        sub = Subscription(self.next_sid, subject, callback, maxlen)
+        self.next_sid += 1
+        self.subs[sub.sid] = sub
+        return sub
 
-        self.gui_end, self.proc_end = multiprocessing.Pipe()
+    def remove(self, sid):
+        return self.subs.pop(sid, None)
 
-        self.sub_queues = []
-        self.conn_state_recv_end, self.conn_state_send_end = multiprocessing.Pipe(False)
+    def put_batch(self, records):
+        for sid, subject, payload in records:
+            sub = self.subs.get(sid)
+            if sub is None:
+                # unsubscribed while these were in flight
+                continue
 
-    def connect(self, addr):
-        self.proc = multiprocessing.Process(target=self.main, args=(addr,))
-        self.proc.start()
-        self.proc_end.close()
+            if len(sub.queue) == sub.queue.maxlen:
+                sub.dropped += 1
+            sub.queue.append((subject, payload))
 
-    def close(self):
-        # self.gui_end.send(closeCmd())
-        self.gui_end.close()
-        self.proc.join()
+        self._trigger()
 
-    async def _shutdown(self):
-        for queue in self.sub_queues:
-            queue.close()
-        self.proc_end.close()
+    def deliver(self, dt):
+        for sub in list(self.subs.values()):
+            while sub.queue:
+                subject, payload = sub.queue.popleft()
+                sub.callback(subject, payload)
 
-        loop = asyncio.get_event_loop()
-        tasks = asyncio.Task.all_tasks(loop)
 
-        for task in tasks:
-            task.cancel()
-
-            try:
-                await task
-            except asyncio.CancelledError:
-                pass
-
-        self.conn_state_send_end.send(ConnState.DOWN)
+class Robot(kivy.event.EventDispatcher):
+    """
+    backend="process" runs NATS in a NatsProc child process, "thread" runs it
+    in this process with NatsThread. "sbs" skips NATS and drives sbs over
+    TCP with sbs_link.SbsThread, which also sends the heartbeats that let
+    sbs stop the robot if the client goes quiet.
+
+    The backend reconnects by itself. Calling connect() again with the same
+    address keeps the running backend and its connection rather than
+    starting a new one.
+
+    For the process backend connection state reaches the main loop in one of
+    two ways. With conn_notify="push" a watcher thread blocks on the state
+    pipe and hands each change to the Kivy clock as it arrives. "poll" checks
+    the pipe every 0.2 s instead. The child's log records come the same way
+    and are logged here, at the levels in `log_levels`, a logs level spec.
+
+    nats_loop picks the backend's event loop, see sissyBot.loops. None falls
+    back to $SISSYBOT_LOOP.
+    """
 
-    def main(self, addr):
-        # close the gui end here
-        self.gui_end.close()
-        loop = asyncio.get_event_loop()
-        loop.run_until_complete(self.main_task(loop, addr))
-        loop.close()
+    up = kivy.properties.BooleanProperty(False, force_dispatch=True)
+    state = kivy.properties.ObjectProperty(ConnState.DOWN)
+    rtt = kivy.properties.NumericProperty(None, allownone=True)
+    reconnect_time = kivy.properties.NumericProperty(None, allownone=True)
+    buffered = kivy.properties.NumericProperty(0)
+    dropped = kivy.properties.NumericProperty(0)
+    published = kivy.properties.NumericProperty(0)
+
+    backend = kivy.properties.OptionProperty(
+        "process", options=["process", "thread", "sbs"]
+    )
+    transport = kivy.properties.OptionProperty("pipe", options=["pipe", "shm"])
+    conn_notify = kivy.properties.OptionProperty("push", options=["push", "poll"])
+    nats_loop = kivy.properties.OptionProperty(
+        None, options=[None, *loops.LOOPS], allownone=True
+    )
+    log_levels = kivy.properties.StringProperty(None, allownone=True)
 
-    async def main_task(self, loop, addr):
-        self.nats = nats.aio.client.Client()
+    def __init__(self, **kwargs):
+        super(Robot, self).__init__(**kwargs)
+        self.nat_proc = None
+        self.addr = None
+        self.event = None
+        self.drive = Drive(self)
+        self.subs = SubDispatcher(kivy.clock.Clock)
+        self.publish_ns = stats.Histogram()
+        self.log = logging.getLogger("robot")
 
-        await self.nats.connect(addr)
-        self.conn_state_send_end.send(ConnState.UP)
+    def connect(self, addr, port):
+        addr = f"{addr}:{port}"
+        self.log.info("connecting to %s", addr)
+        self.clock = kivy.clock.Clock
 
-        while True:
+        if self.nat_proc is not None:
+            if addr == self.addr and self.nat_proc.is_alive():
+                return
+            self.close()
 
-            try:
-                cmd = await loop.run_in_executor(None, self.proc_end.recv)
-                print(f"cmd: {cmd}")
-            except EOFError:
-                await self._shutdown()
+        self.addr = addr
 
-                return
+        if self.backend == "thread":
+            self.nat_proc = NatsThread(
+                self._post_status, self.subs.put_batch, self.nats_loop
+            )
+            self.nat_proc.connect(addr)
+            return
 
-            if isinstance(cmd, PubCmd):
-                sub = cmd.subject
-                payload = cmd.payload
+        if self.backend == "sbs":
+            from sissyBot.sbs_link import SbsThread
 
-                try:
-                    await self.nats.publish(sub, payload)
-                except nats.io.errors.ErrConnectionClosed:
-                    await self._shutdown()
-                    return
+            self.nat_proc = SbsThread(self._post_status, self.nats_loop)
+            self.nat_proc.connect(addr)
+            return
 
-            elif isinstance(cmd, SubCmd):
-                recv_end, send_end = multiprocessing.Pipe(False)
+        self.nat_proc = NatsProc(self.transport, self.nats_loop, self.log_levels)
+        self.nat_proc.connect(addr)
 
-                self.proc_end.send(recv_end)
-                self.sub_queues.append(send_end)
+        sub_watcher = threading.Thread(
+            target=self._watch_subs, args=(self.nat_proc.sub_recv_end,)
+        )
+        sub_watcher.daemon = True
+        sub_watcher.start()
 
-                async def sub_callback(msg):
-                    send_end.send(msg)
+        if self.conn_notify == "poll":
+            self.event = self.clock.schedule_interval(self.check_up, 0.2)
+            return
 
-                # when I add unsub I will need this sid
-                _ = await self.nats.subscribe(cmd.subject, cb=sub_callback)
+        self.event = None
+        watcher = threading.Thread(
+            target=self._watch_state, args=(self.nat_proc.conn_state_recv_end,)
+        )
+        watcher.daemon = True
+        watcher.start()
 
+    def _watch_state(self, recv_end):
+        while True:
+            try:
+                msg = recv_end.recv()
+            except (EOFError, OSError):
+                return
 
-class Robot(kivy.event.EventDispatcher):
-    up = kivy.properties.BooleanProperty(False, force_dispatch=True)
+            if isinstance(msg, logging.LogRecord):
+                self._log_record(msg)
+            else:
+                self._post_status(msg)
 
-    def __init__(self, **kwargs):
-        super(Robot, self).__init__(**kwargs)
-        self.nat_proc = None
-        self.drive = Drive(self)
+    def _watch_subs(self, recv_end):
+        while True:
+            try:
+                batch = recv_end.recv()
+            except (EOFError, OSError):
+                return
 
-    def connect(self, addr, port):
-        addr = f"{addr}:{port}"
-        print(addr)
-        self.nat_proc = NatsProc()
-        self.nat_proc.connect(addr)
+            self.subs.put_batch(batch)
 
-        self.clock = kivy.clock.Clock
-        self.event = self.clock.schedule_interval(self.check_up, 0.2)
+    def _post_status(self, msg):
+        # safe from any thread
+        self.clock.schedule_once(functools.partial(self._on_status, msg))
 
     def check_up(self, dt):
-        msg = None
-        while self.nat_proc.conn_state_recv_end.poll():
-            print("got something")
-            msg = self.nat_proc.conn_state_recv_end.recv()
-
-        if msg:
-            if msg == ConnState.UP and not self.up:
-                print("we up !")
-                self.up = True
-            elif msg == ConnState.DOWN and self.up:
-                print("we down !")
-                self.up = False
+        try:
+            while self.nat_proc.conn_state_recv_end.poll():
+                self.log.debug("got something")
+                msg = self.nat_proc.conn_state_recv_end.recv()
+                if isinstance(msg, logging.LogRecord):
+                    self._log_record(msg)
+                else:
+                    self._on_status(msg)
+        except (EOFError, OSError):
+            self.event.cancel()
+
+    def _log_record(self, record):
+        # already filtered by level in the child, safe from any thread
+        logging.getLogger(record.name).handle(record)
+
+    def on_log_levels(self, _, spec):
+        # also fires from __init__, before there is a nat_proc
+        if isinstance(getattr(self, "nat_proc", None), NatsProc):
+            self.nat_proc.set_log_levels(spec)
+
+    def _on_status(self, msg, dt=None):
+        self.state = msg.state
+        if msg.rtt is not None:
+            self.rtt = msg.rtt
+        if msg.reconnect_time is not None:
+            self.reconnect_time = msg.reconnect_time
+        self.buffered = msg.buffered
+        self.dropped = msg.dropped
+        self.published = msg.published
+
+        if msg.state == ConnState.UP and not self.up:
+            self.log.info("we up !")
+            self.up = True
+        elif msg.state != ConnState.UP and self.up:
+            self.log.info("we down !")
+            self.up = False
 
     def close(self):
+        if self.event is not None:
+            self.event.cancel()
+            self.event = None
+
         if self.nat_proc:
-            self.nat_proc.gui_end.close()
+            self.nat_proc.close()
+            self.nat_proc = None
 
     def tick(self, dt):
-        print("tick!")
+        self.log.debug("tick!")
 
     def publish(self, subject, payload):
         if not isinstance(payload, bytes):
@@ -164,69 +256,175 @@ class Robot(kivy.event.EventDispatcher):
             # TODO add logging
             return
 
-        cmd = PubCmd()
-        cmd.subject = subject
-        cmd.payload = payload
-        self.nat_proc.gui_end.send(cmd)
+        start = time.perf_counter_ns()
+        self.nat_proc.publish(subject, payload)
+        self.publish_ns.record(time.perf_counter_ns() - start)
+
+    def metrics(self):
+        """
+        Counters for a stats view. in_flight is publishes handed to the
+        backend that it hadn't sent, buffered or dropped as of its last
+        status, which arrive every couple of seconds.
+        """
+        sent = self.nat_proc.sent if self.nat_proc else 0
+        pcts = self.publish_ns.percentiles(50, 99)
+        return {
+            "state": self.state.name,
+            "rtt": self.rtt,
+            "sent": sent,
+            "published": self.published,
+            "in_flight": max(0, sent - self.published - self.buffered - self.dropped),
+            "buffered": self.buffered,
+            "dropped": self.dropped,
+            "ring_dropped": getattr(self.nat_proc, "ring_dropped", 0),
+            "publish_p50_ns": pcts[50],
+            "publish_p99_ns": pcts[99],
+            "sub_queued": sum(len(sub.queue) for sub in self.subs.subs.values()),
+            "sub_dropped": sum(sub.dropped for sub in self.subs.subs.values()),
+            **{f"drive_{key}": value for key, value in self.drive.stats().items()},
+        }
+
+    def subscribe(self, subject, callback, maxlen=64):
+        """
+        Call callback(subject, payload) on the main loop for each message.
+
+        Returns the sid to pass to unsubscribe().
+        """
+        sub = self.subs.add(subject, callback, maxlen)
+        self.nat_proc.subscribe(sub.sid, subject)
+        return sub.sid
+
+    def unsubscribe(self, sid):
+        if self.subs.remove(sid) is not None:
+            self.nat_proc.unsubscribe(sid)
 
-    def subscribe(self, subject):
 
-        cmd = SubCmd(subject)
-        self.nat_proc.gui_end.send(cmd)
+class Drive:
+    """
+    Publishes drive commands, skipping ones that don't matter.
+
+    A command is only sent if heading or throttle moved further than the
+    deadband from the last one sent, and at most max_rate times a second.
+    Commands held back by the rate limit are sent on the trailing edge, so the
+    robot always ends up with the latest value. stop() is always sent at once.
+    """
+
+    def __init__(
+        self, robot, max_rate=30.0, heading_deadband=2, throttle_deadband=0.02
+    ):
+        self.robot = robot
 
-        return self.nat_proc.gui_end.recv()
+        self.min_interval = 1 / max_rate if max_rate else 0
+        self.heading_deadband = heading_deadband
+        self.throttle_deadband = throttle_deadband
 
+        self.last_sent = None
+        self.last_time = 0.0
+        self.pending = None
+        self._trailing = None
 
-class Drive:
-    def __init__(self, robot):
-        self.robot = robot
+        self.sent = 0
+        self.suppressed = 0
+
+    def _in_deadband(self, heading, throttle):
+        if self.last_sent is None:
+            return False
+
+        last_heading, last_throttle = self.last_sent
+        heading_diff = abs((heading - last_heading + 180) % 360 - 180)
+
+        return (
+            heading_diff <= self.heading_deadband
+            and abs(throttle - last_throttle) <= self.throttle_deadband
+        )
 
     def cmd(self, heading, throttle):
+        heading = int(math.degrees(heading))
+
+        if self.pending is not None:
+            self.suppressed += 1
+            self.pending = None
+
+        if self._in_deadband(heading, throttle):
+            self.suppressed += 1
+            return
+
+        wait = self.last_time + self.min_interval - time.monotonic()
+        if wait > 0:
+            self.pending = (heading, throttle)
+            if self._trailing is None:
+                self._trailing = kivy.clock.Clock.schedule_once(self._flush, wait)
+            return
+
+        self._send(heading, throttle)
+
+    def _flush(self, dt):
+        self._trailing = None
+
+        if self.pending is not None:
+            heading, throttle = self.pending
+            self.pending = None
+            self._send(heading, throttle)
+
+    def _send(self, heading, throttle):
         frame = drive_pb2.DriveCmd()
-        frame.heading_delta = int(math.degrees(heading))
+        frame.heading_delta = heading
         frame.throttle = throttle
 
         self.robot.publish("drive.cmd", frame.SerializeToString())
 
+        self.last_sent = (heading, throttle)
+        self.last_time = time.monotonic()
+        self.sent += 1
+
     def stop(self):
+        if self._trailing is not None:
+            self._trailing.cancel()
+            self._trailing = None
+
+        if self.pending is not None:
+            self.suppressed += 1
+            self.pending = None
+
+        # after a stop the next command has to go out whatever it is
+        self.last_sent = None
+
         frame = drive_pb2.AllStop()
         self.robot.publish("drive.all_stop", frame.SerializeToString())
 
+    def stats(self):
+        return {"sent": self.sent, "suppressed": self.suppressed}
+
 
-@snoop(depth=2)
 def main():
+    """Two Robots over NATS. Set SISSYBOT_SNOOP=1 to trace it with snoop."""
+    if os.environ.get("SISSYBOT_SNOOP"):
+        import snoop
+
+        snoop(depth=2)(demo)()
+    else:
+        demo()
+
+
+def demo():
     bp = Robot()
-    bp.connect("127.0.0.1:4222")
+    bp.connect("127.0.0.1", 4222)
     bp2 = Robot()
-    bp2.connect("127.0.0.1:4222")
+    bp2.connect("127.0.0.1", 4222)
 
-    # cmd = SubCmd("boo")
-    # bp2.gui_end.send(cmd)
-    # sub_pipe = bp2.gui_end.recv()
-    sub_pipe = bp2.subscribe("drive.cmd")
+    def on_drive(subject, payload):
+        print(subject, drive_pb2.DriveCmd.FromString(payload))
+
+    bp2.subscribe("drive.cmd", on_drive)
 
-    # cmd = PubCmd("boo", b"1234")
-    # bp.gui_end.send(cmd)
-    # bp.publish("boo", b"1234")
     bp.drive.cmd(180, 1.0)
     bp.drive.stop()
 
-    if sub_pipe.poll(3):
-        # print(sub_pipe.recv())
-
-        msg = sub_pipe.recv()
-        msg = drive_pb2.DriveFrame.FromString(msg.data)
-        print(msg)
-    if sub_pipe.poll(3):
-        # print(sub_pipe.recv())
-
-        msg = sub_pipe.recv()
-        msg = drive_pb2.DriveFrame.FromString(msg.data)
-        print(msg)
-
-    import time
+    deadline = time.monotonic() + 3
+    while time.monotonic() < deadline:
+        kivy.clock.Clock.tick()
+        time.sleep(0.01)
 
-    # time.sleep(30.0)
     bp.close()
     bp2.close()
 
@@ -0,0 +1,219 @@
+"""
+Drives sbs directly over TCP instead of through NATS, for Robot's "sbs"
+backend.
+
+SbsThread has NatsThread's interface. drive.cmd and drive.all_stop
+publishes become drive and drive_stop frames, and a HeartbeatSender pings
+sbs ten times a second so its watchdog stops the robot if this end goes
+quiet. Kivy isn't imported here.
+"""
+
+import asyncio
+import logging
+import random
+import threading
+import time
+
+from google.protobuf.message import DecodeError
+
+import sissyBot.errors as errors
+import sissyBot.heartbeat as heartbeat
+import sissyBot.net as net
+import sissyBot.proto.packet_pb2 as packet_pb2
+from sissyBot import loops
+from sissyBot.nats_proc import ConnState, ConnStatus
+from sissyBot.proto import drive_pb2
+
+RTT_INTERVAL = 2.0
+
+
+class SbsThread:
+    """
+    Runs a connection to sbs on an asyncio loop in a thread of this process.
+
+    Reconnects with jittered exponential backoff whenever the connection
+    drops. A link that goes quiet without closing is only reported, as
+    RECONNECTING, once no heartbeat echo has come back for `echo_timeout`
+    seconds: sbs will have stopped the robot by then, and keeps control with
+    this connection, so it carries on when the link does. Drive commands made
+    while down or quiet are dropped and counted, there is no point driving
+    on stale ones later; stops still go out if there's a connection. sbs has
+    no subscriptions, subscribe() and unsubscribe() do nothing.
+
+    Connection state goes to `on_status` from the connection's thread, with
+    the heartbeat round trip as the rtt.
+    """
+
+    def __init__(
+        self,
+        on_status,
+        loop=None,
+        hb_rate=10.0,
+        echo_timeout=1.0,
+        min_backoff=0.1,
+        max_backoff=5.0,
+    ):
+        self.on_status = on_status
+        self.hb_rate = hb_rate
+        self.echo_timeout = echo_timeout
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+
+        self.loop = loops.new_event_loop(loop)
+        self.thread = None
+        self.proc = None  # net.PacketProcessor while connected
+        self.heartbeat = None
+        self.quiet = False  # connected, but the echoes have stopped
+        self.reconnect_time = None
+
+        self.sent = 0
+        self.published = 0
+        self.dropped = 0
+
+        self.log = logging.getLogger("sbs link")
+
+    def connect(self, addr):
+        host, _, port = addr.rpartition(":")
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+        asyncio.run_coroutine_threadsafe(self.run(host, int(port)), self.loop)
+
+    def is_alive(self):
+        return self.thread is not None and self.thread.is_alive()
+
+    def _run(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+        self.loop.close()
+
+    def close(self):
+        future = asyncio.run_coroutine_threadsafe(self._shutdown(), self.loop)
+        future.result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+
+    def publish(self, subject, payload):
+        self.loop.call_soon_threadsafe(self._publish, subject, payload)
+        self.sent += 1
+
+    def subscribe(self, sid, subject):
+        pass
+
+    def unsubscribe(self, sid):
+        pass
+
+    def status(self, state, rtt=None):
+        self.on_status(
+            ConnStatus(state, rtt, self.reconnect_time, 0, self.dropped, self.published)
+        )
+
+    def _publish(self, subject, payload):
+        if self.proc is None:
+            self.dropped += 1
+            return
+
+        if subject == "drive.cmd":
+            if self.quiet:
+                self.dropped += 1
+                return
+            cmd = drive_pb2.DriveCmd.FromString(payload)
+            self.proc.send_drive(cmd.heading_delta, cmd.throttle)
+        elif subject == "drive.all_stop":
+            pkt = packet_pb2.Packet()
+            pkt.drive_stop.SetInParent()
+            self.proc.send_pkt(pkt)
+        else:
+            self.dropped += 1
+            return
+
+        self.published += 1
+
+    async def _shutdown(self):
+        for task in asyncio.all_tasks():
+            if task is not asyncio.current_task():
+                task.cancel()
+
+        if self.proc is not None:
+            self.proc.writer.close()
+            self.proc = None
+
+        self.status(ConnState.DOWN)
+
+    async def run(self, host, port):
+        backoff = self.min_backoff
+        down_since = None
+
+        while True:
+            try:
+                reader, writer, header, features = await net.open_connection(
+                    host, port, features=net.FEATURE_PACKED
+                )
+            except (OSError, errors.BadStreamError):
+                if down_since is None:
+                    down_since = time.monotonic()
+                self.status(ConnState.RECONNECTING)
+
+                await asyncio.sleep(random.uniform(0, backoff))
+                backoff = min(backoff * 2, self.max_backoff)
+                continue
+
+            if down_since is not None:
+                self.reconnect_time = time.monotonic() - down_since
+            backoff = self.min_backoff
+
+            await self._serve(reader, writer, header, features)
+
+            down_since = time.monotonic()
+            self.status(ConnState.RECONNECTING)
+
+    async def _serve(self, reader, writer, header, features):
+        stop_event = asyncio.Event()
+        proc = net.PacketProcessor(
+            reader, writer, stop_event, self.log, header, features=features
+        )
+        sender = heartbeat.HeartbeatSender(proc.send_pkt, self.hb_rate)
+        proc.handlers["ping"] = sender.handle_echo
+
+        self.proc = proc
+        self.heartbeat = sender
+        self.quiet = False
+        self.status(ConnState.UP)
+
+        tasks = [
+            asyncio.create_task(sender.run(stop_event)),
+            asyncio.create_task(self._watch(sender)),
+        ]
+        try:
+            await proc.recv_fn()
+        except (OSError, errors.BadStreamError, DecodeError) as e:
+            self.log.warning(f"sbs connection lost: {e}")
+        finally:
+            stop_event.set()
+            for task in tasks:
+                task.cancel()
+            self.proc = None
+            writer.close()
+
+    async def _watch(self, sender):
+        """Reports the rtt, and when the echoes stop and start again."""
+        started = time.monotonic()
+        last_report = started
+
+        while True:
+            await asyncio.sleep(sender.period)
+            now = time.monotonic()
+
+            quiet = now - (sender.last_echo or started) > self.echo_timeout
+            if quiet != self.quiet:
+                self.quiet = quiet
+                if quiet:
+                    self.log.warning(f"no heartbeat echo for {self.echo_timeout}s")
+                    self.status(ConnState.RECONNECTING)
+                else:
+                    self.log.info("heartbeat echoes back")
+                    self.status(ConnState.UP, sender.rtt.percentile(50))
+                continue
+
+            if not quiet and now - last_report >= RTT_INTERVAL and len(sender.rtt):
+                last_report = now
+                self.status(ConnState.UP, sender.rtt.percentile(50))
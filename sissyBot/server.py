@@ -1,11 +1,22 @@
+import argparse
 import asyncio
-import functools
 import logging
-import signal
 import math
 
+from google.protobuf.message import DecodeError
+
+import sissyBot.capture as capture
+import sissyBot.control as control
+import sissyBot.errors as errors
+import sissyBot.heartbeat as heartbeat
+import sissyBot.logs as logs
+import sissyBot.loops as loops
+import sissyBot.metrics as metrics
+import sissyBot.mixing as mixing
 import sissyBot.net as net
 
+drive_log = logging.getLogger("drive handler")
+
 
 def heading_trans(x):
     y = math.sin(math.radians(x)) * 1.6
@@ -20,38 +31,372 @@ def motor_calc(drive):
 
 
 def handle_drive(drive, writer):
-    log = logging.getLogger("drive handler")
-    # print(f"drive.heading: {drive.heading}, throttle: {drive.throttle}")
     l_motor, r_motor = motor_calc(drive)
-    print(
-        f"drive.heading: {drive.heading}, throttle: {drive.throttle}Motors:{l_motor}, {r_motor}"
+    drive_log.debug(
+        "drive.heading: %s, throttle: %s, motors: %s, %s",
+        drive.heading,
+        drive.throttle,
+        l_motor,
+        r_motor,
     )
 
 
 def handle_drive_stop(drive, writer):
-    print("ALL STOP")
+    drive_log.info("ALL STOP")
+
+
+class DriveCoalescer:
+    """
+    Keeps only the newest drive command per tick of the event loop.
+
+    Drive frames that arrive before the pending one is applied replace it, so
+    a backlog of stale joystick updates collapses to the latest. drive_stop
+    is never delayed and throws away any pending drive command.
+
+    With on_drive=None nothing is applied here, a consumer such as
+    control.ControlLoop calls take() on its own tick instead.
+    """
+
+    def __init__(self, on_drive=handle_drive, on_stop=handle_drive_stop):
+        self.on_drive = on_drive
+        self.on_stop = on_stop
+
+        self.pending = None
+        self.writer = None
+        self._flush_handle = None
+
+        self.received = 0
+        self.applied = 0
+        self.superseded = 0
+        self.dropped = 0
+        self.stops = 0
+
+    def __call__(self, frame, writer):
+        self.handle_batch([frame], writer)
+
+    def handle_batch(self, frames, writer):
+        self.received += len(frames)
+        self.superseded += len(frames) - 1
+
+        if self.pending is not None:
+            self.superseded += 1
+
+        self.pending = frames[-1]
+        self.writer = writer
+
+        if self.on_drive is not None and self._flush_handle is None:
+            loop = asyncio.get_running_loop()
+            self._flush_handle = loop.call_soon(self.flush)
+
+    def stop(self, frame, writer):
+        if self.pending is not None:
+            self.dropped += 1
+        self.pending = None
+
+        self.stops += 1
+        self.on_stop(frame, writer)
+
+    def take(self):
+        drive = self.pending
+        if drive is not None:
+            self.pending = None
+            self.applied += 1
+        return drive
+
+    def flush(self):
+        self._flush_handle = None
+
+        drive = self.take()
+        if drive is None:
+            return
+
+        self.on_drive(drive, self.writer)
+
+    def stats(self):
+        return {
+            "received": self.received,
+            "applied": self.applied,
+            "superseded": self.superseded,
+            "dropped": self.dropped,
+            "stops": self.stops,
+        }
 
 
-async def client_handler(reader, writer, stop_event=None, tasks_list=None):
+class Client:
+    """A live connection as seen by ConnectionManager."""
+
+    def __init__(self, cid, peer, task):
+        self.cid = cid
+        self.peer = peer
+        self.task = task
+
+        self.controller = False
+        self.drives = 0
+        self.stops = 0
+        self.ignored = 0
+
+
+class ControllerOnly:
+    """
+    Passes drive frames through only while the client has control, observers'
+    frames are counted and dropped. Also counts the client's stops, which go
+    through whoever sends them.
+    """
+
+    def __init__(self, handler, client):
+        self.handler = handler
+        self.client = client
+
+    def handle_batch(self, frames, writer):
+        if not self.client.controller:
+            self.client.ignored += len(frames)
+            return
+
+        self.client.drives += len(frames)
+        handle_batch = getattr(self.handler, "handle_batch", None)
+        if handle_batch:
+            handle_batch(frames, writer)
+        else:
+            for frame in frames:
+                self.handler(frame, writer)
+
+    def stop(self, frame, writer):
+        self.client.stops += 1
+        self.handler.stop(frame, writer)
+
+
+async def client_handler(
+    reader,
+    writer,
+    stop_event=None,
+    drive=None,
+    hb_deadline=0.5,
+    client=None,
+    max_buffer=None,
+    frame_rate=None,
+    proc=None,
+    capture=None,
+    metrics=None,
+):
+    """
+    Serves one client. reader and writer are ignored when an already connected
+    proc, e.g. a net.PacketProtocol, is passed in. capture is a
+    capture.CaptureStream to record the client's frames to and metrics a
+    net.FrameMetrics to count them in.
+
+    `drive` is normally shared by every client, so what is logged at the end
+    is this client's own counts, the totals are logged at shutdown.
+    """
     log = logging.getLogger("client_handler")
-    client = net.PacketProcessor(reader, writer, stop_event, log)
+    if proc is None:
+        proc = net.PacketProcessor(
+            reader,
+            writer,
+            stop_event,
+            log,
+            max_buffer=max_buffer,
+            frame_rate=frame_rate,
+            capture=capture,
+            metrics=metrics,
+        )
+
+    if drive is None:
+        drive = DriveCoalescer()
+
+    def on_timeout():
+        # an observer going quiet has no say over the motors
+        if client is None or client.controller:
+            drive.stop(None, writer)
+
+    monitor = heartbeat.HeartbeatMonitor(
+        proc.send_pkt, on_timeout, deadline=hb_deadline
+    )
+
+    proc.handlers["ping"] = monitor
+    if client is None:
+        proc.handlers["drive"] = drive
+        # anyone may stop the robot
+        proc.handlers["drive_stop"] = drive.stop
+    else:
+        controller_only = ControllerOnly(drive, client)
+        proc.handlers["drive"] = controller_only
+        proc.handlers["drive_stop"] = controller_only.stop
+
+    monitor_task = asyncio.create_task(monitor.run(stop_event))
+    try:
+        await proc.recv_fn()
+    except (errors.BadStreamError, DecodeError) as e:
+        log.error(f"dropping client: {e}")
+    finally:
+        monitor_task.cancel()
+
+    log.info(f"heartbeats: {monitor.stats()}")
+    if client is not None:
+        log.info(
+            f"client {client.cid}: {client.drives} drive frames, "
+            f"{client.stops} stops, ignored {client.ignored} drive frames, "
+            f"throttled for {proc.throttled:.3f}s"
+        )
+
 
-    def print_log(frame, writer):
-        import pdb
+class ConnectionManager:
+    """
+    Client callback for asyncio.start_server that keeps track of every
+    connection.
 
-        pdb.set_trace()
-        # print(f"ping:{frame.time}")
-        # log.info(f"ping{frame.time}")
+    The first client to connect has control of the robot, any others are
+    observers whose drive frames are ignored. When the controller leaves the
+    robot is stopped and the longest connected observer takes over. Any client
+    can send drive_stop.
 
-    client.handlers["ping"] = print_log
-    client.handlers["drive"] = handle_drive
-    client.handlers["drive_stop"] = handle_drive_stop
+    Use the instance itself with asyncio.start_server, its protocol method as
+    the factory for loop.create_server, or datagram_protocol for
+    loop.create_datagram_endpoint. Stream clients' frames are recorded to
+    `capture`, a capture.CaptureFile, and counted in `metrics`, a
+    net.FrameMetrics, if they are given.
+    """
 
-    await client.recv_fn()
+    def __init__(
+        self,
+        drive,
+        stop_event,
+        max_clients=64,
+        hb_deadline=0.5,
+        max_buffer=65536,
+        frame_rate=1000,
+        capture=None,
+        metrics=None,
+    ):
+        self.drive = drive
+        self.stop_event = stop_event
+        self.max_clients = max_clients
+        self.hb_deadline = hb_deadline
+        self.max_buffer = max_buffer
+        self.frame_rate = frame_rate
+        self.capture = capture
+        self.metrics = metrics
 
+        self.clients = {}  # cid -> Client, oldest first
+        self._next_cid = 0
 
-async def main(client_cb, port=4443):
-    server = await asyncio.start_server(client_cb, port=port)
+        self.accepted = 0
+        self.rejected = 0
+
+        self.log = logging.getLogger("connections")
+
+    @property
+    def controller(self):
+        for client in self.clients.values():
+            if client.controller:
+                return client
+        return None
+
+    async def __call__(self, reader, writer, proc=None):
+        peer = writer.get_extra_info("peername")
+
+        if len(self.clients) >= self.max_clients:
+            self.rejected += 1
+            self.log.warning(f"refusing {peer}, {self.max_clients} clients connected")
+            # a datagram sender would otherwise be back as a new peer, and a
+            # new warning, with its next datagram
+            reject = getattr(proc, "reject", None)
+            if reject is not None:
+                reject()
+            else:
+                writer.close()
+            return
+
+        self.accepted += 1
+        client = Client(self._next_cid, peer, asyncio.current_task())
+        self._next_cid += 1
+
+        self.clients[client.cid] = client
+        self._elect()
+
+        if proc is None:
+            capture_stream = self._capture_stream()
+        else:
+            capture_stream = getattr(proc, "capture", None)
+
+        try:
+            await client_handler(
+                reader,
+                writer,
+                self.stop_event,
+                drive=self.drive,
+                hb_deadline=self.hb_deadline,
+                client=client,
+                max_buffer=self.max_buffer,
+                frame_rate=self.frame_rate,
+                proc=proc,
+                capture=capture_stream if proc is None else None,
+                metrics=self.metrics,
+            )
+        finally:
+            del self.clients[client.cid]
+            if client.controller:
+                self.log.info(f"controller {peer} left")
+                self.drive.stop(None, writer)
+                self._elect()
+            if capture_stream is not None:
+                capture_stream.close()
+            writer.close()
+
+    def protocol(self):
+        return net.PacketProtocol(
+            self.stop_event,
+            logging.getLogger("client_handler"),
+            max_buffer=self.max_buffer,
+            frame_rate=self.frame_rate,
+            on_connect=self._proc_connected,
+            capture=self._capture_stream(),
+            metrics=self.metrics,
+        )
+
+    def datagram_protocol(self):
+        """Factory for loop.create_datagram_endpoint, each sender is a client."""
+        return net.DatagramEndpoint(
+            self.stop_event,
+            logging.getLogger("client_handler"),
+            frame_rate=self.frame_rate,
+            on_peer=self._proc_connected,
+            peer_timeout=max(5.0, self.hb_deadline * 4),
+        )
+
+    def _capture_stream(self):
+        if self.capture is None:
+            return None
+        return self.capture.stream()
+
+    def _proc_connected(self, proc):
+        asyncio.get_running_loop().create_task(self(None, proc.writer, proc=proc))
+
+    def _elect(self):
+        if self.clients and self.controller is None:
+            client = next(iter(self.clients.values()))
+            client.controller = True
+            self.log.info(f"client {client.cid} {client.peer} has control")
+
+    async def close(self):
+        tasks = [client.task for client in self.clients.values()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def stats(self):
+        return {
+            "connected": len(self.clients),
+            "accepted": self.accepted,
+            "rejected": self.rejected,
+        }
+
+
+async def main(client_cb, port=4443, protocol=False):
+    if protocol:
+        loop = asyncio.get_running_loop()
+        server = await loop.create_server(client_cb, port=port)
+    else:
+        server = await asyncio.start_server(client_cb, port=port)
 
     addr = server.sockets[0].getsockname()
     print(f"Serving on {addr}")
@@ -60,32 +405,197 @@ async def main(client_cb, port=4443):
 
 
 def serve():
-    FORMAT = "%(asctime)-15s %(message)s"
-    logging.basicConfig(format=FORMAT)
+    parser = argparse.ArgumentParser(description="SissyBot drive server.")
+    parser.add_argument("--port", type=int, default=4443)
+    parser.add_argument(
+        "--rate", type=float, default=200, help="motor control loop rate in Hz"
+    )
+    parser.add_argument(
+        "--slew",
+        type=float,
+        default=8.0,
+        help="max change in motor output per second, 0 for no limit",
+    )
+    parser.add_argument(
+        "--mix-gain",
+        type=float,
+        default=1.6,
+        help="gain of the sine mixing curve, outputs clip at 1",
+    )
+    parser.add_argument(
+        "--heartbeat-timeout",
+        type=float,
+        default=0.5,
+        help="all stop if a client's heartbeats stop for this many seconds",
+    )
+    parser.add_argument("--backend", choices=sorted(control.BACKENDS), default="log")
+    parser.add_argument("--max-clients", type=int, default=64)
+    parser.add_argument(
+        "--max-frame-rate",
+        type=float,
+        default=1000,
+        help="frames per second a client may send before its reads are paused",
+    )
+    parser.add_argument(
+        "--max-read-buffer",
+        type=int,
+        default=65536,
+        help="drop a client whose unparsed data outgrows this many bytes",
+    )
+    parser.add_argument(
+        "--receiver",
+        choices=("stream", "protocol"),
+        default="stream",
+        help="read clients with StreamReader or with a BufferedProtocol",
+    )
+    parser.add_argument(
+        "--udp-port",
+        type=int,
+        default=None,
+        help="also take drive commands as datagrams on this port",
+    )
+    parser.add_argument(
+        "--loop",
+        choices=loops.LOOPS,
+        default=None,
+        help=f"event loop to run on, defaults to ${loops.ENV_VAR} or asyncio",
+    )
+    parser.add_argument(
+        "--capture",
+        metavar="FILE",
+        default=None,
+        help="append every frame TCP clients send to FILE, for sbs-replay",
+    )
+    parser.add_argument(
+        "--metrics-port",
+        type=int,
+        default=None,
+        help="serve Prometheus metrics on this port at /metrics",
+    )
+    parser.add_argument(
+        "--metrics-host",
+        default="127.0.0.1",
+        help="address to serve metrics on, local only by default",
+    )
+    parser.add_argument(
+        "--metrics-sample",
+        type=int,
+        default=8,
+        help="time one read in this many, frames are counted regardless",
+    )
+    parser.add_argument(
+        "--log",
+        metavar="LEVELS",
+        type=logs.level_spec,
+        default=None,
+        help=f'log levels, e.g. "info,motors=debug", defaults to ${logs.ENV_VAR} '
+        f"or {logs.DEFAULT_LEVELS}",
+    )
+    parser.add_argument(
+        "--log-rate",
+        type=float,
+        default=logs.RATE,
+        help="records a second let through per drive or motor logger, 0 for all",
+    )
+    args = parser.parse_args()
+
+    log_queue = logs.QueueLogging(levels=args.log, rate=args.log_rate)
+    log_queue.start()
+    try:
+        loops.run(run_server(args), args.loop)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        log_queue.stop()
 
-    loop = asyncio.get_event_loop()
 
+async def run_server(args):
+    """Serves until cancelled, which asyncio.Runner does on Ctrl-C."""
     stop_event = asyncio.Event()
-    tasks = []
 
-    client_cb = functools.partial(
-        client_handler, stop_event=stop_event, tasks_list=tasks
+    control_loop = control.ControlLoop(
+        None,
+        control.BACKENDS[args.backend](),
+        mixing.Mixer(mixing.sine_curve(args.mix_gain)).motor_calc,
+        rate=args.rate,
+        slew=args.slew,
     )
+    drive = DriveCoalescer(on_drive=None, on_stop=control_loop.all_stop)
+    control_loop.slot = drive
 
-    svr_start_task = loop.create_task(main(client_cb))
+    capture_file = None
+    if args.capture is not None:
+        capture_file = capture.CaptureFile(args.capture)
+        print(f"Capturing to {args.capture}")
 
-    loop.run_until_complete(svr_start_task)
+    connections = ConnectionManager(
+        drive,
+        stop_event,
+        max_clients=args.max_clients,
+        hb_deadline=args.heartbeat_timeout,
+        max_buffer=args.max_read_buffer,
+        frame_rate=args.max_frame_rate,
+        capture=capture_file,
+        metrics=net.FrameMetrics(sample_every=args.metrics_sample),
+    )
+
+    if args.receiver == "protocol":
+        client_cb = connections.protocol
+    else:
+        client_cb = connections
+
+    server = await main(client_cb, port=args.port, protocol=args.receiver == "protocol")
+    control_task = asyncio.create_task(control_loop.run(stop_event))
 
-    server = svr_start_task.result()
+    metrics_server = None
+    if args.metrics_port is not None:
+        exporter = metrics.Exporter()
+        exporter.add(lambda: metrics.frame_metrics(connections.metrics))
+        exporter.add(
+            lambda: metrics.stats_gauges("sissybot_connections", connections.stats())
+        )
+        exporter.add(lambda: metrics.stats_gauges("sissybot_drive", drive.stats()))
+        exporter.add(
+            lambda: metrics.stats_gauges("sissybot_control", control_loop.stats())
+        )
+        metrics_server = await exporter.start(args.metrics_host, args.metrics_port)
+        print(f"Metrics on {metrics_server.sockets[0].getsockname()}")
 
-    svr_task = loop.create_task(server.serve_forever())
+    udp_transport = None
+    if args.udp_port is not None:
+        loop = asyncio.get_running_loop()
+        udp_transport, _ = await loop.create_datagram_endpoint(
+            connections.datagram_protocol, local_addr=("0.0.0.0", args.udp_port)
+        )
+        print(f"Datagrams on {udp_transport.get_extra_info('sockname')}")
 
+    # not server.serve_forever(), once cancelled it waits for every client
+    # to hang up before we get the chance to close them
     try:
-        loop.run_forever()
-    except KeyboardInterrupt:
+        await stop_event.wait()
+    finally:
         stop_event.set()
         server.close()
-        loop.run_until_complete(server.wait_closed())
+        if metrics_server is not None:
+            metrics_server.close()
+        await connections.close()
+        if udp_transport is not None:
+            udp_transport.close()
+        await server.wait_closed()
+        await control_task
 
-        for task in tasks:
-            loop.run_until_complete(task)
+        print(f"control loop: {control_loop.stats()}")
+        print(f"drive commands: {drive.stats()}")
+        print(f"connections: {connections.stats()}")
+        frame_metrics = connections.metrics
+        for number, count in frame_metrics.frames().items():
+            pcts = frame_metrics.handler_ns[number].percentiles(50, 99)
+            if pcts[50] is None:
+                continue
+            print(
+                f"{net.FRAME_TYPES.get(number)}: {count} frames, handler "
+                f"p50 {pcts[50] / 1000:.1f}us p99 {pcts[99] / 1000:.1f}us"
+            )
+        if capture_file is not None:
+            print(f"capture: {capture_file.stats()}")
+            capture_file.close()
@@ -0,0 +1,142 @@
+"""
+Single producer, single consumer ring of fixed size slots in shared memory.
+
+Used to get publish commands from the GUI process into the NATS process
+without pickling them. The producer writes a slot and then moves the head
+index, the consumer reads slots up to the head and then moves the tail.
+Plain stores to shared memory aren't ordered on every CPU (ARM, say, may
+make the new head visible before the slot it covers), so the indices are
+only read and written holding a shared lock, whose acquire and release are
+barriers. Python has no atomic stores or fences to build a lock-free ring
+from, and uncontended the lock costs a fraction of a put. Slots are copied
+outside it. A doorbell pipe wakes the consumer's event loop when the ring
+goes from empty to not empty.
+
+The last `reserve` slots only take put(..., reserved=True), so a message
+that must get through still fits once ordinary ones have filled the ring.
+"""
+
+import multiprocessing
+import struct
+from multiprocessing import shared_memory
+
+INDEX = struct.Struct("=Q")
+SLOT_HDR = struct.Struct("=BH")  # subject length, payload length
+
+HEAD = 0
+TAIL = INDEX.size
+SLOTS = INDEX.size * 2
+
+
+class ShmRing:
+    def __init__(self, slots=256, slot_size=256, reserve=8):
+        self.slots = slots
+        self.slot_size = slot_size
+        self.reserve = reserve
+
+        self.shm = shared_memory.SharedMemory(
+            create=True, size=SLOTS + slots * slot_size
+        )
+        self.shm.buf[:SLOTS] = bytes(SLOTS)
+
+        self.doorbell_recv, self.doorbell_send = multiprocessing.Pipe(False)
+        # spawn, as NatsProc starts its child that way
+        self.index_lock = multiprocessing.get_context("spawn").Lock()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["shm"] = self.shm.name
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        # the creating process owns and unlinks the segment
+        self.shm = shared_memory.SharedMemory(name=state["shm"], track=False)
+
+    def _get(self, offset):
+        return INDEX.unpack_from(self.shm.buf, offset)[0]
+
+    def _set(self, offset, value):
+        INDEX.pack_into(self.shm.buf, offset, value)
+
+    def max_payload(self, subject):
+        return self.slot_size - SLOT_HDR.size - len(subject)
+
+    def fits(self, subject, payload):
+        """Whether put() can take this subject and payload."""
+        return len(subject) <= 0xFF and len(payload) <= self.max_payload(subject)
+
+    def put(self, subject, payload, reserved=False):
+        """
+        Producer side. Returns False if the ring is full, or only reserved
+        slots are left and `reserved` isn't set.
+
+        `subject` is the encoded subject, at most 255 bytes.
+        """
+        if not self.fits(subject, payload):
+            raise ValueError(
+                f"{len(subject)} byte subject and {len(payload)} byte payload "
+                f"do not fit a {self.slot_size} byte slot"
+            )
+
+        with self.index_lock:
+            head = self._get(HEAD)
+            used = head - self._get(TAIL)
+        if used >= (self.slots if reserved else self.slots - self.reserve):
+            return False
+
+        offset = SLOTS + (head % self.slots) * self.slot_size
+        buf = self.shm.buf
+
+        SLOT_HDR.pack_into(buf, offset, len(subject), len(payload))
+        offset += SLOT_HDR.size
+        buf[offset : offset + len(subject)] = subject
+        offset += len(subject)
+        buf[offset : offset + len(payload)] = payload
+
+        # only ring if the consumer had caught up, it may be asleep. The tail
+        # is read after the head is published so we can't miss it going idle.
+        with self.index_lock:
+            self._set(HEAD, head + 1)
+            idle = self._get(TAIL) == head
+        if idle:
+            self.doorbell_send.send_bytes(b"")
+
+        return True
+
+    def drain(self):
+        """Consumer side, yields (subject, payload) until the ring is empty."""
+        buf = self.shm.buf
+        with self.index_lock:
+            tail = self._get(TAIL)
+
+        while True:
+            with self.index_lock:
+                head = self._get(HEAD)
+            if tail == head:
+                return
+
+            while tail != head:
+                offset = SLOTS + (tail % self.slots) * self.slot_size
+                sub_len, payload_len = SLOT_HDR.unpack_from(buf, offset)
+                offset += SLOT_HDR.size
+
+                subject = bytes(buf[offset : offset + sub_len]).decode()
+                offset += sub_len
+                payload = bytes(buf[offset : offset + payload_len])
+
+                tail += 1
+                with self.index_lock:
+                    self._set(TAIL, tail)
+
+                yield subject, payload
+
+    def clear_doorbell(self):
+        while self.doorbell_recv.poll():
+            self.doorbell_recv.recv_bytes()
+
+    def close(self):
+        self.shm.close()
+
+    def unlink(self):
+        self.shm.unlink()
@@ -0,0 +1,139 @@
+import collections
+import math
+
+
+class RollingWindow:
+    """The last `size` samples of something, for percentiles."""
+
+    def __init__(self, size=1000):
+        self.samples = collections.deque(maxlen=size)
+
+    def __len__(self):
+        return len(self.samples)
+
+    def add(self, value):
+        self.samples.append(value)
+
+    def percentile(self, pct):
+        return self.percentiles(pct)[pct]
+
+    def percentiles(self, *pcts):
+        if not self.samples:
+            return {pct: None for pct in pcts}
+
+        ordered = sorted(self.samples)
+        return {
+            pct: ordered[max(0, math.ceil(pct / 100 * len(ordered)) - 1)]
+            for pct in pcts
+        }
+
+
+class Histogram:
+    """
+    HDR style histogram of non-negative ints, e.g. nanoseconds.
+
+    Below 2 << sub_bits every value has its own bucket, above that each power
+    of two is split into 1 << sub_bits buckets, so what it reports is within
+    1 / (1 << sub_bits) of the true value. Recording is a few integer ops
+    however many samples there are, and nothing is allocated. Values of
+    1 << max_bits or more land in the last bucket.
+    """
+
+    def __init__(self, sub_bits=5, max_bits=40):
+        self.sub_bits = sub_bits
+        self._linear = 2 << sub_bits
+        self._last = ((max_bits - sub_bits + 1) << sub_bits) - 1  # top bucket
+        self.counts = [0] * (self._last + 1)
+
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    def __len__(self):
+        return self.count
+
+    def _index(self, value):
+        if value < self._linear:
+            return value if value > 0 else 0
+        shift = value.bit_length() - self.sub_bits - 1
+        return min((shift << self.sub_bits) + (value >> shift), self._last)
+
+    def _highest(self, idx):
+        """Largest value counted in bucket idx."""
+        if idx < self._linear:
+            return idx
+        shift = (idx >> self.sub_bits) - 1
+        return ((idx - (shift << self.sub_bits)) << shift) + (1 << shift) - 1
+
+    def record(self, value, count=1):
+        # _index() inlined, this is on the hot path
+        shift = value.bit_length() - self.sub_bits - 1
+        if shift > 0:
+            idx = (shift << self.sub_bits) + (value >> shift)
+            if idx > self._last:
+                idx = self._last
+        elif value > 0:
+            idx = value
+        else:
+            idx = 0
+
+        self.counts[idx] += count
+        self.count += count
+        self.total += value * count
+        if value > self.max:
+            self.max = value
+
+    def merge(self, other):
+        for idx, count in enumerate(other.counts):
+            if count:
+                self.counts[idx] += count
+        self.count += other.count
+        self.total += other.total
+        self.max = max(self.max, other.max)
+
+    def reset(self):
+        self.counts = [0] * len(self.counts)
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    def mean(self):
+        return self.total / self.count if self.count else None
+
+    def percentile(self, pct):
+        return self.percentiles(pct)[pct]
+
+    def percentiles(self, *pcts):
+        if not self.count:
+            return {pct: None for pct in pcts}
+
+        wanted = sorted(pcts)
+        result = {}
+        seen = 0
+        for idx, count in enumerate(self.counts):
+            if not count:
+                continue
+            seen += count
+            while wanted and seen >= math.ceil(wanted[0] / 100 * self.count):
+                result[wanted.pop(0)] = min(self._highest(idx), self.max)
+            if not wanted:
+                break
+
+        for pct in wanted:
+            result[pct] = self.max
+        return result
+
+    def cumulative(self, bounds):
+        """
+        [(bound, samples <= bound)] for ascending bounds, as in a Prometheus
+        histogram. A bucket counts towards a bound once its top is within it.
+        """
+        result = []
+        seen = 0
+        idx = 0
+        for bound in bounds:
+            while idx < len(self.counts) and self._highest(idx) <= bound:
+                seen += self.counts[idx]
+                idx += 1
+            result.append((bound, seen))
+        return result
@@ -0,0 +1,15 @@
+import socket
+
+import pytest
+
+NATS_ADDR = ("127.0.0.1", 4222)
+
+
+@pytest.fixture
+def nats_addr():
+    """host:port of a local NATS server, the test is skipped if none is up."""
+    try:
+        socket.create_connection(NATS_ADDR, timeout=0.5).close()
+    except OSError:
+        pytest.skip(f"no NATS server on {NATS_ADDR[0]}:{NATS_ADDR[1]}")
+    return "%s:%d" % NATS_ADDR
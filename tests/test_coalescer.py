@@ -0,0 +1,80 @@
+"""server.DriveCoalescer."""
+
+import asyncio
+
+import sissyBot.server as server
+
+
+def test_take_returns_the_newest():
+    drive = server.DriveCoalescer(on_drive=None)
+    drive("a", None)
+    drive.handle_batch(["b", "c"], None)
+    drive("d", None)
+
+    assert drive.take() == "d"
+    assert drive.take() is None
+    assert drive.stats() == {
+        "received": 4,
+        "applied": 1,
+        "superseded": 3,
+        "dropped": 0,
+        "stops": 0,
+    }
+
+
+def test_flush_applies_the_newest_once_per_tick():
+    applied = []
+
+    async def run():
+        drive = server.DriveCoalescer(
+            on_drive=lambda frame, writer: applied.append((frame, writer)),
+            on_stop=None,
+        )
+        for frame in range(5):
+            drive(frame, "writer")
+        await asyncio.sleep(0)
+        drive.handle_batch([5, 6], "writer")
+        await asyncio.sleep(0)
+        await asyncio.sleep(0)
+        return drive
+
+    drive = asyncio.run(run())
+    assert applied == [(4, "writer"), (6, "writer")]
+    assert drive.applied == 2
+    assert drive.superseded == 5
+
+
+def test_stop_drops_the_pending_drive():
+    stops = []
+    drive = server.DriveCoalescer(
+        on_drive=None, on_stop=lambda frame, writer: stops.append(frame)
+    )
+    drive("forward", None)
+    drive.stop("stop", None)
+
+    assert stops == ["stop"]
+    assert drive.take() is None
+    assert drive.dropped == 1
+    assert drive.stops == 1
+
+    # a stop with nothing pending drops nothing
+    drive.stop("stop", None)
+    assert drive.dropped == 1
+    assert drive.stops == 2
+
+
+def test_stop_is_not_delayed():
+    order = []
+
+    async def run():
+        drive = server.DriveCoalescer(
+            on_drive=lambda frame, writer: order.append(frame),
+            on_stop=lambda frame, writer: order.append(frame),
+        )
+        drive("forward", None)
+        drive.stop("stop", None)
+        await asyncio.sleep(0)
+
+    asyncio.run(run())
+    # the pending drive never goes out after the stop
+    assert order == ["stop"]
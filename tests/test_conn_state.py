@@ -0,0 +1,103 @@
+"""How Robot learns about connection state from its NATS backend."""
+
+import logging
+import multiprocessing
+import threading
+
+import sissyBot.robot as robot
+from sissyBot.nats_proc import ConnState, ConnStatus
+
+
+class Clock:
+    def __init__(self):
+        self.scheduled = []
+        self.ready = threading.Event()
+
+    def schedule_once(self, callback, timeout=0):
+        self.scheduled.append(callback)
+        self.ready.set()
+
+    def run(self):
+        scheduled, self.scheduled = self.scheduled, []
+        for callback in scheduled:
+            callback(0)
+
+
+def test_status_sets_properties():
+    bot = robot.Robot()
+    ups = []
+    bot.bind(up=lambda _, value: ups.append(value))
+
+    bot._on_status(ConnStatus(ConnState.UP, rtt=0.004, buffered=2, published=7))
+    assert bot.up and bot.state == ConnState.UP
+    assert (bot.rtt, bot.buffered, bot.published) == (0.004, 2, 7)
+
+    # rtt is kept when a status has none
+    bot._on_status(ConnStatus(ConnState.RECONNECTING, reconnect_time=0.5))
+    assert not bot.up and bot.state == ConnState.RECONNECTING
+    assert (bot.rtt, bot.reconnect_time) == (0.004, 0.5)
+
+    bot._on_status(ConnStatus(ConnState.DOWN))
+    assert ups == [True, False]
+
+
+def test_push_hands_each_message_to_the_clock():
+    bot = robot.Robot()
+    bot.clock = Clock()
+    recv_end, send_end = multiprocessing.Pipe(duplex=False)
+
+    watcher = threading.Thread(target=bot._watch_state, args=(recv_end,))
+    watcher.start()
+
+    send_end.send(ConnStatus(ConnState.UP, rtt=0.001))
+    assert bot.clock.ready.wait(5)
+    # nothing changes until the main loop runs what was scheduled
+    assert not bot.up
+    bot.clock.run()
+    assert bot.up and bot.rtt == 0.001
+
+    # closing the pipe ends the watcher
+    send_end.close()
+    watcher.join(5)
+    assert not watcher.is_alive()
+
+
+def test_child_log_records_are_logged_here(caplog):
+    bot = robot.Robot()
+    bot.clock = Clock()
+    recv_end, send_end = multiprocessing.Pipe(duplex=False)
+
+    record = logging.LogRecord("nats", logging.WARNING, "", 0, "lost it", (), None)
+    send_end.send(record)
+    send_end.close()
+    with caplog.at_level(logging.WARNING, logger="nats"):
+        bot._watch_state(recv_end)
+
+    assert [rec.getMessage() for rec in caplog.records] == ["lost it"]
+    assert bot.clock.scheduled == []
+
+
+def test_poll_drains_the_pipe():
+    bot = robot.Robot()
+    recv_end, send_end = multiprocessing.Pipe(duplex=False)
+
+    class Proc:
+        conn_state_recv_end = recv_end
+
+    bot.nat_proc = Proc()
+    send_end.send(ConnStatus(ConnState.RECONNECTING))
+    send_end.send(ConnStatus(ConnState.UP, rtt=0.002))
+    bot.check_up(0.2)
+    assert bot.up and bot.rtt == 0.002
+
+    class Event:
+        cancelled = False
+
+        def cancel(self):
+            self.cancelled = True
+
+    bot.event = Event()
+    send_end.close()
+    bot.check_up(0.2)
+    assert bot.event.cancelled
+    bot.nat_proc = None
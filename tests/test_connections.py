@@ -0,0 +1,106 @@
+"""server.ConnectionManager over real TCP connections."""
+
+import asyncio
+
+import sissyBot.net as net
+import sissyBot.server as server
+from sissyBot.proto import packet_pb2
+
+HOST = "127.0.0.1"
+
+
+def drive_pkt(heading):
+    return net.insert_pkt_len(net.encode_drive(heading, 0.5))
+
+
+def stop_pkt():
+    pkt = packet_pb2.Packet()
+    pkt.drive_stop.SetInParent()
+    return net.insert_pkt_len(pkt.SerializeToString())
+
+
+async def settle(check, timeout=2.0):
+    for _ in range(int(timeout / 0.01)):
+        if check():
+            return
+        await asyncio.sleep(0.01)
+    raise AssertionError("timed out")
+
+
+def test_first_client_controls_and_hands_over():
+    stops = []
+
+    async def run():
+        stop_event = asyncio.Event()
+        drive = server.DriveCoalescer(
+            on_drive=None, on_stop=lambda frame, writer: stops.append(frame)
+        )
+        manager = server.ConnectionManager(drive, stop_event, max_clients=2)
+        sbs = await asyncio.start_server(manager, HOST, 0)
+        port = sbs.sockets[0].getsockname()[1]
+
+        _, first = await asyncio.open_connection(HOST, port)
+        await settle(lambda: len(manager.clients) == 1)
+        second_reader, second = await asyncio.open_connection(HOST, port)
+        await settle(lambda: len(manager.clients) == 2)
+        controller, observer = manager.clients.values()
+        assert manager.controller is controller
+
+        first.write(drive_pkt(10))
+        second.write(drive_pkt(20))
+        await settle(lambda: controller.drives and observer.ignored)
+        assert drive.take().heading == 10
+        assert drive.take() is None
+
+        # anyone may stop the robot
+        second.write(stop_pkt())
+        await settle(lambda: observer.stops)
+        assert len(stops) == 1
+
+        # no room for a third
+        third_reader, third = await asyncio.open_connection(HOST, port)
+        assert await third_reader.read() == b""
+        assert manager.rejected == 1
+
+        # the controller leaving stops the robot and the observer takes over
+        first.close()
+        await settle(lambda: manager.controller is observer)
+        assert len(stops) == 2 and stops[1] is None
+        second.write(drive_pkt(30))
+        await settle(lambda: observer.drives)
+        assert drive.take().heading == 30
+
+        assert manager.stats() == {"connected": 1, "accepted": 2, "rejected": 1}
+        second.close()
+        third.close()
+        await settle(lambda: not manager.clients)
+
+        stop_event.set()
+        sbs.close()
+        await manager.close()
+
+    asyncio.run(run())
+
+
+def test_controller_only():
+    applied = []
+    stops = []
+
+    class Handler:
+        def handle_batch(self, frames, writer):
+            applied.extend(frames)
+
+        def stop(self, frame, writer):
+            stops.append(frame)
+
+    client = server.Client(0, None, None)
+    handler = server.ControllerOnly(Handler(), client)
+
+    handler.handle_batch([1, 2], None)
+    handler.stop("stop", None)
+    assert (applied, stops, client.ignored, client.stops) == ([], ["stop"], 2, 1)
+
+    client.controller = True
+    handler.handle_batch([3], None)
+    assert applied == [3]
+    assert client.drives == 1
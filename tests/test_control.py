@@ -0,0 +1,92 @@
+"""control.ControlLoop."""
+
+import asyncio
+
+import pytest
+
+import sissyBot.control as control
+
+
+class Slot:
+    def __init__(self):
+        self.pending = None
+
+    def take(self):
+        drive, self.pending = self.pending, None
+        return drive
+
+
+class Backend:
+    def __init__(self):
+        self.sets = []
+        self.stops = 0
+
+    def set(self, l_motor, r_motor):
+        self.sets.append((l_motor, r_motor))
+
+    def stop(self):
+        self.stops += 1
+
+
+def make_loop(**kwargs):
+    slot = Slot()
+    backend = Backend()
+    loop = control.ControlLoop(slot, backend, lambda drive: drive, **kwargs)
+    return loop, slot, backend
+
+
+def test_slew_limits_each_tick():
+    # 8 per second at 100 ticks a second is 0.08 a tick
+    loop, slot, backend = make_loop(rate=100, slew=8.0)
+    slot.pending = (1.0, -0.1)
+
+    loop.tick()
+    assert backend.sets[-1] == pytest.approx((0.08, -0.08))
+    for _ in range(20):
+        loop.tick()
+    assert backend.sets[-1] == pytest.approx((1.0, -0.1))
+
+    # nothing written once the output reaches the target
+    count = len(backend.sets)
+    loop.tick()
+    assert len(backend.sets) == count
+
+
+def test_no_slew_limit():
+    loop, slot, backend = make_loop(slew=0)
+    slot.pending = (1.0, -1.0)
+    loop.tick()
+    assert backend.sets == [(1.0, -1.0)]
+
+
+def test_all_stop_skips_the_slew_limit():
+    loop, slot, backend = make_loop(rate=100, slew=8.0)
+    slot.pending = (1.0, 1.0)
+    for _ in range(20):
+        loop.tick()
+
+    count = len(backend.sets)
+    loop.all_stop()
+    assert loop.output == (0.0, 0.0)
+    assert backend.stops == 1
+    # and the old command doesn't start them again
+    loop.tick()
+    assert len(backend.sets) == count
+
+
+def test_run_ticks_and_stops_on_exit():
+    loop, slot, backend = make_loop(rate=200)
+    slot.pending = (0.5, 0.5)
+
+    async def run():
+        stop_event = asyncio.Event()
+        task = asyncio.create_task(loop.run(stop_event))
+        await asyncio.sleep(0.1)
+        stop_event.set()
+        await task
+
+    asyncio.run(run())
+    # generous, CI machines miss ticks
+    assert 5 < loop.ticks <= 25
+    assert backend.stops == 1
+    assert loop.stats()["ticks"] == loop.ticks
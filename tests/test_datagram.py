@@ -0,0 +1,156 @@
+"""The sequenced datagram transport: net.DatagramPeer and DatagramEndpoint."""
+
+import asyncio
+import logging
+
+import sissyBot.net as net
+import sissyBot.proto.packet_pb2 as packet_pb2
+from bench import lossy_udp
+
+log = logging.getLogger("test")
+
+
+class FakeTransport:
+    def __init__(self):
+        self.sent = []
+
+    def is_closing(self):
+        return False
+
+    def sendto(self, data, addr):
+        self.sent.append((data, addr))
+
+
+def datagram(seq, **frame):
+    pkt = packet_pb2.Packet()
+    if "drive" in frame:
+        pkt.drive.heading, pkt.drive.throttle = frame["drive"]
+    elif "stop" in frame:
+        pkt.drive_stop.SetInParent()
+    else:
+        pkt.ping.time = frame["ping"]
+    return net.DGRAM_SEQ.pack(seq) + pkt.SerializeToString()
+
+
+async def make_peer():
+    endpoint = net.DatagramEndpoint(None, log, peer_timeout=None)
+    endpoint.connection_made(FakeTransport())
+    peer = endpoint.peer(("127.0.0.1", 9))
+
+    applied = []
+    peer.handlers["drive"] = lambda frame, writer: applied.append(frame.heading)
+    peer.handlers["drive_stop"] = lambda frame, writer: applied.append("stop")
+    peer.handlers["ping"] = lambda frame, writer: applied.append("ping")
+
+    task = asyncio.create_task(peer.recv_fn())
+    await asyncio.sleep(0)
+    return endpoint, peer, applied, task
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def test_stale_and_out_of_order_drives_are_dropped():
+    async def main():
+        _, peer, applied, task = await make_peer()
+        for seq in (1, 2, 5, 3, 4, 6, 6):
+            peer.datagram_received(datagram(seq, drive=(seq, 0.5)))
+        peer.close()
+        await task
+        return peer, applied
+
+    peer, applied = run(main())
+    assert applied == [1, 2, 5, 6]
+    assert peer.stale == 3
+
+
+def test_pings_are_never_stale():
+    async def main():
+        _, peer, applied, task = await make_peer()
+        peer.datagram_received(datagram(5, drive=(5, 0.5)))
+        peer.datagram_received(datagram(2, ping=1))
+        peer.close()
+        await task
+        return applied
+
+    assert run(main()) == [5, "ping"]
+
+
+def test_late_stop_applied_once():
+    async def main():
+        _, peer, applied, task = await make_peer()
+        peer.datagram_received(datagram(10, drive=(10, 0.5)))
+        # the stop's first copy was lost and the next drive overtook the rest
+        peer.datagram_received(datagram(12, drive=(12, 0.5)))
+        for _ in range(net.DatagramPeer.STOP_COPIES - 1):
+            peer.datagram_received(datagram(11, stop=True))
+        peer.close()
+        await task
+        return peer, applied
+
+    peer, applied = run(main())
+    assert applied == [10, 12, "stop"]
+    assert peer.late_stops == 1
+    assert peer.stale == 1
+
+
+def test_sequence_wraps_around():
+    last = net.SEQ_MOD - 1
+    assert net.seq_newer(0, last)
+    assert not net.seq_newer(last, 0)
+
+    async def main():
+        _, peer, applied, task = await make_peer()
+        for seq in (last - 1, last, 0, last, 1):
+            peer.datagram_received(datagram(seq, drive=(seq % 1000, 0.5)))
+        peer.close()
+        await task
+        return applied
+
+    assert run(main()) == [(last - 1) % 1000, last % 1000, 0, 1]
+
+
+def test_send_stop_repeats_under_one_sequence_number():
+    async def main():
+        endpoint, peer, _, task = await make_peer()
+        pkt = packet_pb2.Packet()
+        pkt.drive_stop.SetInParent()
+        peer.send_pkt(pkt)
+        peer.send_drive(1, 0.5)
+        await asyncio.sleep(
+            net.DatagramPeer.STOP_INTERVAL * net.DatagramPeer.STOP_COPIES
+        )
+        peer.close()
+        await task
+        return [data for data, _ in endpoint.transport.sent]
+
+    sent = run(main())
+    seqs = [net.DGRAM_SEQ.unpack_from(data)[0] for data in sent]
+    assert sorted(seqs) == [0] * net.DatagramPeer.STOP_COPIES + [1]
+
+
+def test_blocked_address_makes_no_peers():
+    async def main():
+        peers = []
+        endpoint = net.DatagramEndpoint(
+            None, log, on_peer=peers.append, peer_timeout=None, block_time=60
+        )
+        endpoint.connection_made(FakeTransport())
+        addr = ("127.0.0.1", 9)
+
+        endpoint.datagram_received(datagram(1, ping=1), addr)
+        peers[0].reject()
+        for seq in range(2, 12):
+            endpoint.datagram_received(datagram(seq, ping=1), addr)
+        return endpoint, peers
+
+    endpoint, peers = run(main())
+    assert len(peers) == 1
+    assert endpoint.blocked == 10
+    assert not endpoint.peers
+
+
+def test_lossy_link():
+    args = lossy_udp.parse_args(["--count", "600", "--rate", "1000", "--seed", "1"])
+    assert run(lossy_udp.run(args)) == []
@@ -0,0 +1,109 @@
+"""HandlerTable and Dispatcher."""
+
+import logging
+
+import sissyBot.net as net
+from sissyBot.proto import packet_pb2
+
+PING, DRIVE, DRIVE_STOP = 1, 2, 3
+
+
+def handler(frame, writer):
+    pass
+
+
+class Batched:
+    def __init__(self):
+        self.batches = []
+
+    def __call__(self, frame, writer):
+        self.batches.append([frame])
+
+    def handle_batch(self, frames, writer):
+        self.batches.append(list(frames))
+
+
+def numbers(table):
+    return {number: entry[1] for number, entry in table.by_number.items()}
+
+
+def test_frame_types():
+    assert net.FRAME_TYPES == {PING: "ping", DRIVE: "drive", DRIVE_STOP: "drive_stop"}
+
+
+def test_by_number_follows_every_change():
+    table = net.HandlerTable(ping=handler)
+    assert numbers(table) == {PING: handler}
+
+    table["drive"] = handler
+    assert numbers(table) == {PING: handler, DRIVE: handler}
+    del table["ping"]
+    assert numbers(table) == {DRIVE: handler}
+
+    table.update(drive_stop=handler)
+    assert numbers(table) == {DRIVE: handler, DRIVE_STOP: handler}
+    other = Batched()
+    table |= {"drive": other}
+    assert numbers(table) == {DRIVE: other, DRIVE_STOP: handler}
+
+    table.setdefault("ping", handler)
+    assert numbers(table) == {PING: handler, DRIVE: other, DRIVE_STOP: handler}
+    assert table.pop("drive") is other
+    assert numbers(table) == {PING: handler, DRIVE_STOP: handler}
+    assert table.pop("drive", None) is None
+
+    table.popitem()
+    assert len(table.by_number) == 1
+    table.clear()
+    assert table.by_number == {}
+
+
+def test_unknown_names_are_ignored():
+    table = net.HandlerTable(not_a_frame=handler)
+    assert table.by_number == {}
+
+
+def test_batch_handlers_are_found():
+    batched = Batched()
+    table = net.HandlerTable(drive=batched, ping=handler)
+
+    assert table.by_number[DRIVE] == (batched.handle_batch, batched)
+    assert table.by_number[PING] == (None, handler)
+
+
+def packet(kind, heading=0):
+    pkt = packet_pb2.Packet()
+    if kind == "drive":
+        pkt.drive.heading = heading
+    else:
+        getattr(pkt, kind).SetInParent()
+    return pkt.SerializeToString()
+
+
+def test_dispatch_hands_out_runs():
+    dispatcher = net.Dispatcher(logging.getLogger("test"), metrics=net.FrameMetrics())
+    drives = Batched()
+    pings = []
+    dispatcher.handlers["drive"] = drives
+    dispatcher.handlers["ping"] = lambda frame, writer: pings.append(frame)
+
+    pkts = [packet("drive", 1), packet("drive", 2), packet("ping")]
+    pkts += [packet("drive", 3), packet("drive_stop"), packet("drive_stop")]
+    assert dispatcher.dispatch(pkts, None) == 6
+
+    assert [[frame.heading for frame in run] for run in drives.batches] == [[1, 2], [3]]
+    assert len(pings) == 1
+    assert dispatcher.unhandled == {DRIVE_STOP: 2}
+    assert dispatcher.metrics.frames() == {DRIVE: 3, PING: 1}
+    assert dispatcher.metrics.unhandled == 2
+
+
+def test_dispatch_sees_handler_changes():
+    dispatcher = net.Dispatcher(logging.getLogger("test"))
+    stops = []
+    dispatcher.dispatch([packet("drive_stop")], None)
+    dispatcher.handlers["drive_stop"] = lambda frame, writer: stops.append(frame)
+    dispatcher.dispatch([packet("drive_stop")], None)
+
+    assert len(stops) == 1
+    assert dispatcher.unhandled == {DRIVE_STOP: 1}
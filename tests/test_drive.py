@@ -0,0 +1,116 @@
+"""robot.Drive rate limiting and deadband."""
+
+import math
+
+import pytest
+
+import sissyBot.robot as robot
+from sissyBot.proto import drive_pb2
+
+
+class Publisher:
+    def __init__(self):
+        self.sent = []
+
+    def publish(self, subject, payload):
+        if subject == "drive.cmd":
+            cmd = drive_pb2.DriveCmd.FromString(payload)
+            self.sent.append((cmd.heading_delta, round(cmd.throttle, 3)))
+        else:
+            self.sent.append(subject)
+
+
+class Event:
+    def __init__(self, callback, timeout):
+        self.callback = callback
+        self.timeout = timeout
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class Clock:
+    """Stands in for both time.monotonic and kivy's Clock."""
+
+    def __init__(self):
+        self.now = 100.0
+        self.events = []
+
+    def monotonic(self):
+        return self.now
+
+    def schedule_once(self, callback, timeout=0):
+        event = Event(callback, timeout)
+        self.events.append(event)
+        return event
+
+    def advance(self, secs):
+        self.now += secs
+        due = [event for event in self.events if not event.cancelled]
+        self.events = []
+        for event in due:
+            event.callback(secs)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(robot.time, "monotonic", clock.monotonic)
+    monkeypatch.setattr(robot.kivy.clock, "Clock", clock)
+    return clock
+
+
+def make_drive(**kwargs):
+    publisher = Publisher()
+    return robot.Drive(publisher, **kwargs), publisher.sent
+
+
+def test_deadband(clock):
+    drive, sent = make_drive(max_rate=0)
+    drive.cmd(math.radians(10), 0.5)
+    drive.cmd(math.radians(11), 0.51)
+    drive.cmd(math.radians(13), 0.5)
+    drive.cmd(math.radians(13), 0.6)
+
+    assert sent == [(10, 0.5), (13, 0.5), (13, 0.6)]
+    assert drive.stats() == {"sent": 3, "suppressed": 1}
+
+
+def test_deadband_wraps_heading(clock):
+    drive, sent = make_drive(max_rate=0)
+    drive.cmd(math.radians(359), 0.5)
+    drive.cmd(math.radians(0.5), 0.5)
+    assert sent == [(359, 0.5)]
+
+
+def test_rate_limit_sends_the_latest_on_the_trailing_edge(clock):
+    drive, sent = make_drive(max_rate=10)
+    drive.cmd(math.radians(10), 0.1)
+    for throttle in (0.2, 0.3, 0.4):
+        clock.now += 0.01
+        drive.cmd(math.radians(10), throttle)
+
+    assert sent == [(10, 0.1)]
+    assert len(clock.events) == 1
+    assert clock.events[0].timeout == pytest.approx(0.09)
+
+    clock.advance(0.09)
+    assert sent == [(10, 0.1), (10, 0.4)]
+    assert drive.stats() == {"sent": 2, "suppressed": 2}
+
+
+def test_stop_is_sent_at_once_and_cancels_the_pending_command(clock):
+    drive, sent = make_drive(max_rate=10)
+    drive.cmd(math.radians(10), 0.5)
+    clock.now += 0.01
+    drive.cmd(math.radians(10), 0.9)
+    drive.stop()
+
+    assert sent == [(10, 0.5), "drive.all_stop"]
+    clock.advance(0.1)
+    assert sent == [(10, 0.5), "drive.all_stop"]
+
+    # the same command as before the stop still goes out
+    drive.cmd(math.radians(10), 0.5)
+    assert sent[-1] == (10, 0.5)
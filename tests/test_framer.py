@@ -0,0 +1,141 @@
+"""net.Framer and the length headers it reads."""
+
+import random
+
+import pytest
+
+import sissyBot.errors as errors
+import sissyBot.net as net
+
+HEADERS = [
+    net.FRAMINGS[net.FRAMING_BYTE],
+    net.FRAMINGS[net.FRAMING_VARINT],
+    net.FRAMINGS[net.FRAMING_U32],
+]
+
+
+def payloads(count=200, max_len=255):
+    rand = random.Random(1)
+    return [rand.randbytes(rand.randint(1, max_len)) for _ in range(count)]
+
+
+def stream(frames, header):
+    return b"".join(net.insert_pkt_len(frame, header) for frame in frames)
+
+
+def read_all(framer, chunks, use_get_buffer=False):
+    got = []
+    for chunk in chunks:
+        if use_get_buffer:
+            framer.get_buffer(len(chunk))[: len(chunk)] = chunk
+            framer.buffer_updated(len(chunk))
+        else:
+            framer.feed(chunk)
+        # frames are views into the buffer, only good until the next read
+        got.extend(bytes(frame) for frame in framer.frames())
+    return got
+
+
+@pytest.mark.parametrize("header", HEADERS)
+def test_one_byte_at_a_time(header):
+    frames = payloads(50)
+    data = stream(frames, header)
+
+    framer = net.Framer(header=header)
+    assert read_all(framer, [data[i : i + 1] for i in range(len(data))]) == frames
+    assert len(framer) == 0
+
+
+@pytest.mark.parametrize("header", HEADERS)
+@pytest.mark.parametrize("use_get_buffer", [False, True])
+def test_random_splits(header, use_get_buffer):
+    frames = payloads()
+    data = stream(frames, header)
+
+    rand = random.Random(2)
+    chunks = []
+    pos = 0
+    while pos < len(data):
+        size = rand.randint(1, 700)
+        chunks.append(data[pos : pos + size])
+        pos += size
+
+    # small, so the buffer is compacted and grown along the way
+    framer = net.Framer(size=512, min_free=64, header=header)
+    assert read_all(framer, chunks, use_get_buffer) == frames
+
+
+def test_partial_frame_waits_for_the_rest():
+    data = net.insert_pkt_len(b"hello world")
+    framer = net.Framer()
+
+    framer.feed(data[:1])
+    assert list(framer.frames()) == []
+    framer.feed(data[1:5])
+    assert list(framer.frames()) == []
+    assert len(framer) == 5
+
+    framer.feed(data[5:])
+    assert [bytes(frame) for frame in framer.frames()] == [b"hello world"]
+
+
+def test_partial_varint_header_waits():
+    header = net.FRAMINGS[net.FRAMING_VARINT]
+    data = net.insert_pkt_len(bytes(300), header)
+    assert len(header.encode(300)) == 2
+
+    framer = net.Framer(header=header)
+    framer.feed(data[:1])
+    assert list(framer.frames()) == []
+    framer.feed(data[1:])
+    assert [len(frame) for frame in framer.frames()] == [300]
+
+
+@pytest.mark.parametrize("header", HEADERS)
+def test_zero_length_frame_raises(header):
+    framer = net.Framer(header=header)
+    framer.feed(net.insert_pkt_len(b"ok", header) + header.encode(0))
+
+    frames = framer.frames()
+    assert bytes(next(frames)) == b"ok"
+    with pytest.raises(errors.BadStreamError):
+        next(frames)
+
+
+def test_buffer_limit_raises():
+    framer = net.Framer(size=64, min_free=16, max_size=128)
+    framer.feed(bytes([200]) + bytes(100))
+    with pytest.raises(errors.BadStreamError):
+        framer.feed(bytes(100))
+
+
+@pytest.mark.parametrize("header", HEADERS)
+@pytest.mark.parametrize("len_", [1, 2, 127, 128, 200, 255])
+def test_header_round_trip(header, len_):
+    encoded = header.encode(len_)
+    data = b"\xaa" + encoded + b"\xbb"
+
+    assert header.decode(data, 1, 1 + len(encoded)) == (len_, 1 + len(encoded))
+    # one byte short is not enough
+    assert header.decode(data, 1, len(encoded)) is None
+
+
+@pytest.mark.parametrize("len_", [256, 300, 16383, 16384, 1 << 20, (1 << 32) - 1])
+def test_wide_header_round_trip(len_):
+    for header in HEADERS[1:]:
+        encoded = header.encode(len_)
+        assert header.decode(encoded, 0, len(encoded)) == (len_, len(encoded))
+
+
+def test_varint_widths():
+    header = net.FRAMINGS[net.FRAMING_VARINT]
+    assert header.encode(127) == b"\x7f"
+    assert header.encode(128) == b"\x80\x01"
+    assert header.encode(300) == b"\xac\x02"
+
+
+def test_overlong_varint_raises():
+    header = net.FRAMINGS[net.FRAMING_VARINT]
+    data = b"\xff" * header.MAX_WIDTH
+    with pytest.raises(errors.BadStreamError):
+        header.decode(data, 0, len(data))
@@ -0,0 +1,141 @@
+"""The framing handshake, on both ends."""
+
+import asyncio
+
+import pytest
+
+import sissyBot.errors as errors
+import sissyBot.net as net
+
+HOST = "127.0.0.1"
+
+
+def accept(data):
+    framer = net.Framer()
+    framer.feed(data)
+    return framer, framer.accept_handshake()
+
+
+def test_accept_varint():
+    framer, reply = accept(bytes([net.HANDSHAKE, net.FRAMING_VARINT]))
+    assert reply == bytes([net.HANDSHAKE, net.FRAMING_VARINT])
+    assert framer.header is net.FRAMINGS[net.FRAMING_VARINT]
+    assert framer.features == 0
+
+
+def test_accept_features():
+    mode = net.FRAMING_U32 | net.FEATURE_PACKED
+    framer, reply = accept(
+        bytes([net.HANDSHAKE, mode]) + net.FRAMINGS[net.FRAMING_U32].encode(2)
+    )
+    assert reply == bytes([net.HANDSHAKE, mode])
+    assert framer.header is net.FRAMINGS[net.FRAMING_U32]
+    assert framer.features == net.FEATURE_PACKED
+    # the handshake is consumed, the frame header after it is left
+    assert len(framer) == 4
+
+
+def test_accept_legacy_client():
+    framer, reply = accept(net.insert_pkt_len(b"drive"))
+    assert reply == b""
+    assert framer.header is net.FRAMINGS[net.FRAMING_BYTE]
+    assert [bytes(frame) for frame in framer.frames()] == [b"drive"]
+
+
+def test_accept_waits_for_mode():
+    framer, reply = accept(bytes([net.HANDSHAKE]))
+    assert reply is None
+    framer.feed(bytes([net.FRAMING_VARINT]))
+    assert framer.accept_handshake() == bytes([net.HANDSHAKE, net.FRAMING_VARINT])
+
+
+def test_accept_unknown_mode():
+    with pytest.raises(errors.BadStreamError):
+        accept(bytes([net.HANDSHAKE, 0x7F]))
+
+
+async def serve(handler):
+    server = await asyncio.start_server(handler, HOST, 0)
+    return server, server.sockets[0].getsockname()[1]
+
+
+async def negotiate(reader, writer):
+    """A current server: answers the handshake, then echoes one frame."""
+    framer = net.Framer()
+    reply = None
+    while reply is None:
+        framer.feed(await reader.read(64))
+        reply = framer.accept_handshake()
+    writer.write(reply)
+    while not (frames := [bytes(frame) for frame in framer.frames()]):
+        framer.feed(await reader.read(64))
+    writer.write(net.insert_pkt_len(frames[0], framer.header))
+    await writer.drain()
+    writer.close()
+
+
+def test_open_connection_negotiates():
+    async def run():
+        server, port = await serve(negotiate)
+        async with server:
+            reader, writer, header, features = await net.open_connection(
+                HOST, port, net.FRAMING_VARINT, net.FEATURE_PACKED
+            )
+            assert header is net.FRAMINGS[net.FRAMING_VARINT]
+            assert features == net.FEATURE_PACKED
+
+            writer.write(net.insert_pkt_len(bytes(200), header))
+            echo = await reader.readexactly(202)
+            assert echo == header.encode(200) + bytes(200)
+            writer.close()
+
+    asyncio.run(run())
+
+
+def test_open_connection_falls_back():
+    """A server from before the handshake drops the connection on seeing it."""
+    received = []
+
+    async def legacy(reader, writer):
+        data = await reader.read(64)
+        if data[:1] == bytes([net.HANDSHAKE]):
+            writer.close()
+            return
+        while data:
+            received.append(data)
+            data = await reader.read(64)
+        writer.close()
+
+    async def run():
+        server, port = await serve(legacy)
+        async with server:
+            reader, writer, header, features = await net.open_connection(
+                HOST, port, net.FRAMING_VARINT, net.FEATURE_PACKED
+            )
+            assert header is net.FRAMINGS[net.FRAMING_BYTE]
+            assert features == 0
+
+            writer.write(net.insert_pkt_len(b"drive", header))
+            await writer.drain()
+            writer.close()
+            await writer.wait_closed()
+            await asyncio.sleep(0.05)
+
+    asyncio.run(run())
+    assert b"".join(received) == net.insert_pkt_len(b"drive")
+
+
+def test_open_connection_refused_mode():
+    async def wrong_mode(reader, writer):
+        await reader.read(64)
+        writer.write(bytes([net.HANDSHAKE, net.FRAMING_U32]))
+        await writer.drain()
+        writer.close()
+
+    async def run():
+        server, port = await serve(wrong_mode)
+        async with server:
+            with pytest.raises(errors.BadStreamError):
+                await net.open_connection(HOST, port, net.FRAMING_VARINT)
+
+    asyncio.run(run())
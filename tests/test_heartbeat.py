@@ -0,0 +1,76 @@
+"""Heartbeat sender and monitor."""
+
+import asyncio
+
+import sissyBot.heartbeat as heartbeat
+from bench import heartbeat_watchdog
+
+
+class Ping:
+    def __init__(self, time):
+        self.time = time
+
+
+def test_elapsed_wraps(monkeypatch):
+    monkeypatch.setattr(heartbeat, "now_ms", lambda: 5)
+    assert heartbeat.elapsed_ms(heartbeat.TIME_MASK - 4) == 10
+
+
+def test_monitor_echoes_the_stamp():
+    sent = []
+    monitor = heartbeat.HeartbeatMonitor(sent.append, on_timeout=None)
+    monitor(Ping(1234), None)
+    monitor(Ping(1334), None)
+
+    assert [pkt.ping.time for pkt in sent] == [1234, 1334]
+    assert monitor.received == 2
+    assert len(monitor.gaps) == 1
+
+
+def test_sender_measures_rtt_from_the_echo():
+    sender = heartbeat.HeartbeatSender(None)
+    sender.handle_echo(Ping(heartbeat.now_ms() - 20), None)
+    sender.handle_echo(Ping(heartbeat.now_ms() - 30), None)
+
+    stats = sender.stats()
+    assert stats["received"] == 2
+    assert 0.02 <= stats["rtt_p50"] < 0.05
+    assert sender.last_echo is not None
+
+
+def test_monitor_stops_once_per_outage():
+    timeouts = []
+
+    async def run():
+        monitor = heartbeat.HeartbeatMonitor(
+            lambda pkt: None, lambda: timeouts.append(1), deadline=0.05
+        )
+        stop_event = asyncio.Event()
+        task = asyncio.create_task(monitor.run(stop_event))
+
+        # nothing happens for a client that never sent a heartbeat
+        await asyncio.sleep(0.15)
+        assert timeouts == []
+
+        monitor(Ping(0), None)
+        await asyncio.sleep(0.2)
+        assert timeouts == [1]
+
+        # back, then gone again
+        monitor(Ping(0), None)
+        await asyncio.sleep(0.02)
+        assert timeouts == [1]
+        await asyncio.sleep(0.2)
+        assert timeouts == [1, 1]
+
+        stop_event.set()
+        await task
+        return monitor
+
+    monitor = asyncio.run(run())
+    assert monitor.timeouts == 2
+
+
+def test_watchdog_stops_the_motors():
+    args = heartbeat_watchdog.parse_args(["--outage", "1.5"])
+    assert asyncio.run(heartbeat_watchdog.run(args)) == []
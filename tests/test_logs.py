@@ -0,0 +1,40 @@
+"""logs.RateLimit and level specs."""
+
+import logging
+
+import pytest
+
+import sissyBot.logs as logs
+
+
+def record(level, msg="tick"):
+    return logging.LogRecord("motors", level, __file__, 1, msg, None, None)
+
+
+def test_rate_limit_drops_debug_past_the_burst():
+    limit = logs.RateLimit(rate=1.0, burst=3)
+
+    passed = [limit.filter(record(logging.DEBUG)) for _ in range(10)]
+
+    assert passed.count(True) == 3
+    assert limit.dropped == 7
+
+
+def test_rate_limit_never_drops_info_and_above():
+    limit = logs.RateLimit(rate=1.0, burst=1)
+    for _ in range(10):
+        limit.filter(record(logging.DEBUG))
+
+    for level in (logging.INFO, logging.WARNING, logging.ERROR):
+        stop = record(level, "ALL STOP")
+        assert limit.filter(stop)
+        assert stop.msg == "ALL STOP"
+
+
+def test_parse_levels():
+    assert logs.parse_levels("info, motors=debug") == {
+        None: logging.INFO,
+        "motors": logging.DEBUG,
+    }
+    with pytest.raises(ValueError):
+        logs.parse_levels("loud")
@@ -0,0 +1,58 @@
+"""Event loop selection."""
+
+import asyncio
+import builtins
+import logging
+
+import pytest
+
+import sissyBot.loops as loops
+
+
+async def loop_type():
+    return type(asyncio.get_running_loop()).__module__
+
+
+def test_asyncio_is_the_default(monkeypatch):
+    monkeypatch.delenv(loops.ENV_VAR, raising=False)
+    assert loops.loop_factory() is None
+    assert loops.run(loop_type()).startswith("asyncio")
+
+
+def test_env_var(monkeypatch):
+    pytest.importorskip("uvloop")
+    monkeypatch.setenv(loops.ENV_VAR, "uvloop")
+    assert loops.run(loop_type()).startswith("uvloop")
+    # an explicit choice wins
+    assert loops.run(loop_type(), "asyncio").startswith("asyncio")
+
+
+@pytest.mark.parametrize("name", ["uvloop", "auto"])
+def test_uvloop(name):
+    pytest.importorskip("uvloop")
+    loop = loops.new_event_loop(name)
+    try:
+        assert type(loop).__module__.startswith("uvloop")
+    finally:
+        loop.close()
+
+
+def test_unknown_loop():
+    with pytest.raises(ValueError):
+        loops.loop_factory("trio")
+
+
+def test_falls_back_without_uvloop(monkeypatch, caplog):
+    real_import = builtins.__import__
+
+    def no_uvloop(name, *args, **kwargs):
+        if name == "uvloop":
+            raise ImportError(name)
+        return real_import(name, *args, **kwargs)
+
+    monkeypatch.setattr(builtins, "__import__", no_uvloop)
+    with caplog.at_level(logging.WARNING, logger="loops"):
+        assert loops.loop_factory("auto") is None
+        assert not caplog.records
+        assert loops.loop_factory("uvloop") is None
+    assert len(caplog.records) == 1
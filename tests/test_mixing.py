@@ -0,0 +1,56 @@
+"""mixing.Mixer's lookup tables against the scalar server.motor_calc."""
+
+import random
+from dataclasses import dataclass
+
+import pytest
+
+import sissyBot.mixing as mixing
+import sissyBot.server as server
+
+TOLERANCE = 1e-5
+
+
+@dataclass
+class Drive:
+    heading: int
+    throttle: float
+
+
+def make_drives(count=10_000):
+    rand = random.Random(1)
+    drives = [Drive(rand.randint(-180, 180), rand.random()) for _ in range(count)]
+    # every whole heading, at full and no throttle
+    drives += [Drive(h, t) for h in range(-360, 361) for t in (0.0, 1.0)]
+    return drives
+
+
+def worst_error(expected, got):
+    return max(
+        abs(a - b) for pair, other in zip(expected, got) for a, b in zip(pair, other)
+    )
+
+
+def test_table_matches_motor_calc():
+    mixer = mixing.Mixer()
+    drives = make_drives()
+
+    expected = [server.motor_calc(drive) for drive in drives]
+    got = [mixer.motor_calc(drive) for drive in drives]
+
+    assert worst_error(expected, got) <= TOLERANCE
+
+
+def test_batch_matches_motor_calc():
+    np = pytest.importorskip("numpy")
+
+    mixer = mixing.Mixer()
+    drives = make_drives()
+
+    l_out, r_out = mixer.motor_calc_batch(
+        [d.heading for d in drives], [d.throttle for d in drives]
+    )
+    expected = np.array([server.motor_calc(d) for d in drives])
+
+    assert np.max(np.abs(expected[:, 0] - l_out)) <= TOLERANCE
+    assert np.max(np.abs(expected[:, 1] - r_out)) <= TOLERANCE
@@ -0,0 +1,185 @@
+"""ManagedConnection's buffering while down and reconnecting."""
+
+import asyncio
+import socket
+
+import nats.aio.client
+
+from sissyBot.nats_conn import ManagedConnection, SubBatcher
+from sissyBot.nats_proc import ConnState
+
+
+class FakeNats:
+    is_connected = True
+
+    def __init__(self):
+        self.published = []
+
+    async def publish(self, subject, payload):
+        self.published.append((subject, payload))
+
+
+def make_conn(addr="127.0.0.1:1", **kwargs):
+    statuses = []
+    conn = ManagedConnection(addr, statuses.append, SubBatcher(print), **kwargs)
+    return conn, statuses
+
+
+def test_buffer_keeps_only_the_newest_drive():
+    conn, _ = make_conn()
+    for payload in (b"1", b"2", b"3"):
+        conn._buffer("drive.cmd", payload)
+    conn._buffer("other", b"x")
+    conn._buffer("drive.cmd", b"4")
+
+    assert [msg[:2] for msg in conn.buffer] == [("other", b"x"), ("drive.cmd", b"4")]
+    assert conn.dropped == 3
+
+
+def test_buffer_limit_never_drops_a_stop():
+    conn, _ = make_conn(max_buffered=2)
+    conn._buffer("drive.all_stop", b"stop")
+    for payload in (b"1", b"2", b"3"):
+        conn._buffer("other", payload)
+    assert [msg[1] for msg in conn.buffer] == [b"stop", b"3"]
+
+    conn._buffer("drive.all_stop", b"stop2")
+    conn._buffer("drive.all_stop", b"stop3")
+    assert [msg[1] for msg in conn.buffer] == [b"stop", b"stop2", b"stop3"]
+    assert conn.dropped == 3
+
+
+def test_stale_drive_is_not_sent_on_reconnect():
+    async def run():
+        conn, _ = make_conn(max_latest_age=0.3)
+        conn._buffer("drive.all_stop", b"stop")
+        conn._buffer("drive.cmd", b"old")
+        conn.buffer[-1] = (*conn.buffer[-1][:2], conn.buffer[-1][2] - 1.0)
+
+        conn.nc = FakeNats()
+        await conn._flush_buffer()
+        return conn
+
+    conn = asyncio.run(run())
+    assert conn.nc.published == [("drive.all_stop", b"stop")]
+    assert (conn.published, conn.dropped) == (1, 1)
+
+
+def test_publish_while_down_reports_at_most_every_interval():
+    async def run():
+        conn, statuses = make_conn()
+        for _ in range(50):
+            await conn.publish("other", b"x")
+        return conn, statuses
+
+    conn, statuses = asyncio.run(run())
+    assert len(conn.buffer) == 50
+    assert len(statuses) == 1
+    assert statuses[0].state == ConnState.RECONNECTING
+    assert statuses[0].buffered == 1
+
+
+def test_keeps_trying_with_backoff():
+    # a port nobody listens on
+    sock = socket.socket()
+    sock.bind(("127.0.0.1", 0))
+    port = sock.getsockname()[1]
+    sock.close()
+
+    async def run():
+        conn, statuses = make_conn(f"127.0.0.1:{port}", min_backoff=0.01)
+        task = asyncio.create_task(conn.run())
+        await asyncio.sleep(0.5)
+        task.cancel()
+        return statuses
+
+    statuses = asyncio.run(run())
+    assert len(statuses) >= 3
+    assert {status.state for status in statuses} == {ConnState.RECONNECTING}
+
+
+class CuttableProxy:
+    """Forwards TCP to `port`, cut() drops every connection through it."""
+
+    def __init__(self, port):
+        self.port = port
+        self.writers = []
+
+    async def __call__(self, reader, writer):
+        up_reader, up_writer = await asyncio.open_connection("127.0.0.1", self.port)
+        self.writers += [writer, up_writer]
+        await asyncio.gather(
+            self._pump(reader, up_writer),
+            self._pump(up_reader, writer),
+            return_exceptions=True,
+        )
+
+    async def _pump(self, reader, writer):
+        while data := await reader.read(65536):
+            writer.write(data)
+            await writer.drain()
+        writer.close()
+
+    def cut(self):
+        for writer in self.writers:
+            writer.transport.abort()
+        self.writers = []
+
+
+async def wait_state(statuses, state, after=0, timeout=5):
+    for _ in range(int(timeout / 0.01)):
+        if any(status.state == state for status in statuses[after:]):
+            return
+        await asyncio.sleep(0.01)
+    raise AssertionError(f"never got {state}")
+
+
+def test_reconnects_and_sends_what_was_buffered(nats_addr):
+    host, port = nats_addr.split(":")
+
+    async def run():
+        proxy = CuttableProxy(int(port))
+        server = await asyncio.start_server(proxy, "127.0.0.1", 0)
+        proxy_port = server.sockets[0].getsockname()[1]
+
+        watcher = nats.aio.client.Client()
+        await watcher.connect(nats_addr)
+        got = []
+        subject = f"test.reconnect.{proxy_port}"
+
+        async def on_msg(msg):
+            got.append(msg.data)
+
+        await watcher.subscribe(subject, cb=on_msg)
+
+        conn, statuses = make_conn(f"127.0.0.1:{proxy_port}", min_backoff=0.01)
+        task = asyncio.create_task(conn.run())
+        try:
+            await wait_state(statuses, ConnState.UP)
+            await conn.publish(subject, b"before")
+            await conn.nc.flush()
+
+            # hold new connections off until the publishes are buffered
+            server.close()
+            proxy.cut()
+            down = len(statuses)
+            await wait_state(statuses, ConnState.RECONNECTING, down)
+            await conn.publish(subject, b"during")
+            await conn.publish("drive.all_stop", b"")
+            assert len(conn.buffer) == 2
+
+            server = await asyncio.start_server(proxy, "127.0.0.1", proxy_port)
+            await wait_state(statuses, ConnState.UP, down)
+            await watcher.flush()
+            await asyncio.sleep(0.1)
+
+            assert got == [b"before", b"during"]
+            assert not conn.buffer
+            assert conn.reconnect_time is not None
+        finally:
+            await conn.close()
+            task.cancel()
+            await watcher.close()
+            server.close()
+
+    asyncio.run(run())
@@ -0,0 +1,41 @@
+"""NatsThread, the in-process NATS backend, against a real server."""
+
+import queue
+import uuid
+
+from sissyBot.nats_proc import ConnState, NatsThread
+
+
+def wait_state(statuses, state, timeout=5):
+    while True:
+        status = statuses.get(timeout=timeout)
+        if status.state == state:
+            return status
+
+
+def test_publish_and_subscribe(nats_addr):
+    statuses = queue.Queue()
+    msgs = queue.Queue()
+    subject = f"test.{uuid.uuid4().hex}"
+
+    nats = NatsThread(statuses.put, msgs.put)
+    # commands given before the connection is made wait for it
+    nats.subscribe(1, subject)
+    nats.connect(nats_addr)
+    try:
+        wait_state(statuses, ConnState.UP)
+        assert nats.is_alive()
+
+        for i in range(3):
+            nats.publish(subject, b"%d" % i)
+
+        records = []
+        while len(records) < 3:
+            records += msgs.get(timeout=5)
+        assert records == [(1, subject, b"0"), (1, subject, b"1"), (1, subject, b"2")]
+        assert nats.sent == 3
+    finally:
+        nats.close()
+
+    assert not nats.is_alive()
+    wait_state(statuses, ConnState.DOWN)
@@ -0,0 +1,51 @@
+"""Packed drive frames."""
+
+import pytest
+from google.protobuf.message import DecodeError
+
+import sissyBot.net as net
+import sissyBot.packed as packed
+
+
+def test_round_trip():
+    buff = packed.pack_drive(-90, 0.25)
+    assert len(buff) == packed.DRIVE.size == 9
+    assert packed.unpack_drive(buff) == packed.PackedDrive(-90, 0.25)
+
+
+def test_smaller_than_protobuf():
+    proto = net.encode_drive(359, 0.75)
+    assert len(packed.pack_drive(359, 0.75)) < len(proto)
+
+
+@pytest.mark.parametrize("features", [0, net.FEATURE_PACKED])
+def test_decode_either_kind(features):
+    number, frame = net.decode(net.encode_drive(123, 0.5, features))
+    assert number == net.DRIVE_NUMBER
+    assert (frame.heading, frame.throttle) == (123, 0.5)
+
+
+def test_decode_from_a_view():
+    buff = memoryview(b"\xff" + packed.pack_drive(7, -1.0))
+    number, frame = net.decode(buff[1:])
+    assert (number, frame) == (net.DRIVE_NUMBER, (7, -1.0))
+
+
+def test_truncated_frame_is_a_decode_error():
+    with pytest.raises(DecodeError):
+        net.decode(packed.pack_drive(1, 1.0)[:-1])
+
+
+def test_packed_and_protobuf_share_a_stream():
+    framer = net.Framer(header=net.FRAMINGS[net.FRAMING_VARINT])
+    header = framer.header
+    for features in (net.FEATURE_PACKED, 0, net.FEATURE_PACKED):
+        framer.feed(net.insert_pkt_len(net.encode_drive(5, 0.5, features), header))
+
+    frames = [net.decode(frame) for frame in framer.frames()]
+    assert [number for number, _ in frames] == [net.DRIVE_NUMBER] * 3
+    assert [type(frame) is packed.PackedDrive for _, frame in frames] == [
+        True,
+        False,
+        True,
+    ]
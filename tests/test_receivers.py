@@ -0,0 +1,119 @@
+"""Both receivers, PacketProcessor and PacketProtocol, behind ConnectionManager."""
+
+import asyncio
+import socket
+import struct
+import time
+
+import pytest
+
+import sissyBot.net as net
+import sissyBot.server as server
+
+HOST = "127.0.0.1"
+
+
+async def start(receiver, **kwargs):
+    stop_event = asyncio.Event()
+    drive = server.DriveCoalescer(on_drive=None, on_stop=lambda frame, writer: None)
+    manager = server.ConnectionManager(drive, stop_event, **kwargs)
+    if receiver == "protocol":
+        sbs = await asyncio.get_running_loop().create_server(manager.protocol, HOST, 0)
+    else:
+        sbs = await asyncio.start_server(manager, HOST, 0)
+    return manager, sbs, sbs.sockets[0].getsockname()[1]
+
+
+async def stop(manager, sbs):
+    manager.stop_event.set()
+    sbs.close()
+    await manager.close()
+
+
+async def settle(check, timeout=5.0):
+    for _ in range(int(timeout / 0.01)):
+        if check():
+            return
+        await asyncio.sleep(0.01)
+    raise AssertionError("timed out")
+
+
+@pytest.mark.parametrize("receiver", ["stream", "protocol"])
+@pytest.mark.parametrize("framing", [net.FRAMING_BYTE, net.FRAMING_VARINT])
+def test_frames_split_across_writes(receiver, framing):
+    async def run():
+        manager, sbs, port = await start(receiver)
+        reader, writer, header, features = await net.open_connection(
+            HOST, port, framing, net.FEATURE_PACKED
+        )
+        data = b"".join(
+            net.insert_pkt_len(net.encode_drive(i % 360, 0.5, features), header)
+            for i in range(500)
+        )
+        # odd sized writes, so frames and headers straddle reads
+        for pos in range(0, len(data), 37):
+            writer.write(data[pos : pos + 37])
+            await writer.drain()
+
+        await settle(lambda: manager.controller and manager.controller.drives == 500)
+        assert manager.drive.take().heading == 499 % 360
+        writer.close()
+        await stop(manager, sbs)
+        return features
+
+    features = asyncio.run(run())
+    assert features == (net.FEATURE_PACKED if framing != net.FRAMING_BYTE else 0)
+
+
+@pytest.mark.parametrize("receiver", ["stream", "protocol"])
+def test_bad_stream_drops_the_client(receiver):
+    async def run():
+        manager, sbs, port = await start(receiver)
+        reader, writer = await asyncio.open_connection(HOST, port)
+        # a zero length frame, after one good one as a lone 0 is the handshake
+        writer.write(net.insert_pkt_len(net.encode_drive(1, 0.5)) + b"\x00")
+        assert await reader.read() == b""
+        writer.close()
+        await settle(lambda: not manager.clients)
+        await stop(manager, sbs)
+
+    asyncio.run(run())
+
+
+@pytest.mark.parametrize("receiver", ["stream", "protocol"])
+def test_frame_rate_limit(receiver):
+    async def run():
+        manager, sbs, port = await start(receiver, frame_rate=400)
+        reader, writer = await asyncio.open_connection(HOST, port)
+        frame = net.insert_pkt_len(net.encode_drive(1, 0.5))
+        start_time = time.monotonic()
+        # a second's worth is free, the 200 beyond it hold off the next read
+        writer.write(frame * 600)
+        await settle(lambda: manager.controller and manager.controller.drives == 600)
+        writer.write(frame)
+        await settle(lambda: manager.controller.drives == 601)
+        took = time.monotonic() - start_time
+        writer.close()
+        await stop(manager, sbs)
+        return took
+
+    assert asyncio.run(run()) >= 0.3
+
+
+@pytest.mark.parametrize("receiver", ["stream", "protocol"])
+def test_reset_connection(receiver, caplog):
+    async def run():
+        manager, sbs, port = await start(receiver)
+        reader, writer = await asyncio.open_connection(HOST, port)
+        writer.write(net.insert_pkt_len(net.encode_drive(1, 0.5)))
+        await settle(lambda: manager.controller and manager.controller.drives == 1)
+
+        # close with an RST rather than a FIN
+        sock = writer.get_extra_info("socket")
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, struct.pack("ii", 1, 0))
+        writer.transport.abort()
+        await settle(lambda: not manager.clients)
+        await stop(manager, sbs)
+
+    asyncio.run(run())
+    assert not [rec for rec in caplog.records if rec.exc_info]
@@ -0,0 +1,88 @@
+"""shm_ring.ShmRing and NatsProc's use of it."""
+
+import pytest
+
+from sissyBot.nats_proc import NatsProc, PubCmd
+from sissyBot.shm_ring import ShmRing
+
+
+@pytest.fixture
+def ring():
+    ring = ShmRing(slots=8, slot_size=64, reserve=2)
+    yield ring
+    ring.close()
+    ring.unlink()
+
+
+def test_wraps_around(ring):
+    sent = [(f"sub.{i}", bytes([i]) * (i % 40)) for i in range(50)]
+    got = []
+    for start in range(0, len(sent), 5):
+        for subject, payload in sent[start : start + 5]:
+            assert ring.put(subject.encode(), payload)
+        got.extend(ring.drain())
+
+    assert got == sent
+
+
+def test_full_ring_keeps_reserved_slots(ring):
+    for _ in range(6):
+        assert ring.put(b"drive.cmd", b"x")
+    assert not ring.put(b"drive.cmd", b"x")
+
+    assert ring.put(b"drive.all_stop", b"", reserved=True)
+    assert ring.put(b"drive.all_stop", b"", reserved=True)
+    assert not ring.put(b"drive.all_stop", b"", reserved=True)
+
+    assert [subject for subject, _ in ring.drain()] == ["drive.cmd"] * 6 + [
+        "drive.all_stop"
+    ] * 2
+    assert ring.put(b"drive.cmd", b"x")
+
+
+def test_doorbell_rings_when_not_empty(ring):
+    ring.put(b"a", b"1")
+    assert ring.doorbell_recv.poll()
+    ring.clear_doorbell()
+
+    # the consumer hasn't caught up, no need to ring again
+    ring.put(b"a", b"2")
+    assert not ring.doorbell_recv.poll()
+
+    list(ring.drain())
+    ring.put(b"a", b"3")
+    assert ring.doorbell_recv.poll()
+
+
+def test_oversized_put_raises(ring):
+    payload = bytes(ring.max_payload(b"sub") + 1)
+    assert not ring.fits(b"sub", payload)
+    with pytest.raises(ValueError):
+        ring.put(b"sub", payload)
+
+
+@pytest.fixture
+def nats_proc():
+    nats_proc = NatsProc(transport="shm")
+    yield nats_proc
+    nats_proc.ring.close()
+    nats_proc.ring.unlink()
+
+
+def test_publish_uses_ring(nats_proc):
+    nats_proc.publish("drive.cmd", b"small")
+
+    assert list(nats_proc.ring.drain()) == [("drive.cmd", b"small")]
+    assert not nats_proc.proc_end.poll()
+
+
+def test_oversized_publish_goes_over_the_pipe(nats_proc):
+    payload = bytes(300)
+    nats_proc.publish("status.blob", payload)
+
+    assert list(nats_proc.ring.drain()) == []
+    assert nats_proc.proc_end.poll(1)
+    cmd = nats_proc.proc_end.recv()
+    assert isinstance(cmd, PubCmd)
+    assert (cmd.subject, cmd.payload) == ("status.blob", payload)
+    assert nats_proc.sent == 1
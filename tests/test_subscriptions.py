@@ -0,0 +1,118 @@
+"""Subscriptions multiplexed over one channel, SubBatcher to SubDispatcher."""
+
+import asyncio
+import time
+import uuid
+
+from sissyBot.nats_conn import SubBatcher
+from sissyBot.nats_proc import NatsProc
+from sissyBot.robot import SubDispatcher
+
+
+class Clock:
+    def __init__(self):
+        self.triggers = 0
+
+    def create_trigger(self, callback):
+        def trigger():
+            self.triggers += 1
+
+        return trigger
+
+
+class Msg:
+    def __init__(self, subject, data):
+        self.subject = subject
+        self.data = data
+
+
+def test_dispatcher_routes_by_sid():
+    clock = Clock()
+    subs = SubDispatcher(clock)
+    got = []
+    a = subs.add("a", lambda subject, payload: got.append(("a", payload)), 8)
+    b = subs.add("b.*", lambda subject, payload: got.append((subject, payload)), 8)
+
+    subs.put_batch([(a.sid, "a", b"1"), (b.sid, "b.x", b"2"), (a.sid, "a", b"3")])
+    assert clock.triggers == 1
+    assert got == []
+
+    subs.deliver(0)
+    assert got == [("a", b"1"), ("a", b"3"), ("b.x", b"2")]
+
+
+def test_dispatcher_drops_the_oldest_beyond_maxlen():
+    subs = SubDispatcher(Clock())
+    got = []
+    sub = subs.add("a", lambda subject, payload: got.append(payload), 2)
+
+    subs.put_batch([(sub.sid, "a", b"%d" % i) for i in range(5)])
+    subs.deliver(0)
+    assert got == [b"3", b"4"]
+    assert sub.dropped == 3
+
+
+def test_dispatcher_ignores_removed_subscriptions():
+    subs = SubDispatcher(Clock())
+    got = []
+    sub = subs.add("a", lambda subject, payload: got.append(payload), 8)
+    assert subs.remove(sub.sid) is sub
+
+    subs.put_batch([(sub.sid, "a", b"late")])
+    subs.deliver(0)
+    assert got == []
+
+
+def test_batcher_sends_one_list_per_loop_turn():
+    sent = []
+
+    async def run():
+        batcher = SubBatcher(sent.append)
+        one = batcher._callback(1)
+        two = batcher._callback(2)
+        await one(Msg("a", b"1"))
+        await two(Msg("b", b"2"))
+        await one(Msg("a", b"3"))
+        await asyncio.sleep(0)
+        await two(Msg("b", b"4"))
+        await asyncio.sleep(0)
+
+    asyncio.run(run())
+    assert sent == [[(1, "a", b"1"), (2, "b", b"2"), (1, "a", b"3")], [(2, "b", b"4")]]
+
+
+def recv_until(recv_end, count, timeout=10):
+    records = []
+    deadline = time.monotonic() + timeout
+    while len(records) < count and recv_end.poll(deadline - time.monotonic()):
+        records += recv_end.recv()
+    return records
+
+
+def test_proc_subscriptions_share_one_pipe(nats_addr):
+    prefix = f"test.{uuid.uuid4().hex}"
+    proc = NatsProc()
+    proc.connect(nats_addr)
+    try:
+        proc.subscribe(1, f"{prefix}.a")
+        proc.subscribe(2, f"{prefix}.*")
+        # commands run in order in the child, so once this comes back both
+        # subscriptions are in place
+        proc.publish(f"{prefix}.ready", b"")
+        assert recv_until(proc.sub_recv_end, 1) == [(2, f"{prefix}.ready", b"")]
+
+        proc.publish(f"{prefix}.a", b"1")
+        proc.publish(f"{prefix}.b", b"2")
+        records = sorted(recv_until(proc.sub_recv_end, 3))
+        assert records == [
+            (1, f"{prefix}.a", b"1"),
+            (2, f"{prefix}.a", b"1"),
+            (2, f"{prefix}.b", b"2"),
+        ]
+
+        proc.unsubscribe(2)
+        proc.publish(f"{prefix}.b", b"3")
+        proc.publish(f"{prefix}.a", b"4")
+        assert recv_until(proc.sub_recv_end, 1) == [(1, f"{prefix}.a", b"4")]
+    finally:
+        proc.close()